@@ -0,0 +1,173 @@
+"""
+Answer-level cache for repeated natural-language queries.
+
+Queries are normalized to an intent plus the tickers and other significant
+words they mention, so "What's AAPL's price?" and "aapl price today" share a
+key. Keys also carry a freshness epoch derived from the market session: while
+the market is open answers expire after a minute, in extended hours after a
+few minutes, and while it is closed they stay valid until the next open.
+Follow-ups that refer back to the conversation ("compare it to MSFT") are
+never served from the cache.
+"""
+
+import asyncio
+import re
+import time
+from datetime import datetime, time as dtime, timedelta, timezone
+from zoneinfo import ZoneInfo
+
+MARKET_TZ = ZoneInfo("America/New_York")
+
+# Words that map to the same intent are interchangeable in a query
+INTENT_SYNONYMS = {
+    "price": "price", "prices": "price", "quote": "price", "trading": "price", "trade": "price",
+    "worth": "price", "cost": "price", "value": "price", "stock": "price", "share": "price",
+    "news": "news", "headlines": "news", "headline": "news", "articles": "news", "stories": "news",
+    "dividend": "dividends", "dividends": "dividends", "payout": "dividends", "yield": "dividends",
+    "split": "splits", "splits": "splits",
+    "details": "details", "info": "details", "information": "details", "about": "details",
+    "profile": "details", "company": "details", "overview": "details",
+    "open": "market_status", "closed": "market_status", "status": "market_status",
+    "close": "previous_close", "closing": "previous_close", "previous": "previous_close",
+    "rsi": "rsi", "sma": "sma", "ema": "ema", "macd": "macd",
+    "performance": "performance", "return": "performance", "returns": "performance",
+    "change": "performance", "gain": "performance", "gains": "performance",
+}
+
+# Filler words and relative dates that the freshness epoch already covers
+STOPWORDS = {
+    "a", "an", "the", "of", "for", "on", "in", "at", "to", "is", "are", "was", "what", "whats",
+    "what's", "how", "much", "many", "me", "show", "tell", "give", "get", "please", "can", "you",
+    "i", "my", "does", "do", "current", "currently", "now", "right", "today", "todays", "latest",
+    "recent", "s", "and", "per", "us", "quick", "check", "look", "up", "find", "pull",
+}
+
+# References to earlier turns make an answer depend on the conversation
+CONTEXT_WORDS = {
+    "it", "its", "that", "this", "these", "those", "they", "them", "their", "above", "again",
+    "same", "previously", "earlier", "instead", "also", "else", "more", "why",
+}
+
+MAX_CACHEABLE_WORDS = 20
+
+
+def normalize_query(text: str) -> str | None:
+    """Normalized cache key for a query, or None if the answer should not be shared"""
+    text = text.lower().replace("’", "'")
+    text = re.sub(r"'s\b", "", text)
+    words = re.findall(r"\$?[a-z0-9][a-z0-9.\-]*", text)
+    if not words or len(words) > MAX_CACHEABLE_WORDS:
+        return None
+    if any(w in CONTEXT_WORDS for w in words):
+        return None
+
+    intents, terms = set(), set()
+    for word in words:
+        word = word.lstrip("$").rstrip(".")
+        if word in STOPWORDS or not word:
+            continue
+        if word in INTENT_SYNONYMS:
+            intents.add(INTENT_SYNONYMS[word])
+        else:
+            terms.add(word)
+    if not terms:
+        return None
+    return f"{'+'.join(sorted(intents)) or 'general'}|{' '.join(sorted(terms))}"
+
+
+def market_phase(now: datetime) -> str:
+    """open, extended (pre/after hours) or closed; exchange holidays count as trading days"""
+    local = now.astimezone(MARKET_TZ)
+    if local.weekday() >= 5:
+        return "closed"
+    t = local.time()
+    if dtime(9, 30) <= t < dtime(16, 0):
+        return "open"
+    if dtime(4, 0) <= t < dtime(20, 0):
+        return "extended"
+    return "closed"
+
+
+def next_session_open(now: datetime) -> datetime:
+    local = now.astimezone(MARKET_TZ)
+    day = local.date()
+    if local.time() >= dtime(9, 30):
+        day += timedelta(days=1)
+    while day.weekday() >= 5:
+        day += timedelta(days=1)
+    return datetime.combine(day, dtime(9, 30), tzinfo=MARKET_TZ)
+
+
+def freshness_epoch(now: datetime, open_ttl: int, extended_ttl: int) -> tuple[str, str, datetime]:
+    """(phase, epoch id, epoch end) for the data-freshness window containing now"""
+    phase = market_phase(now)
+    if phase == "closed":
+        ends = next_session_open(now)
+        return phase, f"closed:{ends.date().isoformat()}", ends
+    ttl = open_ttl if phase == "open" else extended_ttl
+    bucket = int(now.timestamp()) // ttl
+    ends = datetime.fromtimestamp((bucket + 1) * ttl, tz=timezone.utc)
+    # Never let a bucket straddle a phase change (e.g. the opening bell)
+    local = now.astimezone(MARKET_TZ)
+    for boundary in (dtime(4, 0), dtime(9, 30), dtime(16, 0), dtime(20, 0)):
+        edge = datetime.combine(local.date(), boundary, tzinfo=MARKET_TZ)
+        if now < edge < ends:
+            ends = edge
+    return phase, f"{phase}:{bucket}", ends
+
+
+class AnswerCache:
+    """Caches final answers in a shared_state store, keyed by normalized query and freshness epoch"""
+
+    def __init__(self, store, open_ttl=60, extended_ttl=300):
+        self.store = store
+        self.open_ttl = open_ttl
+        self.extended_ttl = extended_ttl
+        self.hits = 0
+        self.misses = 0
+
+    def _key(self, query: str, now: datetime) -> tuple[str | None, str, datetime]:
+        normalized = normalize_query(query)
+        phase, epoch, ends = freshness_epoch(now, self.open_ttl, self.extended_ttl)
+        if normalized is None:
+            return None, phase, ends
+        return f"answer:{epoch}:{normalized}", phase, ends
+
+    async def get(self, query: str) -> dict | None:
+        """Cached response data with staleness metadata, or None"""
+        key, _, _ = self._key(query, datetime.now(timezone.utc))
+        if key is None:
+            return None
+        # The store may be a SQLite file shared by workers; keep its I/O off the event loop
+        entry = await asyncio.to_thread(self.store.get, key)
+        if entry is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        data = dict(entry["data"])
+        data["cache"] = {
+            "hit": True,
+            "cached_at": entry["cached_at"],
+            "age_seconds": round(time.time() - entry["cached_at"], 1),
+            "market_phase": entry["market_phase"],
+            "fresh_until": entry["fresh_until"],
+        }
+        return data
+
+    async def put(self, query: str, data: dict):
+        now = datetime.now(timezone.utc)
+        key, phase, ends = self._key(query, now)
+        if key is None:
+            return
+        ttl = (ends - now).total_seconds()
+        if ttl < 1:
+            return
+        await asyncio.to_thread(self.store.set, key, {
+            "data": data,
+            "cached_at": time.time(),
+            "market_phase": phase,
+            "fresh_until": ends.isoformat(),
+        }, ex=ttl)
+
+    def stats(self) -> dict:
+        return {"hits": self.hits, "misses": self.misses}
@@ -1,52 +1,160 @@
+import time
+_import_started = time.perf_counter()
 import os
+import sys
 import asyncio
+import hashlib
 from datetime import date
+from typing import TYPE_CHECKING
 from fastapi import FastAPI, WebSocket, WebSocketDisconnect
 from starlette.websockets import WebSocketState
 from fastapi.staticfiles import StaticFiles
 from fastapi.templating import Jinja2Templates
-from fastapi.responses import HTMLResponse
+from fastapi.responses import HTMLResponse, JSONResponse
 from fastapi import Request
 from dotenv import load_dotenv
-from pydantic_ai import Agent, RunContext
-from pydantic_ai.mcp import MCPServerStdio
+# Before any project module is imported: custom_mcp_server (which inprocess_tools
+# imports at module level) reads its settings from the environment on import
+load_dotenv()
+from dataclasses import replace
 import json
-import markdown
-import time
-from collections import deque
+import re
+from datetime import datetime
+from zoneinfo import ZoneInfo
+from rate_limiter import RateLimiter
+from shared_state import SharedRateLimiter, create_store
+from answer_cache import AnswerCache
+from model_router import FAST_TIER, STANDARD_TIER, ModelRouter
+from prefetch import HotTickers, Prefetcher
+from tracing import Tracer, current_span
+from session_tasks import AdmissionController, AdmissionRejected, SessionTasks
+from rendering import MarkdownRenderer
+from startup import StartupPipeline
+from watchlist import WatchlistPoller
 
-load_dotenv()
+# pydantic_ai, the MCP client/server packages, custom_mcp_server and markdown are
+# slow to import, so they are loaded by the startup pipeline after the server is up
+# (see "Startup Pipeline" below) and imported inside the functions that use them
+if TYPE_CHECKING:
+    from pydantic_ai import Agent
+    from pydantic_ai.usage import RunUsage
 
-# Rate limiting
-class RateLimiter:
-    def __init__(self, max_requests=5, time_window=60):
-        self.max_requests = max_requests
-        self.time_window = time_window
-        self.requests = deque()
-    
-    async def acquire(self):
-        now = time.time()
-        # Remove old requests outside the time window
-        while self.requests and self.requests[0] < now - self.time_window:
-            self.requests.popleft()
-        
-        if len(self.requests) >= self.max_requests:
-            wait_time = self.requests[0] + self.time_window - now
-            if wait_time > 0:
-                return False, wait_time
-        
-        self.requests.append(now)
-        return True, 0
+# Shared state: with several uvicorn workers, rate-limit counters and cached
+# tool results live in a store every worker can see (a local SQLite file by default)
+WEB_CONCURRENCY = int(os.getenv("WEB_CONCURRENCY", "1"))
+SHARED_STATE_URL = os.getenv(
+    "SHARED_STATE_URL",
+    "sqlite:///.cache/shared_state.sqlite3" if WEB_CONCURRENCY > 1 else ""
+)
+shared_store = create_store(SHARED_STATE_URL)
+
+# Rate limiting: per-client fair queueing plus Anthropic token / Polygon call budgets
+rate_limiter_options = dict(
+    requests_per_minute=float(os.getenv("RATE_LIMIT_REQUESTS_PER_MINUTE", "3")),
+    burst=int(os.getenv("RATE_LIMIT_BURST", "3")),
+    tokens_per_minute=int(os.getenv("RATE_LIMIT_TOKENS_PER_MINUTE", "30000")),
+    global_tokens_per_minute=int(os.getenv("ANTHROPIC_TOKENS_PER_MINUTE", "30000")),
+    polygon_calls_per_minute=int(os.getenv("POLYGON_CALLS_PER_MINUTE", "0")),
+    max_wait=float(os.getenv("RATE_LIMIT_MAX_WAIT", "30")),
+)
+# X-Forwarded-For entries appended by proxies we trust (Railway's edge adds one). Only
+# entries from the right are used: anything further left was sent by the client itself
+TRUSTED_PROXY_HOPS = int(os.getenv("TRUSTED_PROXY_HOPS", "0"))
+if shared_store.shared:
+    rate_limiter = SharedRateLimiter(shared_store, **rate_limiter_options)
+else:
+    rate_limiter = RateLimiter(**rate_limiter_options)
+
+# Repeated questions are answered from cache until the market data could have changed
+answer_cache = AnswerCache(
+    shared_store,
+    open_ttl=int(os.getenv("ANSWER_CACHE_OPEN_TTL", "60")),
+    extended_ttl=int(os.getenv("ANSWER_CACHE_EXTENDED_TTL", "300")),
+) if os.getenv("ANSWER_CACHE_ENABLED", "true").lower() == "true" else None
+
+# Simple lookups run on a fast model and escalate to the standard one when needed
+MODEL_TIERS = {
+    FAST_TIER: os.getenv("FAST_MODEL", "anthropic:claude-haiku-4-5-20251001"),
+    STANDARD_TIER: os.getenv("STANDARD_MODEL", "anthropic:claude-sonnet-4-5-20250929"),
+}
+model_router = ModelRouter(
+    max_fast_tickers=int(os.getenv("ROUTER_MAX_FAST_TICKERS", "2")),
+    fast_request_limit=int(os.getenv("ROUTER_FAST_REQUEST_LIMIT", "4")),
+    log_path=os.getenv("ROUTER_LOG_PATH") or None,
+)
+
+# Most-requested tickers are refreshed in the background so user calls hit a warm cache
+PREFETCH_ENABLED = os.getenv("PREFETCH_ENABLED", "true").lower() == "true"
+hot_tickers = HotTickers()
+prefetcher = None
 
-rate_limiter = RateLimiter(max_requests=3, time_window=60)  # 3 requests per minute
+# Spans per query (model requests, tool calls, Polygon HTTP, rendering, sends) are
+# summarized at /metrics, and written to a JSONL file only if TRACE_LOG_PATH is set
+tracer = Tracer(
+    sink_path=os.getenv("TRACE_LOG_PATH") or None,
+    max_bytes=int(os.getenv("TRACE_LOG_MAX_BYTES", "50000000")),
+)
+
+# Watchlists: one shared poller per worker fetches every subscribed ticker in one
+# batched snapshot call per interval and pushes only changed quotes to subscribers
+WATCHLIST_ENABLED = os.getenv("WATCHLIST_ENABLED", "true").lower() == "true"
+watchlist = WatchlistPoller(
+    interval=float(os.getenv("WATCHLIST_INTERVAL", "15")),
+    closed_interval=float(os.getenv("WATCHLIST_CLOSED_INTERVAL", "300")),
+    max_tickers=int(os.getenv("WATCHLIST_MAX_TICKERS", "20")),
+    market_state=lambda: prefetcher.market if prefetcher is not None else None,
+    on_calls=lambda calls: rate_limiter.record_usage("watchlist", polygon_calls=calls),
+    tracer=tracer,
+) if WATCHLIST_ENABLED else None
+
+# Per-session history is compacted to this many tokens after every turn
+# (the HistoryManager is built with the agent stack at startup)
+HISTORY_OPTIONS = dict(
+    max_tokens=int(os.getenv("HISTORY_MAX_TOKENS", "6000")),
+    keep_recent_turns=int(os.getenv("HISTORY_KEEP_RECENT_TURNS", "2")),
+)
+history_manager = None
+
+# Final answers are rendered to HTML in a pool (not on the event loop), cached by text hash
+renderer = MarkdownRenderer(
+    pool=os.getenv("RENDER_POOL", "thread").lower(),
+    workers=int(os.getenv("RENDER_WORKERS", "2")),
+    cache_size=int(os.getenv("RENDER_CACHE_SIZE", "256")),
+    inline_below=int(os.getenv("RENDER_INLINE_BELOW", "2000")),
+)
 
 app = FastAPI()
 
 # Mount static files and templates
 app.mount("/static", StaticFiles(directory="static"), name="static")
 templates = Jinja2Templates(directory="templates")
+# Browsers render markdown themselves only with a vendored copy of marked (pinned in
+# README); no third-party script is loaded, and without it the server renders HTML
+MARKED_JS_PATH = "js/vendor/marked.min.js"
+MARKED_JS_URL = f"/static/{MARKED_JS_PATH}" if os.path.exists(os.path.join("static", MARKED_JS_PATH)) else None
 
 # ------------- MCP Server Factory -------------
+# "polygon": the official mcp_polygon server; "custom": custom_mcp_server.py from this repo;
+# "inprocess": custom_mcp_server's tools called directly in this process (no subprocess)
+MCP_SERVER = os.getenv("MCP_SERVER", "polygon").lower()
+CUSTOM_MCP_SERVER_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "custom_mcp_server.py")
+
+# The MCP server's tool list (names, descriptions, schemas) is cached on disk so it
+# is not fetched again on every start; the fingerprint invalidates it when the server changes
+TOOLS_CACHE_PATH = os.getenv("TOOLS_CACHE_PATH", ".cache/mcp_tools.json")
+TOOLS_CACHE_MAX_AGE = float(os.getenv("TOOLS_CACHE_MAX_AGE", "86400"))
+
+def tools_fingerprint() -> str:
+    """Identifies the tool server's version (a hash of custom_mcp_server.py, or mcp_polygon's version)"""
+    if MCP_SERVER in ("custom", "inprocess"):
+        with open(CUSTOM_MCP_SERVER_PATH, "rb") as f:
+            return "custom:" + hashlib.sha256(f.read()).hexdigest()[:16]
+    import importlib.metadata
+    try:
+        return "polygon:" + importlib.metadata.version("mcp_polygon")
+    except importlib.metadata.PackageNotFoundError:
+        return "polygon:unknown"
+
 def create_polygon_mcp_server():
     """Create Polygon.io MCP server"""
     print("[MCP] Creating Polygon.io MCP server...")
@@ -56,9 +164,25 @@ def create_polygon_mcp_server():
         raise Exception("POLYGON_API_KEY is not set in the environment or .env file.")
     
     print(f"[MCP] POLYGON_API_KEY found: {polygon_api_key[:10]}...")
+    if MCP_SERVER == "inprocess":
+        from inprocess_tools import InProcessToolServer
+        print("[MCP] Using custom_mcp_server tools in-process")
+        return InProcessToolServer()
+    
+    from pydantic_ai.mcp import MCPServerStdio
+    
     env = os.environ.copy()
     env["POLYGON_API_KEY"] = polygon_api_key
     
+    if MCP_SERVER == "custom":
+        # The stocks-only server in this repo (smaller tool set, local caching)
+        print("[MCP] Initializing MCPServerStdio with custom_mcp_server.py...")
+        return MCPServerStdio(
+            command=sys.executable,
+            args=[CUSTOM_MCP_SERVER_PATH],
+            env=env
+        )
+    
     # Use the mcp_polygon command directly (installed as a console script)
     print("[MCP] Initializing MCPServerStdio with mcp_polygon command...")
     return MCPServerStdio(
@@ -69,87 +193,832 @@ def create_polygon_mcp_server():
 
 # ------------- Global Agent Setup -------------
 # Initialize agent once at startup to avoid timeout issues
-print("[Startup] Initializing global agent and MCP server...")
 _global_server = None
 _global_agent = None
-_mcp_context = None
+_global_agents = {}
+_mcp_started = False
+_mcp_start_lock = asyncio.Lock()
+
+SYSTEM_PROMPT = (
+    "You are an expert financial analyst. Note that when using Polygon tools, prices are already stock split adjusted. "
+    "Use the latest data available. Always double check your math. "
+    "For any questions about the current date, use the 'get_today_date' tool. "
+    "For long or complex queries, break the query into logical subtasks and process each subtask in order."
+)
+
+def get_today_date() -> str:
+    """Returns today's date in YYYY-MM-DD format."""
+    return str(date.today())
+
+def get_or_create_pool():
+    """Get or create the shared MCP server pool (does not start it)"""
+    global _global_server
+    if _global_server is None:
+        from mcp_pool import MCPServerPool
+        # Several warm MCP subprocesses so concurrent sessions don't share one stdio pipe
+        _global_server = MCPServerPool(
+            create_polygon_mcp_server,
+            # In-process tools have no pipe to queue on, so one member is enough
+            size=1 if MCP_SERVER == "inprocess" else int(os.getenv("MCP_POOL_SIZE", "2")),
+            health_interval=float(os.getenv("MCP_HEALTH_INTERVAL", "30")),
+            cache=shared_store,
+            tracer=tracer,
+            tools_cache_path=TOOLS_CACHE_PATH or None,
+            tools_fingerprint=tools_fingerprint(),
+            tools_cache_max_age=TOOLS_CACHE_MAX_AGE,
+        )
+        _global_server.call_listeners.append(hot_tickers.record_call)
+    return _global_server
 
 def get_or_create_agent():
-    """Get or create the global agent instance"""
-    global _global_agent, _global_server
+    """Get or create the global agent instances (one per model tier) and the shared MCP pool"""
+    global _global_agent
     
     if _global_agent is None:
-        print("[Agent] Creating new global agent...")
-        _global_server = create_polygon_mcp_server()
-        _global_agent = Agent(
-            model="anthropic:claude-sonnet-4-5-20250929",
-            mcp_servers=[_global_server],
-            system_prompt=(
-                "You are an expert financial analyst. Note that when using Polygon tools, prices are already stock split adjusted. "
-                "Use the latest data available. Always double check your math. "
-                "For any questions about the current date, use the 'get_today_date' tool. "
-                "For long or complex queries, break the query into logical subtasks and process each subtask in order."
+        from pydantic_ai import Agent
+        from tool_selector import tool_filter
+        from traced_model import TracedModel
+        print("[Agent] Creating new global agents...")
+        # Each run only sees the tools its query needs (see tool_selector.py)
+        toolset = get_or_create_pool().filtered(tool_filter)
+        for tier, model in MODEL_TIERS.items():
+            tier_agent = Agent(
+                model=TracedModel(model, tracer),
+                toolsets=[toolset],
+                system_prompt=SYSTEM_PROMPT
             )
-        )
-        
-        # Add custom tool for today's date
-        @_global_agent.tool
-        def get_today_date(ctx: RunContext) -> str:
-            """Returns today's date in YYYY-MM-DD format."""
-            return str(date.today())
+            # Add custom tool for today's date
+            tier_agent.tool_plain(get_today_date)
+            _global_agents[tier] = tier_agent
+        _global_agent = _global_agents[STANDARD_TIER]
         
-        print("[Agent] Global agent created successfully")
+        print("[Agent] Global agents created successfully")
     
     return _global_agent, _global_server
 
+# Response formats a client can ask for with /ws?format=...
+#   "full": rendered HTML in "output" plus the markdown in "raw_output" (the default)
+#   "html": rendered HTML only
+#   "markdown": markdown only; the client renders it (text_delta carries raw "text")
+WS_FORMATS = ("full", "html", "markdown")
+
+class ChatSession:
+    """Per-connection state: rate-limit key, response format and conversation history"""
+    
+    def __init__(self, websocket: WebSocket):
+        self.websocket = websocket
+        self.session_id = id(websocket)
+        self.rate_key = client_key(websocket)
+        self.format = websocket.query_params.get("format", "full").lower()
+        if self.format not in WS_FORMATS:
+            self.format = "full"
+        self.message_history = []
+        self.failed_query = None  # Re-asking a query that just failed gets the full tool set
+        self.tasks = None  # SessionTasks running this session's queries
+
 # Store active sessions
 sessions = {}
 
-@app.on_event("startup")
-async def startup_event():
-    """Pre-initialize the agent and start MCP server on startup"""
-    global _mcp_context
+# Agent runs allowed at once in this process; more wait in line (up to MAX_QUEUED_RUNS)
+admission = AdmissionController(
+    max_concurrent=int(os.getenv("MAX_CONCURRENT_RUNS", "8")),
+    max_queued=int(os.getenv("MAX_QUEUED_RUNS", "50")),
+)
+# Queries one session may have waiting behind its running query
+SESSION_MAX_PENDING = int(os.getenv("SESSION_MAX_PENDING", "3"))
+
+async def send_message(websocket: WebSocket, message: dict):
+    """send_json with the send time and size counted against the current span"""
+    text = json.dumps(message, separators=(",", ":"), ensure_ascii=False)
+    started = time.perf_counter()
+    await websocket.send_text(text)
+    elapsed_ms = (time.perf_counter() - started) * 1000
+    tracer.observe("ws_send", elapsed_ms)
+    span = current_span.get()
+    if span is not None:
+        span.add(ws_messages=1, ws_bytes=len(text.encode()), ws_send_ms=elapsed_ms)
+
+async def response_payload(session: ChatSession, data: dict) -> dict:
+    """Response data in the session's format, rendering the markdown only if the client wants HTML"""
+    if session.format == "markdown":
+        return {key: value for key, value in data.items() if key != "output"}
+    data = dict(data)
+    if "output" not in data:
+        with tracer.span("markdown_render", chars=len(data["raw_output"])):
+            data["output"] = await renderer.render(data["raw_output"])
+    if session.format == "html":
+        data.pop("raw_output", None)
+    return data
+
+# ------------- Fast Path -------------
+# Simple quote, market-status and dividend questions are answered from Polygon
+# directly with a templated reply; anything the patterns don't match with
+# confidence falls through to the agent.
+FAST_PATH_ENABLED = os.getenv("FAST_PATH_ENABLED", "true").lower() == "true"
+FAST_PATH_TIMEOUT = float(os.getenv("FAST_PATH_TIMEOUT", "3"))
+MARKET_TZ = ZoneInfo("America/New_York")
+
+TICKER = r"(?P<ticker>\$?[A-Za-z]{1,5}(?:\.[A-Za-z])?)"
+NOW = r"(?:\s+(?:now|today|right now))?"
+FAST_PATH_PATTERNS = [
+    ("price", re.compile(
+        r"^(?:what(?:'s| is)\s+)?(?:the\s+)?(?:current\s+|latest\s+)?(?:stock\s+|share\s+)?"
+        r"(?:price|quote)\s+(?:of|for)\s+" + TICKER + r"(?:\s+(?:stock|shares))?" + NOW + r"$", re.I)),
+    ("price", re.compile(
+        r"^(?:what(?:'s| is)\s+)?" + TICKER + r"(?:'s)?\s+(?:current\s+)?(?:stock\s+|share\s+)?"
+        r"(?:price|quote)" + NOW + r"$", re.I)),
+    ("price", re.compile(r"^(?:how much is|where is)\s+" + TICKER + r"(?:\s+stock)?\s+trading(?:\s+at)?" + NOW + r"$", re.I)),
+    ("market_status", re.compile(
+        r"^(?:is\s+the\s+(?:us\s+|stock\s+)*market\s+open|are\s+(?:the\s+)?markets\s+open|"
+        r"(?:us\s+|stock\s+)*market\s+status)" + NOW + r"$", re.I)),
+    ("dividend", re.compile(
+        r"^(?:what(?:'s| is| was)\s+)?(?:the\s+)?(?:last|latest|most recent|recent)\s+dividend\s+"
+        r"(?:of|for|from|paid by)\s+" + TICKER + r"$", re.I)),
+    ("dividend", re.compile(r"^(?:what(?:'s| is| was)\s+)?" + TICKER + r"(?:'s)?\s+(?:last|latest|most recent)\s+dividend$", re.I)),
+]
+
+def parse_simple_intent(query_text: str) -> tuple[str, str | None] | None:
+    """(intent, ticker) for a query the fast path can answer confidently, else None"""
+    text = query_text.strip().replace("’", "'").rstrip("?.! ")
+    for intent, pattern in FAST_PATH_PATTERNS:
+        match = pattern.match(text)
+        if not match:
+            continue
+        ticker = match.groupdict().get("ticker")
+        if ticker is None:
+            return intent, None
+        # Lowercase words like "apple" or "ford" are too ambiguous to treat as tickers
+        if not (ticker.startswith("$") or ticker.isupper()):
+            return None
+        return intent, ticker.lstrip("$").upper()
+    return None
+
+def format_money(value) -> str:
+    return f"${value:,.2f}" if isinstance(value, (int, float)) else "n/a"
+
+def format_market_time(ms) -> str:
+    if not ms:
+        return ""
+    # Snapshot times are in nanoseconds, aggregate bar times in milliseconds
+    seconds = ms / 1e9 if ms > 1e14 else ms / 1e3
+    return datetime.fromtimestamp(seconds, tz=MARKET_TZ).strftime("%Y-%m-%d %H:%M ET")
+
+async def fast_price_answer(ticker: str) -> str | None:
+    import custom_mcp_server
+    data = await custom_mcp_server.batch_stock_prices([ticker])
+    quote = data["results"].get(ticker)
+    if not quote:
+        return None
+    if "price" in quote:
+        if quote["price"] is None:
+            return None
+        answer = f"**{ticker}** is trading at **{format_money(quote['price'])}**"
+        if quote.get("change") is not None and quote.get("change_pct") is not None:
+            answer += f" ({quote['change']:+,.2f}, {quote['change_pct']:+.2f}% today)"
+        details = [f"Previous close: {format_money(quote.get('prev_close'))}"]
+        if quote.get("volume"):
+            details.append(f"Volume: {quote['volume']:,.0f}")
+        if quote.get("updated"):
+            details.append(f"As of {format_market_time(quote['updated'])}")
+        return f"{answer}.\n\n{' · '.join(details)}"
+    # Previous-close fallback (no snapshot access on this Polygon plan)
+    return (
+        f"**{ticker}** last closed at **{format_money(quote['c'])}** ({format_market_time(quote.get('t'))}).\n\n"
+        f"Open: {format_money(quote.get('o'))} · High: {format_money(quote.get('h'))} · "
+        f"Low: {format_money(quote.get('l'))} · Volume: {quote.get('v', 0):,.0f}"
+    )
+
+async def fast_market_status_answer() -> str | None:
+    import custom_mcp_server
+    data = await custom_mcp_server.call_polygon_api("/v1/marketstatus/now")
+    market = data.get("market")
+    if not market:
+        return None
+    label = {"extended-hours": "in extended hours"}.get(market, market)
+    answer = f"The US stock market is currently **{label}**."
+    exchanges = data.get("exchanges") or {}
+    if exchanges:
+        answer += "\n\n" + " · ".join(f"{name.upper()}: {state}" for name, state in exchanges.items())
+    return answer
+
+async def fast_dividend_answer(ticker: str) -> str | None:
+    import custom_mcp_server
+    data = await custom_mcp_server.call_polygon_api(
+        "/v3/reference/dividends",
+        {"ticker": ticker, "limit": 1, "order": "desc", "sort": "ex_dividend_date"}
+    )
+    results = data.get("results") or []
+    if not results:
+        return None
+    dividend = results[0]
+    frequency = {1: "annual", 2: "semi-annual", 4: "quarterly", 12: "monthly"}.get(dividend.get("frequency"))
+    answer = (
+        f"**{ticker}**'s most recent dividend is **{format_money(dividend.get('cash_amount'))}** per share"
+        f" (ex-dividend {dividend.get('ex_dividend_date', 'n/a')}, paid {dividend.get('pay_date', 'n/a')}"
+    )
+    if frequency:
+        answer += f", {frequency}"
+    return answer + ")."
+
+FAST_PATH_HANDLERS = {
+    "price": ("get_stock_price", fast_price_answer),
+    "market_status": ("get_market_status", fast_market_status_answer),
+    "dividend": ("get_dividends", fast_dividend_answer),
+}
+
+async def answer_fast_path(query_text: str) -> dict | None:
+    """Response data for a simple query answered without the model, or None to use the agent"""
+    import custom_mcp_server
+    if not FAST_PATH_ENABLED:
+        return None
+    parsed = parse_simple_intent(query_text)
+    if parsed is None:
+        return None
+    intent, ticker = parsed
+    tool_name, handler = FAST_PATH_HANDLERS[intent]
+    if ticker:
+        hot_tickers.record_tickers([ticker])
+    started = time.monotonic()
     try:
-        print("[Startup] Pre-initializing agent...")
-        agent, server = get_or_create_agent()
-        print("[Startup] Agent pre-initialized successfully")
-        
-        # Start MCP server and keep it running
-        print("[Startup] Starting MCP server...")
-        _mcp_context = agent.run_mcp_servers()
-        await _mcp_context.__aenter__()
-        print("[Startup] MCP server started and ready for connections")
+        async with asyncio.timeout(FAST_PATH_TIMEOUT):
+            output = await (handler(ticker) if ticker else handler())
     except Exception as e:
-        print(f"[Startup] ERROR: Failed to start MCP server: {str(e)}")
-        raise
+        print(f"[FastPath] {intent} {ticker or ''} failed, using the agent: {custom_mcp_server.describe_error(e)}")
+        return None
+    if output is None:
+        return None
+    print(f"[FastPath] {intent} {ticker or ''} answered in {(time.monotonic() - started) * 1000:.0f}ms")
+    return {
+        "raw_output": output,
+        "tools_used": [tool_name],
+        "fast_path": True
+    }
+
+# ------------- Streaming -------------
+# Minimum gap between text_delta messages so we don't send one frame per token
+STREAM_FLUSH_INTERVAL = 0.05
+
+class IncrementalMarkdown:
+    """Split streamed markdown into completed blocks.
+
+    Text is split at blank lines outside code fences; each completed block is
+    handed out exactly once to be rendered, and the unfinished tail is kept as
+    raw text until its block completes.
+    """
+    def __init__(self):
+        self.pending = ""
+    
+    def feed(self, text: str) -> str:
+        """Add streamed text and return the markdown of any blocks it completed"""
+        self.pending += text
+        cut = self._last_block_boundary()
+        if cut <= 0:
+            return ""
+        completed, self.pending = self.pending[:cut], self.pending[cut:]
+        return completed
+    
+    def flush(self) -> str:
+        """Return whatever is left as a final block"""
+        completed, self.pending = self.pending, ""
+        return completed
+    
+    def _last_block_boundary(self) -> int:
+        """Offset just past the last blank line that is outside a code fence"""
+        boundary, in_fence, offset = 0, False, 0
+        for line in self.pending.splitlines(keepends=True):
+            offset += len(line)
+            if line.lstrip().startswith("```"):
+                in_fence = not in_fence
+            elif not in_fence and not line.strip() and line.endswith("\n"):
+                boundary = offset
+        return boundary
+
+async def stream_agent_run(websocket: WebSocket, agent: "Agent", query_text: str, message_history: list,
+                           deps=None, usage=None, usage_limits=None, stream_format="full"):
+    """Run the agent, forwarding text deltas and tool call events; returns the run result
+
+    Deltas carry incrementally rendered HTML plus the unfinished block as
+    text. With the "html" format only what the unfinished block gained since
+    the last delta is sent (pending_append); with "markdown" deltas carry the
+    streamed markdown itself for the client to render.
+    """
+    from pydantic_ai.messages import (
+        FunctionToolCallEvent, FunctionToolResultEvent, PartDeltaEvent, PartStartEvent, TextPart, TextPartDelta,
+    )
+    blocks = IncrementalMarkdown()
+    raw_text = stream_format == "markdown"
+    html_append = ""
+    text_append = ""
+    client_pending = ""  # The unfinished block as the client last saw it
+    streamed = False
+    last_sent = 0.0
+    span = current_span.get()
+    
+    async def render(text=None):
+        """Feed (or flush) the block splitter and render completed blocks, timing it for the trace"""
+        started = time.perf_counter()
+        completed = blocks.feed(text) if text is not None else blocks.flush()
+        html = await renderer.render(completed) if completed.strip() else ""
+        if span is not None:
+            span.add(render_ms=(time.perf_counter() - started) * 1000)
+        return html
+    
+    async def send_delta(force=False):
+        nonlocal html_append, text_append, client_pending, last_sent
+        now = time.monotonic()
+        if raw_text:
+            if not text_append or (not force and now - last_sent < STREAM_FLUSH_INTERVAL):
+                return
+            data = {"text": text_append}
+        else:
+            if not html_append and blocks.pending == client_pending:
+                return
+            if not force and not html_append and now - last_sent < STREAM_FLUSH_INTERVAL:
+                return
+            data = {"html_append": html_append}
+            if stream_format == "html" and blocks.pending.startswith(client_pending):
+                data["pending_append"] = blocks.pending[len(client_pending):]
+            else:
+                data["pending"] = blocks.pending
+            client_pending = blocks.pending
+        await send_message(websocket, {"type": "text_delta", "data": data})
+        html_append = text_append = ""
+        last_sent = now
+    
+    async def add_text(text, new_part=False):
+        nonlocal html_append, text_append, streamed
+        if raw_text:
+            # A new text part starts a new block
+            text_append += ("\n\n" if new_part and streamed else "") + text
+        elif new_part:
+            html_append += await render() + await render(text)
+        else:
+            html_append += await render(text)
+        streamed = True
+    
+    async def handle_events(ctx, events):
+        async for event in events:
+            if isinstance(event, PartStartEvent) and isinstance(event.part, TextPart):
+                await add_text(event.part.content, new_part=True)
+                await send_delta()
+            elif isinstance(event, PartDeltaEvent) and isinstance(event.delta, TextPartDelta):
+                await add_text(event.delta.content_delta)
+                await send_delta()
+            elif isinstance(event, FunctionToolCallEvent):
+                await send_message(websocket, {
+                    "type": "tool_call_start",
+                    "data": {"tool_name": event.part.tool_name, "tool_call_id": event.part.tool_call_id}
+                })
+            elif isinstance(event, FunctionToolResultEvent):
+                await send_message(websocket, {
+                    "type": "tool_call_end",
+                    "data": {"tool_name": event.result.tool_name, "tool_call_id": event.result.tool_call_id}
+                })
+    
+    # agent.run keeps the run in this task (run_stream_events would move it to its own),
+    # so cancelling the query also cancels in-flight model requests and tool calls
+    result = await agent.run(
+        query_text, message_history=message_history, deps=deps, usage=usage, usage_limits=usage_limits,
+        event_stream_handler=handle_events
+    )
+    
+    if not raw_text:
+        html_append += await render()
+    await send_delta(force=True)
+    return result
+
+async def run_routed(websocket: WebSocket, query_text: str, message_history: list, tools, usage: "RunUsage",
+                     stream_format="full"):
+    """Run the query on the tier the router picks, escalating once to the standard tier"""
+    from pydantic_ai.exceptions import UnexpectedModelBehavior, UsageLimitExceeded
+    from tool_selector import HiddenToolRequested
+    decision = model_router.route(query_text, message_history, tools.full)
+    while True:
+        started = time.monotonic()
+        strict = decision.tier == FAST_TIER
+        try:
+            with tracer.span("agent_run", tier=decision.tier, tools=tools.describe()):
+                response = await stream_agent_run(
+                    websocket, _global_agents[decision.tier], query_text, message_history,
+                    deps=replace(tools, strict=strict), usage=usage,
+                    usage_limits=model_router.usage_limits(decision), stream_format=stream_format
+                )
+            model_router.log(decision, query_text, time.monotonic() - started, response.usage())
+            return response
+        except (HiddenToolRequested, UsageLimitExceeded, UnexpectedModelBehavior) as e:
+            model_router.log(decision, query_text, time.monotonic() - started, ok=False)
+            if decision.tier != FAST_TIER:
+                raise
+            decision = model_router.escalate(decision, type(e).__name__)
+            # Discard the partial answer the fast model streamed
+            await send_message(websocket, {"type": "stream_reset"})
+            await send_message(websocket, {
+                "type": "processing",
+                "message": "Escalating to a more capable model..."
+            })
+
+async def ensure_mcp_started():
+    """Start this worker's MCP pool on first use (each worker owns its own pool)"""
+    global _mcp_started
+    async with _mcp_start_lock:
+        if _mcp_started:
+            return
+        pool = get_or_create_pool()
+        print(f"[MCP] Starting MCP server pool in worker {os.getpid()}...")
+        await pool.__aenter__()
+        _mcp_started = True
+        print("[MCP] MCP server pool started and ready for connections")
+
+# ------------- Startup Pipeline -------------
+# uvicorn serves requests once startup_event returns, so the slow work runs afterwards
+# as background steps: /healthz answers right away, /readyz once every step is done,
+# and WebSocket sessions wait for readiness. MCP servers are spawned as soon as the
+# MCP client is imported, overlapping with the rest of the agent stack's imports.
+startup = StartupPipeline()
+# How long a WebSocket session waits for startup before giving up
+STARTUP_WAIT_TIMEOUT = 60.0
+
+def import_mcp_client():
+    """pydantic_ai's MCP client and the pool: all that is needed to spawn MCP servers"""
+    import pydantic_ai.mcp  # noqa: F401
+    import mcp_pool  # noqa: F401
+    if MCP_SERVER == "inprocess":
+        import inprocess_tools  # noqa: F401
+
+def import_agent_stack():
+    """The rest of the agent path: custom_mcp_server (direct Polygon client), history, tool selection, markdown"""
+    global history_manager
+    import custom_mcp_server
+    import markdown  # noqa: F401
+    import tool_selector  # noqa: F401
+    import traced_model  # noqa: F401
+    from history import HistoryManager
+    custom_mcp_server.polygon_client.listeners.append(
+        lambda endpoint, start_ns, end_ns, status, size: tracer.record(
+            "polygon_http", start_ns, end_ns, endpoint=endpoint, status=status, bytes=size
+        )
+    )
+    history_manager = HistoryManager(**HISTORY_OPTIONS)
+
+async def start_mcp_client():
+    # Imports run in a thread so the event loop keeps answering health checks
+    await asyncio.to_thread(import_mcp_client)
+    get_or_create_pool()
+
+async def start_agent_stack():
+    await asyncio.to_thread(import_agent_stack)
+    get_or_create_agent()
+
+async def load_tool_list():
+    """Tool schemas from the disk cache, or from the first MCP server once it is up"""
+    pool = get_or_create_pool()
+    if await pool.load_tools(fetch=False):
+        return
+    if WEB_CONCURRENCY == 1:
+        await ensure_mcp_started()
+        await pool.load_tools()
+
+async def start_prefetcher():
+    global prefetcher
+    # Every worker prefetches for itself, so the budget is split between them
+    prefetcher = Prefetcher(
+        hot_tickers,
+        pool=_global_server,
+        seed_tickers=os.getenv("PREFETCH_TICKERS", "SPY,QQQ,AAPL,MSFT,NVDA,AMZN,GOOGL,META,TSLA").split(","),
+        top_n=int(os.getenv("PREFETCH_TOP_N", "10")),
+        calls_per_hour=int(os.getenv("PREFETCH_CALLS_PER_HOUR", "300")) // WEB_CONCURRENCY,
+        on_calls=lambda calls: rate_limiter.record_usage("prefetch", polygon_calls=calls)
+    )
+    prefetcher.start()
+    print("[Startup] Prefetcher started")
+
+startup.add("mcp_client", start_mcp_client)
+startup.add("agent_stack", start_agent_stack, after=["mcp_client"])
+startup.add("tool_list", load_tool_list, after=["mcp_client"])
+# With several workers the pool starts lazily on each worker's first connection
+if WEB_CONCURRENCY == 1:
+    startup.add("mcp_servers", ensure_mcp_started, after=["mcp_client"])
+if PREFETCH_ENABLED:
+    startup.add("prefetch", start_prefetcher,
+                after=["agent_stack", "mcp_servers"] if WEB_CONCURRENCY == 1 else ["agent_stack"])
+
+@app.on_event("startup")
+async def startup_event():
+    """Launch the startup pipeline in the background; the server starts serving immediately"""
+    print(f"[Startup] App module imported in {APP_IMPORT_MS:.0f}ms; starting {', '.join(startup.steps)}...")
+    startup.start()
 
 @app.on_event("shutdown")
 async def shutdown_event():
     """Clean up MCP server on shutdown"""
-    global _mcp_context
-    if _mcp_context:
+    await startup.stop()
+    if prefetcher is not None:
+        await prefetcher.stop()
+    if watchlist is not None:
+        await watchlist.stop()
+    renderer.shutdown()
+    if _mcp_started:
         try:
             print("[Shutdown] Stopping MCP server...")
-            await _mcp_context.__aexit__(None, None, None)
+            await _global_server.__aexit__(None, None, None)
             print("[Shutdown] MCP server stopped")
         except Exception as e:
             print(f"[Shutdown] Error stopping MCP server: {str(e)}")
+    # Spans from the shutdown itself are included
+    await asyncio.to_thread(tracer.close)
+
+@app.get("/healthz")
+async def healthz():
+    """Liveness: the process is serving (also while still starting); 503 only if startup failed"""
+    if startup.failed:
+        return JSONResponse({"status": "failed", "worker": os.getpid(), **startup.stats()}, status_code=503)
+    return {"status": "ok", "worker": os.getpid()}
+
+@app.get("/readyz")
+async def readyz():
+    """Readiness: 200 once every startup step has finished, 503 until then; includes step timings"""
+    body = {"worker": os.getpid(), "import_ms": APP_IMPORT_MS, **startup.stats()}
+    if _global_server is not None:
+        body["tool_list"] = _global_server.tools_source
+    return body if startup.ready else JSONResponse(body, status_code=503)
 
 @app.get("/", response_class=HTMLResponse)
 async def home(request: Request):
-    return templates.TemplateResponse("index.html", {"request": request})
+    return templates.TemplateResponse("index.html", {"request": request, "marked_js": MARKED_JS_URL})
+
+@app.get("/mcp/pool")
+async def mcp_pool_status():
+    """Per-process health and queue depth of the MCP server pool"""
+    if _global_server is None:
+        return {"worker": os.getpid(), "members": []}
+    return {
+        "worker": os.getpid(),
+        "members": _global_server.stats(),
+        "tool_cache": _global_server.cache_stats(),
+    }
+
+@app.get("/polygon/stats")
+async def polygon_stats():
+    """Retry counters and per-endpoint latency histograms of this worker's direct Polygon client,
+    its response cache hits/misses and coalesced requests"""
+    import custom_mcp_server
+    return {
+        "worker": os.getpid(),
+        **custom_mcp_server.polygon_client.stats(),
+        "response_cache": custom_mcp_server.response_cache.stats(),
+        "coalescer": custom_mcp_server.request_coalescer.stats(),
+    }
+
+@app.get("/metrics")
+async def metrics():
+    """Latency histograms (count, mean, p50/p95/p99 in ms) per span name, and render cache stats, for this worker"""
+    return {"worker": os.getpid(), "latency": tracer.metrics(), "render": renderer.stats()}
+
+@app.get("/prefetch")
+async def prefetch_status():
+    """Background warm-up state: market phase, hot tickers and remaining call budget"""
+    if prefetcher is None:
+        return {"worker": os.getpid(), "enabled": False}
+    return {"worker": os.getpid(), "enabled": True, **prefetcher.stats()}
+
+@app.get("/watchlist")
+async def watchlist_status():
+    """Shared watchlist poller: subscribers, watched tickers, polls, upstream calls and pushes"""
+    if watchlist is None:
+        return {"worker": os.getpid(), "enabled": False}
+    return {"worker": os.getpid(), "enabled": True, **watchlist.stats()}
+
+@app.get("/admission")
+async def admission_status():
+    """Process-wide agent run slots and per-session query queues"""
+    return {
+        "worker": os.getpid(),
+        **admission.stats(),
+        "sessions": {str(sid): s.tasks.stats() for sid, s in sessions.items() if s.tasks is not None},
+    }
+
+@app.get("/router")
+async def router_status():
+    """Per-process counts of runs per model tier and escalations"""
+    return {"worker": os.getpid(), "models": MODEL_TIERS, "counts": model_router.stats()}
+
+def append_direct_turn(message_history: list, query_text: str, output: str) -> list:
+    """Record an answer given without the agent (cache or fast path) so follow-ups have context"""
+    from pydantic_ai.messages import ModelRequest, ModelResponse, SystemPromptPart, TextPart, UserPromptPart
+    parts = [UserPromptPart(query_text)]
+    if not message_history:
+        # The agent only adds its system prompt to an empty history
+        parts.insert(0, SystemPromptPart(SYSTEM_PROMPT))
+    return [*message_history, ModelRequest(parts=parts), ModelResponse(parts=[TextPart(output)])]
+
+def client_key(websocket: WebSocket) -> str:
+    """Rate-limit key for a connection: the client IP as seen by the outermost trusted proxy"""
+    if TRUSTED_PROXY_HOPS > 0:
+        hops = [hop.strip() for hop in websocket.headers.get("x-forwarded-for", "").split(",") if hop.strip()]
+        if len(hops) >= TRUSTED_PROXY_HOPS:
+            return hops[-TRUSTED_PROXY_HOPS]
+    if websocket.client:
+        return websocket.client.host
+    return str(id(websocket))
+
+async def handle_query(session: ChatSession, agent: "Agent", query_text: str):
+    """Answer one query: answer cache, or after the rate limiter, fast path or a routed agent run"""
+    websocket = session.websocket
+    with tracer.span("query", session=session.session_id, client=session.rate_key) as query_span:
+        # Serve repeated questions from the answer cache without touching the model.
+        # Cached answers were given without any conversation, so only the first turn uses them
+        cached = None
+        if answer_cache and not session.message_history:
+            cached = await answer_cache.get(query_text)
+        if cached is not None:
+            query_span.set(path="answer_cache")
+            await send_message(websocket, {"type": "response", "data": await response_payload(session, cached)})
+            session.message_history = append_direct_turn(session.message_history, query_text, cached["raw_output"])
+            return
+        
+        # Check rate limit (queues briefly instead of rejecting when capacity frees up soon).
+        # This comes before the fast path too, so it cannot spend Polygon calls past the budget
+        expected_wait = await rate_limiter.estimate_wait(session.rate_key)
+        if 0 < expected_wait <= rate_limiter.max_wait:
+            await send_message(websocket, {
+                "type": "processing",
+                "message": f"Queued, starting in about {int(expected_wait) + 1} seconds..."
+            })
+        with tracer.span("rate_limit_wait"):
+            can_proceed, wait_time = await rate_limiter.acquire(session.rate_key)
+        if not can_proceed:
+            query_span.set(path="rate_limited")
+            await send_message(websocket, {
+                "type": "error",
+                "message": f"Rate limit exceeded. Please wait {int(wait_time)} seconds before trying again. This helps prevent API rate limit errors."
+            })
+            return
+        
+        # Simple quote/status/dividend questions are answered from Polygon without the LLM
+        direct = await answer_fast_path(query_text)
+        if direct is not None:
+            query_span.set(path="fast_path")
+            await send_message(websocket, {"type": "response", "data": await response_payload(session, direct)})
+            rate_limiter.record_usage(session.rate_key, polygon_calls=1)
+            session.message_history = append_direct_turn(session.message_history, query_text, direct["raw_output"])
+            return
+        
+        # Cap concurrent agent runs process-wide; waiting clients are told their place in line
+        async def report_position(position: int):
+            await send_message(websocket, {
+                "type": "queued",
+                "position": position,
+                "message": f"Server busy: you are number {position} in line..."
+            })
+        
+        query_span.set(path="agent")
+        try:
+            with tracer.span("admission_wait"):
+                await admission.acquire(report_position)
+        except AdmissionRejected:
+            query_span.set(path="rejected")
+            await send_message(websocket, {
+                "type": "error",
+                "message": "The server is at capacity right now. Please try again in a moment."
+            })
+            return
+        try:
+            await run_agent_query(session, query_text, query_span)
+        finally:
+            admission.release()
+
+async def run_agent_query(session: ChatSession, query_text: str, query_span):
+    """Run the routed agent for an admitted query and send the final response"""
+    from pydantic_ai.usage import RunUsage
+    from tool_selector import select_tools
+    websocket = session.websocket
+    
+    # Send processing status
+    await send_message(websocket, {
+        "type": "processing",
+        "message": "Processing your query..."
+    })
+    
+    tools = select_tools(query_text)
+    if query_text == session.failed_query:
+        tools.full = True
+    print(f"[Tools] Session {session.session_id}: {tools.describe()}")
+    session.failed_query = query_text
+    
+    usage = RunUsage()
+    try:
+        # Run the agent with timeout, streaming progress to the client
+        async with asyncio.timeout(60.0):  # 60 second timeout
+            response = await run_routed(websocket, query_text, session.message_history, tools, usage,
+                                        stream_format=session.format)
+        session.failed_query = None
+    
+        # Debit what the run actually cost (including any escalated attempt)
+        rate_limiter.record_usage(
+            session.rate_key,
+            input_tokens=usage.input_tokens or 0,
+            output_tokens=usage.output_tokens or 0,
+            polygon_calls=usage.tool_calls or 0
+        )
+        query_span.set(
+            input_tokens=usage.input_tokens or 0,
+            output_tokens=usage.output_tokens or 0,
+            model_requests=usage.requests,
+            tool_calls=usage.tool_calls or 0
+        )
+    
+        # Extract tools used
+        tools_used = []
+        for msg in response.all_messages():
+            if hasattr(msg, "parts"):
+                for part in msg.parts:
+                    if hasattr(part, "tool_name"):
+                        tools_used.append(part.tool_name)
+    
+        # Get response output
+        output = getattr(response, "output", str(response))
+    
+        # Send response (rendered to HTML off the event loop unless the client renders it)
+        response_data = {
+            "raw_output": output,
+            "tools_used": list(set(tools_used))
+        }
+        await send_message(websocket, {"type": "response", "data": await response_payload(session, response_data)})
+        # Only answers that did not depend on earlier turns may be shared
+        if answer_cache and not session.message_history:
+            await answer_cache.put(query_text, response_data)
+    
+        # Update message history, compacting old turns as whole units
+        # so tool_use/tool_result pairs are never split
+        session.message_history = history_manager.compact(response.all_messages())
+    
+    except asyncio.CancelledError:
+        # Cancelled by the client or a disconnect: debit what was spent so far
+        query_span.set(cancelled=True)
+        session.failed_query = None
+        rate_limiter.record_usage(
+            session.rate_key,
+            input_tokens=usage.input_tokens or 0,
+            output_tokens=usage.output_tokens or 0,
+            polygon_calls=usage.tool_calls or 0
+        )
+        raise
+    except asyncio.TimeoutError:
+        query_span.set(error="timeout")
+        await send_message(websocket, {
+            "type": "error",
+            "message": "Query timed out after 60 seconds. Please try a simpler query or try again later."
+        })
+    except Exception as e:
+        error_msg = str(e)
+        query_span.set(error=type(e).__name__)
+        # Handle rate limit errors specifically
+        if "rate_limit_error" in error_msg or "429" in error_msg:
+            await send_message(websocket, {
+                "type": "error",
+                "message": "API rate limit exceeded. Please wait a minute before trying again. Consider using simpler queries or reducing query frequency."
+            })
+        else:
+            await send_message(websocket, {
+                "type": "error",
+                "message": f"Error: {error_msg}"
+            })
+
+async def handle_watchlist_message(session: ChatSession, message: dict):
+    """subscribe / unsubscribe: update the session's watchlist and send it back with the known quotes"""
+    websocket = session.websocket
+    if watchlist is None:
+        await send_message(websocket, {"type": "error", "message": "Watchlists are disabled on this server"})
+        return
+    
+    async def send(update):
+        await send_message(websocket, update)
+    
+    try:
+        if message["type"] == "subscribe":
+            reply = watchlist.subscribe(session.session_id, message.get("tickers"), send)
+        else:
+            reply = watchlist.unsubscribe(session.session_id, message.get("tickers"))
+    except ValueError as e:
+        await send_message(websocket, {"type": "error", "message": str(e)})
+        return
+    await send_message(websocket, reply or {"type": "watchlist", "tickers": [], "quotes": {}})
 
 @app.websocket("/ws")
 async def websocket_endpoint(websocket: WebSocket):
     await websocket.accept()
-    session_id = id(websocket)
-    message_history = []
+    session = ChatSession(websocket)
+    session_id = session.session_id
+    sessions[session_id] = session
     
     try:
         print(f"[WebSocket] New connection accepted, session_id: {session_id}")
         
         try:
+            # Connections that arrive during startup wait until the agent is ready
+            await startup.wait(timeout=STARTUP_WAIT_TIMEOUT)
             agent, server = get_or_create_agent()
+            await ensure_mcp_started()
             print(f"[WebSocket] Using global agent (MCP server already running)")
         except Exception as e:
             print(f"[WebSocket] Failed to get agent: {str(e)}")
@@ -166,86 +1035,39 @@ async def websocket_endpoint(websocket: WebSocket):
             "message": "Connected to Market Query AI"
         })
         
+        # Queries run in a background task so this loop keeps reading (cancel messages, disconnects)
+        async def run_query(query_id, query_text):
+            await handle_query(session, agent, query_text)
+        
+        async def report_cancelled(query_id, query_text):
+            await send_message(websocket, {"type": "cancelled", "id": query_id, "message": "Query cancelled"})
+        
+        session.tasks = SessionTasks(run_query, report_cancelled, max_pending=SESSION_MAX_PENDING)
+        
         while True:
             try:
                 data = await websocket.receive_text()
                 user_query = json.loads(data)
-                query_text = user_query.get("query", "").strip()
                 
-                if not query_text:
+                if user_query.get("type") == "cancel":
+                    cancelled = session.tasks.cancel(user_query.get("id"))
+                    print(f"[WebSocket] Session {session_id} cancelled {cancelled or 'nothing'}")
                     continue
                 
-                # Check rate limit
-                can_proceed, wait_time = await rate_limiter.acquire()
-                if not can_proceed:
-                    await websocket.send_json({
-                        "type": "error",
-                        "message": f"Rate limit exceeded. Please wait {int(wait_time)} seconds before trying again. This helps prevent API rate limit errors."
-                    })
+                if user_query.get("type") in ("subscribe", "unsubscribe"):
+                    await handle_watchlist_message(session, user_query)
                     continue
                 
-                # Send processing status
-                await websocket.send_json({
-                    "type": "processing",
-                    "message": "Processing your query..."
-                })
+                query_text = user_query.get("query", "").strip()
                 
-                try:
-                    # Run the agent with timeout
-                    response = await asyncio.wait_for(
-                        agent.run(
-                            query_text,
-                            message_history=message_history
-                        ),
-                        timeout=60.0  # 60 second timeout
-                    )
-                    
-                    # Extract tools used
-                    tools_used = []
-                    for msg in response.all_messages():
-                        if hasattr(msg, "parts"):
-                            for part in msg.parts:
-                                if hasattr(part, "tool_name"):
-                                    tools_used.append(part.tool_name)
-                    
-                    # Get response output
-                    output = getattr(response, "output", str(response))
-                    
-                    # Convert markdown to HTML if needed
-                    html_output = markdown.markdown(output, extensions=['tables', 'fenced_code'])
-                    
-                    # Send response
-                    await websocket.send_json({
-                        "type": "response",
-                        "data": {
-                            "output": html_output,
-                            "raw_output": output,
-                            "tools_used": list(set(tools_used))
-                        }
-                    })
-                    
-                    # Update message history
-                    # Don't limit history to avoid breaking tool_use/tool_result pairs
-                    message_history = response.all_messages()
-                    
-                except asyncio.TimeoutError:
-                    await websocket.send_json({
+                if not query_text:
+                    continue
+                
+                if session.tasks.submit(query_text, user_query.get("id")) is None:
+                    await send_message(websocket, {
                         "type": "error",
-                        "message": "Query timed out after 60 seconds. Please try a simpler query or try again later."
+                        "message": "Too many queries waiting. Wait for the current one to finish or cancel it."
                     })
-                except Exception as e:
-                    error_msg = str(e)
-                    # Handle rate limit errors specifically
-                    if "rate_limit_error" in error_msg or "429" in error_msg:
-                        await websocket.send_json({
-                            "type": "error",
-                            "message": "API rate limit exceeded. Please wait a minute before trying again. Consider using simpler queries or reducing query frequency."
-                        })
-                    else:
-                        await websocket.send_json({
-                            "type": "error",
-                            "message": f"Error: {error_msg}"
-                        })
             
             except json.JSONDecodeError:
                 await websocket.send_json({
@@ -255,8 +1077,6 @@ async def websocket_endpoint(websocket: WebSocket):
                     
     except WebSocketDisconnect:
         print(f"[WebSocket] Client disconnected, session_id: {session_id}")
-        if session_id in sessions:
-            del sessions[session_id]
     except Exception as e:
         print(f"[WebSocket] Unexpected error: {str(e)}")
         # Try to send error message, but don't fail if connection is already closed
@@ -275,9 +1095,20 @@ async def websocket_endpoint(websocket: WebSocket):
                 await websocket.close()
         except Exception as close_error:
             print(f"[WebSocket] Could not close connection: {close_error}")
+    finally:
+        # Stop paying for work nobody will see
+        if session.tasks is not None:
+            await session.tasks.close()
+        if watchlist is not None:
+            watchlist.unsubscribe(session_id)
+        sessions.pop(session_id, None)
+
+APP_IMPORT_MS = round((time.perf_counter() - _import_started) * 1000, 1)
 
 if __name__ == "__main__":
     import uvicorn
     port = int(os.getenv("PORT", 8000))
-    uvicorn.run(app, host="0.0.0.0", port=port)
+    # permessage-deflate is negotiated with browsers that offer it (all current ones do)
+    uvicorn.run(app, host="0.0.0.0", port=port,
+                ws_per_message_deflate=os.getenv("WS_PER_MESSAGE_DEFLATE", "true").lower() == "true")
 
@@ -0,0 +1,360 @@
+"""
+Local stand-in for the Polygon.io REST API used by the benchmarks.
+
+Responses come from fixtures.json when a recorded response exists for the
+exact path, otherwise from deterministic synthetic data shaped like
+Polygon's (prices, bars, snapshots and reference data derived from a hash of
+the ticker), so every run sees the same numbers. Latency, jitter and a 429
+rate are configurable, and every request is counted by endpoint template.
+With tick_seconds set, snapshot prices drift like a live market: every tick
+about half of the tickers move.
+
+Run standalone with:
+    python -m benchmarks.fake_polygon --port 8900 --latency-ms 80 --rate-429 0.02
+"""
+
+import argparse
+import asyncio
+import json
+import math
+import os
+import random
+import re
+import time
+import zlib
+from datetime import date, datetime, timedelta, timezone
+
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse
+
+from custom_mcp_server import MARKET_TZ, day_start_ms, endpoint_template
+
+FIXTURES_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "fixtures.json")
+
+
+def seed_for(ticker: str) -> int:
+    return zlib.crc32(ticker.upper().encode())
+
+
+def base_price(ticker: str) -> float:
+    return 20 + seed_for(ticker) % 480
+
+
+def close_on(ticker: str, day: date) -> float:
+    """Deterministic close for a ticker on a day, independent of the requested range"""
+    seed = seed_for(ticker)
+    wave = 0.15 * math.sin(day.toordinal() / 17 + seed % 97) + 0.05 * math.sin(day.toordinal() / 3.1)
+    noise = random.Random(seed ^ day.toordinal()).uniform(-0.01, 0.01)
+    return round(base_price(ticker) * (1 + wave + noise), 2)
+
+
+def bar_for(ticker: str, day: date) -> dict:
+    close = close_on(ticker, day)
+    open_ = close_on(ticker, day - timedelta(days=1))
+    rng = random.Random(seed_for(ticker) + day.toordinal())
+    return {
+        "o": open_,
+        "h": round(max(open_, close) * (1 + rng.uniform(0, 0.015)), 2),
+        "l": round(min(open_, close) * (1 - rng.uniform(0, 0.015)), 2),
+        "c": close,
+        "v": rng.randint(1_000_000, 80_000_000),
+        "vw": round((open_ + close) / 2, 4),
+        "n": rng.randint(10_000, 900_000),
+        "t": day_start_ms(day),
+    }
+
+
+def trading_days(start: date, end: date, step: int = 1) -> list[date]:
+    days = [start + timedelta(days=i) for i in range((end - start).days + 1)]
+    return [d for d in days if d.weekday() < 5][::step]
+
+
+def last_session(today: date = None) -> date:
+    day = (today or datetime.now(MARKET_TZ).date()) - timedelta(days=1)
+    while day.weekday() >= 5:
+        day -= timedelta(days=1)
+    return day
+
+
+def snapshot_for(ticker: str) -> dict:
+    today = datetime.now(MARKET_TZ).date()
+    day, prev = bar_for(ticker, today), bar_for(ticker, last_session(today))
+    change = round(day["c"] - prev["c"], 2)
+    return {
+        "ticker": ticker,
+        "todaysChange": change,
+        "todaysChangePerc": round(change / prev["c"] * 100, 3),
+        "updated": day["t"],
+        "day": {k: day[k] for k in ("o", "h", "l", "c", "v", "vw")},
+        "prevDay": {k: prev[k] for k in ("o", "h", "l", "c", "v", "vw")},
+        "lastTrade": {"p": day["c"], "s": 100, "t": day["t"]},
+    }
+
+
+def ok(**fields) -> dict:
+    return {"status": "OK", "request_id": "bench", **fields}
+
+
+def not_found(message: str) -> tuple[int, dict]:
+    return 404, {"status": "NOT_FOUND", "request_id": "bench", "message": message}
+
+
+# ------------- Endpoints -------------
+def prev_close(m, params):
+    ticker = m["ticker"].upper()
+    bar = bar_for(ticker, last_session())
+    return 200, ok(ticker=ticker, queryCount=1, resultsCount=1, adjusted=True, results=[dict(bar, T=ticker)])
+
+
+def aggregates(m, params):
+    ticker = m["ticker"].upper()
+    start, end = date.fromisoformat(m["from"][:10]), date.fromisoformat(m["to"][:10])
+    step = {"week": 5, "month": 21, "quarter": 63, "year": 252}.get(m["timespan"], 1)
+    bars = [bar_for(ticker, d) for d in trading_days(start, end, step * int(m["multiplier"]))]
+    return 200, ok(ticker=ticker, queryCount=len(bars), resultsCount=len(bars), adjusted=True, results=bars)
+
+
+def open_close(m, params):
+    ticker, day = m["ticker"].upper(), date.fromisoformat(m["date"])
+    if day.weekday() >= 5:
+        return not_found("Data not found.")
+    bar = bar_for(ticker, day)
+    return 200, {"status": "OK", "symbol": ticker, "from": m["date"], "open": bar["o"], "high": bar["h"],
+                 "low": bar["l"], "close": bar["c"], "volume": bar["v"]}
+
+
+def snapshot(m, params):
+    tickers = m.get("tickers") or params.get("tickers") or "SPY,QQQ,AAPL,MSFT,NVDA,AMZN,GOOGL,META,TSLA"
+    return 200, ok(tickers=[snapshot_for(t.strip().upper()) for t in tickers.split(",") if t.strip()])
+
+
+def ticker_details(m, params):
+    ticker = m["ticker"].upper()
+    seed = seed_for(ticker)
+    return 200, ok(results={
+        "ticker": ticker,
+        "name": f"{ticker.title()} Holdings Inc.",
+        "market": "stocks",
+        "primary_exchange": "XNAS" if seed % 2 else "XNYS",
+        "market_cap": round(base_price(ticker) * (50_000_000 + seed % 5_000_000_000), 2),
+        "sic_description": ("SERVICES-PREPACKAGED SOFTWARE", "ELECTRONIC COMPUTERS", "RETAIL-CATALOG & MAIL-ORDER HOUSES",
+                            "SEMICONDUCTORS & RELATED DEVICES")[seed % 4],
+        "total_employees": 1_000 + seed % 200_000,
+        "list_date": str(date(1980 + seed % 40, 1 + seed % 12, 1 + seed % 28)),
+        "share_class_shares_outstanding": 50_000_000 + seed % 5_000_000_000,
+        "homepage_url": f"https://www.{ticker.lower()}.example.com",
+        "description": f"{ticker} is a synthetic company used for offline benchmarks. " * 4,
+    })
+
+
+def search_tickers(m, params):
+    term = re.sub(r"[^A-Za-z]", "", params.get("search", "")).upper()[:4] or "X"
+    limit = int(params.get("limit", 10))
+    results = [{"ticker": f"{term}{suffix}"[:5], "name": f"{term.title()} {suffix} Corp", "market": "stocks",
+                "type": "CS", "active": True, "primary_exchange": "XNAS"} for suffix in "ABCDEFGHIJ"[:limit]]
+    return 200, ok(count=len(results), results=results)
+
+
+def news(m, params):
+    ticker = params.get("ticker", "SPY").upper()
+    limit = int(params.get("limit", 10))
+    now = datetime.now(timezone.utc)
+    results = [{
+        "id": f"{ticker}-{i}",
+        "publisher": {"name": ("Benzinga", "Reuters", "The Motley Fool", "Zacks")[i % 4]},
+        "title": f"{ticker} shares move as analysts revisit outlook ({i + 1})",
+        "author": "Bench Writer",
+        "published_utc": (now - timedelta(hours=3 * i)).strftime("%Y-%m-%dT%H:%M:%SZ"),
+        "article_url": f"https://news.example.com/{ticker.lower()}/{i}",
+        "tickers": [ticker],
+        "description": f"A synthetic article about {ticker} used to size realistic news payloads. " * 3,
+        "keywords": ["earnings", "analyst", "outlook"],
+    } for i in range(limit)]
+    return 200, ok(count=len(results), results=results)
+
+
+def dividends(m, params):
+    ticker = params.get("ticker", "SPY").upper()
+    seed = seed_for(ticker)
+    if seed % 5 == 0:
+        return 200, ok(results=[])
+    amount = round(0.1 + seed % 150 / 100, 2)
+    today = datetime.now(MARKET_TZ).date()
+    results = [{
+        "ticker": ticker, "cash_amount": amount, "currency": "USD", "frequency": 4, "dividend_type": "CD",
+        "declaration_date": str(today - timedelta(days=91 * i + 30)),
+        "ex_dividend_date": str(today - timedelta(days=91 * i)),
+        "record_date": str(today - timedelta(days=91 * i - 1)),
+        "pay_date": str(today - timedelta(days=91 * i - 14)),
+    } for i in range(12)]
+    return 200, ok(results=results)
+
+
+def splits(m, params):
+    ticker = params.get("ticker", "SPY").upper()
+    results = [] if seed_for(ticker) % 3 else [
+        {"ticker": ticker, "execution_date": "2020-08-31", "split_from": 1, "split_to": 4}
+    ]
+    return 200, ok(results=results)
+
+
+def market_status(m, params):
+    now = datetime.now(MARKET_TZ)
+    t = now.hour * 60 + now.minute
+    if now.weekday() >= 5:
+        market = "closed"
+    elif 570 <= t < 960:
+        market = "open"
+    elif 240 <= t < 1200:
+        market = "extended-hours"
+    else:
+        market = "closed"
+    exchange = "open" if market == "open" else "closed"
+    return 200, {"market": market, "serverTime": now.isoformat(), "earlyHours": market == "extended-hours" and t < 570,
+                 "afterHours": market == "extended-hours" and t >= 960,
+                 "exchanges": {"nasdaq": exchange, "nyse": exchange, "otc": exchange}}
+
+
+def indicator(m, params):
+    ticker, kind = m["ticker"].upper(), m["kind"]
+    day = last_session()
+    closes = [close_on(ticker, d) for d in trading_days(day - timedelta(days=60), day)]
+    value = round(sum(closes[-int(params.get("window", 14)):]) / min(len(closes), int(params.get("window", 14))), 4)
+    if kind == "rsi":
+        value = round(30 + seed_for(ticker) % 40 + random.Random(day.toordinal()).uniform(0, 5), 2)
+    entry = {"timestamp": day_start_ms(day), "value": value}
+    if kind == "macd":
+        entry.update(signal=round(value * 0.01, 4), histogram=round(value * 0.002, 4), value=round(value * 0.012, 4))
+    return 200, ok(results={"underlying": {"url": ""}, "values": [entry]})
+
+
+ROUTES = [
+    (r"/v2/aggs/ticker/(?P<ticker>[^/]+)/prev", prev_close),
+    (r"/v2/aggs/ticker/(?P<ticker>[^/]+)/range/(?P<multiplier>\d+)/(?P<timespan>\w+)/(?P<from>[^/]+)/(?P<to>[^/]+)",
+     aggregates),
+    (r"/v1/open-close/(?P<ticker>[^/]+)/(?P<date>[\d-]+)", open_close),
+    (r"/v2/snapshot/locale/us/markets/stocks/tickers(?:/(?P<tickers>[^/]+))?", snapshot),
+    (r"/v3/reference/tickers/(?P<ticker>[^/]+)", ticker_details),
+    (r"/v3/reference/tickers", search_tickers),
+    (r"/v2/reference/news", news),
+    (r"/v3/reference/dividends", dividends),
+    (r"/v3/reference/splits", splits),
+    (r"/v1/marketstatus/now", market_status),
+    (r"/v1/indicators/(?P<kind>sma|ema|rsi|macd)/(?P<ticker>[^/]+)", indicator),
+]
+ROUTES = [(re.compile(pattern + "$"), handler) for pattern, handler in ROUTES]
+
+
+def load_fixtures(path: str = FIXTURES_PATH) -> dict:
+    """Recorded responses keyed by request path (query parameters are ignored)"""
+    if not path or not os.path.exists(path):
+        return {}
+    with open(path) as f:
+        return json.load(f)
+
+
+class FakePolygon:
+    """Request handling, fault injection and counters for the stand-in server"""
+
+    def __init__(self, latency_ms: float = 50, jitter_ms: float = 0, rate_429: float = 0.0,
+                 retry_after: float = 1, fixtures: dict = None, seed: int = 0, tick_seconds: float = 0):
+        self.latency_ms = latency_ms
+        self.jitter_ms = jitter_ms
+        self.rate_429 = rate_429
+        self.retry_after = retry_after
+        self.fixtures = fixtures if fixtures is not None else load_fixtures()
+        self.rng = random.Random(seed)
+        self.tick_seconds = tick_seconds
+        self.live = {}  # ticker -> [last tick applied, price, volume] (tick_seconds > 0)
+        self.counts = {}
+        self.throttled = 0
+
+    def reset(self):
+        self.counts.clear()
+        self.throttled = 0
+
+    async def handle(self, path: str, params: dict) -> tuple[int, dict, dict]:
+        template = endpoint_template(path)
+        self.counts[template] = self.counts.get(template, 0) + 1
+        delay = self.latency_ms + self.rng.uniform(-self.jitter_ms, self.jitter_ms)
+        if delay > 0:
+            await asyncio.sleep(delay / 1000)
+        if self.rng.random() < self.rate_429:
+            self.throttled += 1
+            return 429, {"status": "ERROR", "error": "You've exceeded the maximum requests per minute."}, \
+                {"Retry-After": str(self.retry_after)}
+        if path in self.fixtures:
+            return 200, self.fixtures[path], {}
+        for pattern, handler in ROUTES:
+            match = pattern.match(path)
+            if match:
+                status, body = handler(match.groupdict(), params)
+                if handler is snapshot and self.tick_seconds > 0:
+                    tick = int(time.time() / self.tick_seconds)
+                    body["tickers"] = [self.tick_snapshot(item, tick) for item in body["tickers"]]
+                return status, body, {}
+        status, body = not_found(f"No fake route for {path}")
+        return status, body, {}
+
+    def tick_snapshot(self, item: dict, tick: int) -> dict:
+        """Move a snapshot's last price and volume; each tick about half of the tickers change"""
+        state = self.live.setdefault(item["ticker"], [tick, item["lastTrade"]["p"], item["day"]["v"]])
+        while state[0] < tick:
+            state[0] += 1
+            rng = random.Random(seed_for(item["ticker"]) ^ state[0])
+            if rng.random() < 0.5:
+                state[1] = round(state[1] * (1 + rng.uniform(-0.002, 0.002)), 2)
+                state[2] += rng.randint(100, 50_000)
+        change = round(state[1] - item["prevDay"]["c"], 2)
+        item["lastTrade"]["p"] = state[1]
+        item["day"]["v"] = state[2]
+        item["todaysChange"] = change
+        item["todaysChangePerc"] = round(change / item["prevDay"]["c"] * 100, 3)
+        return item
+
+    def stats(self) -> dict:
+        return {
+            "requests": sum(self.counts.values()),
+            "throttled": self.throttled,
+            "by_endpoint": dict(sorted(self.counts.items(), key=lambda item: -item[1])),
+        }
+
+
+def create_app(fake: FakePolygon) -> FastAPI:
+    api = FastAPI()
+
+    @api.get("/_bench/stats")
+    async def bench_stats():
+        return fake.stats()
+
+    @api.post("/_bench/reset")
+    async def bench_reset():
+        fake.reset()
+        return {"ok": True}
+
+    @api.get("/{path:path}")
+    async def polygon(path: str, request: Request):
+        params = {k: v for k, v in request.query_params.items() if k != "apiKey"}
+        status, body, headers = await fake.handle("/" + path, params)
+        return JSONResponse(body, status_code=status, headers=headers)
+
+    return api
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Offline Polygon.io stand-in")
+    parser.add_argument("--port", type=int, default=8900)
+    parser.add_argument("--latency-ms", type=float, default=50)
+    parser.add_argument("--jitter-ms", type=float, default=0)
+    parser.add_argument("--rate-429", type=float, default=0.0)
+    parser.add_argument("--retry-after", type=float, default=1)
+    parser.add_argument("--tick-seconds", type=float, default=0, help="Snapshot prices drift every this many seconds")
+    args = parser.parse_args()
+
+    import uvicorn
+    fake = FakePolygon(args.latency_ms, args.jitter_ms, args.rate_429, args.retry_after, tick_seconds=args.tick_seconds)
+    uvicorn.run(create_app(fake), host="127.0.0.1", port=args.port, log_level="warning")
+
+
+if __name__ == "__main__":
+    main()
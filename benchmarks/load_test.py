@@ -0,0 +1,369 @@
+"""
+Offline load test: N concurrent /ws clients against the real app.
+
+The app runs in this process with its models replaced by ScriptedModel and
+custom_mcp_server.py (spawned as usual over stdio) pointed at the fake
+Polygon server, so no network or API keys are needed and runs are
+reproducible. Reports throughput, end-to-end latency and time-to-first-token
+percentiles, tokens per query (from the app's trace log), how queries were
+answered (agent, fast path, answer cache), errors, and upstream call counts.
+Clients connect through a relay that counts bytes on the wire (after
+permessage-deflate), and a probe task measures event-loop lag, which is
+what slow work on the loop (e.g. rendering) costs every other connection.
+
+Usage:
+    python -m benchmarks.load_test --clients 20 --queries 5
+    python -m benchmarks.load_test --clients 50 --polygon-latency-ms 150 --rate-429 0.05 --out results.json
+    python -m benchmarks.load_test --table-rows 60 --format markdown --no-deflate
+"""
+
+import argparse
+import asyncio
+import contextlib
+import json
+import os
+import random
+import socket
+import sys
+import tempfile
+import time
+
+TICKERS = ["AAPL", "MSFT", "NVDA", "AMZN", "GOOGL", "META", "TSLA", "AMD", "NFLX", "JPM"]
+
+# (weight, template); {t} and {u} are filled with tickers from TICKERS
+QUERY_MIX = [
+    (3, "What's the price of {t}?"),
+    (2, "How is {t} doing today?"),
+    (2, "Latest news on {t}"),
+    (2, "Compare {t} and {u} performance over the last month"),
+    (1, "Show RSI and MACD for {t}"),
+    (1, "Tell me about {t} as a company"),
+    (1, "Does {t} pay a dividend?"),
+    (1, "Is the market open right now?"),
+    (1, "How has {t} performed over the past year?"),
+]
+
+
+def build_queries(clients: int, per_client: int, seed: int) -> list[list[str]]:
+    rng = random.Random(seed)
+    weights = [weight for weight, _ in QUERY_MIX]
+    templates = [template for _, template in QUERY_MIX]
+    plans = []
+    for _ in range(clients):
+        queries = []
+        for template in rng.choices(templates, weights, k=per_client):
+            t, u = rng.sample(TICKERS, 2)
+            queries.append(template.format(t=t, u=u))
+        plans.append(queries)
+    return plans
+
+
+def percentile(values: list[float], q: float) -> float | None:
+    if not values:
+        return None
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, max(0, round(q / 100 * (len(ordered) - 1))))
+    return round(ordered[index], 1)
+
+
+def summarize(values: list[float]) -> dict:
+    return {
+        "p50": percentile(values, 50),
+        "p95": percentile(values, 95),
+        "p99": percentile(values, 99),
+        "max": round(max(values), 1) if values else None,
+    }
+
+
+def free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def configure_environment(args, workdir: str, polygon_port: int):
+    """Environment for the app and the MCP subprocess; must run before app is imported"""
+    os.environ.update({
+        "POLYGON_API_KEY": "benchmark",
+        "ANTHROPIC_API_KEY": "benchmark",
+        "POLYGON_BASE_URL": f"http://127.0.0.1:{polygon_port}",
+        "POLYGON_HTTP2": "false",
+        "MCP_SERVER": "custom",
+        "WEB_CONCURRENCY": "1",
+        "SHARED_STATE_URL": "",
+        "BAR_STORE_PATH": os.path.join(workdir, "bars.sqlite3"),
+        "TRACE_LOG_PATH": os.path.join(workdir, "traces.jsonl"),
+        "ROUTER_LOG_PATH": "",
+        "PREFETCH_ENABLED": "false",
+        "ANSWER_CACHE_ENABLED": str(not args.no_answer_cache).lower(),
+        "FAST_PATH_ENABLED": str(not args.no_fast_path).lower(),
+        # The benchmark measures the server, not the per-client limits
+        "RATE_LIMIT_REQUESTS_PER_MINUTE": "100000",
+        "RATE_LIMIT_BURST": "100000",
+        "RATE_LIMIT_TOKENS_PER_MINUTE": "1000000000",
+        "ANTHROPIC_TOKENS_PER_MINUTE": "1000000000",
+        "POLYGON_CALLS_PER_MINUTE": "0",
+    })
+    os.environ.update(dict(pair.split("=", 1) for pair in args.env))
+
+
+async def serve(asgi_app, port: int):
+    import uvicorn
+    server = uvicorn.Server(uvicorn.Config(asgi_app, host="127.0.0.1", port=port, log_level="warning"))
+    task = asyncio.create_task(server.serve())
+    while not server.started:
+        if task.done():
+            task.result()
+        await asyncio.sleep(0.05)
+    return server, task
+
+
+class ByteCountingRelay:
+    """TCP relay in front of the app that counts bytes on the wire in each direction"""
+
+    def __init__(self, target_port: int):
+        self.target_port = target_port
+        self.to_client = 0
+        self.to_server = 0
+        self.server = None
+
+    async def start(self, port: int):
+        self.server = await asyncio.start_server(self._handle, "127.0.0.1", port)
+
+    async def _handle(self, reader, writer):
+        upstream_reader, upstream_writer = await asyncio.open_connection("127.0.0.1", self.target_port)
+        await asyncio.gather(
+            self._pipe(reader, upstream_writer, "to_server"),
+            self._pipe(upstream_reader, writer, "to_client"),
+        )
+
+    async def _pipe(self, reader, writer, counter: str):
+        try:
+            while data := await reader.read(65536):
+                setattr(self, counter, getattr(self, counter) + len(data))
+                writer.write(data)
+                await writer.drain()
+        except ConnectionError:
+            pass
+        finally:
+            writer.close()
+
+    def close(self):
+        if self.server is not None:
+            self.server.close()
+
+
+async def probe_loop_lag(samples: list, interval: float = 0.01):
+    """How late a short sleep wakes up: time the event loop was busy with something else"""
+    while True:
+        started = time.perf_counter()
+        await asyncio.sleep(interval)
+        samples.append(max(0.0, (time.perf_counter() - started - interval) * 1000))
+
+
+async def run_client(url: str, queries: list[str], results: list, timeout: float, deflate: bool = True):
+    import websockets
+    async with websockets.connect(url, max_size=None, open_timeout=timeout,
+                                  compression="deflate" if deflate else None) as ws:
+        hello = json.loads(await ws.recv())
+        if hello.get("type") != "connected":
+            results.extend({"query": q, "ok": False, "error": hello.get("message")} for q in queries)
+            return
+        for query in queries:
+            start = time.perf_counter()
+            first_token = None
+            received = 0
+            await ws.send(json.dumps({"query": query}))
+            while True:
+                raw = await asyncio.wait_for(ws.recv(), timeout)
+                received += len(raw)
+                message = json.loads(raw)
+                kind = message.get("type")
+                if kind in ("text_delta", "response") and first_token is None:
+                    first_token = time.perf_counter()
+                if kind in ("response", "error"):
+                    break
+            end = time.perf_counter()
+            results.append({
+                "query": query,
+                "ok": kind == "response",
+                "error": message.get("message") if kind == "error" else None,
+                "latency_ms": (end - start) * 1000,
+                "ttft_ms": (first_token - start) * 1000 if first_token else None,
+                "ws_bytes": received,
+            })
+
+
+def read_query_spans(trace_path: str) -> list[dict]:
+    spans = []
+    if not os.path.exists(trace_path):
+        return spans
+    with open(trace_path) as f:
+        for line in f:
+            record = json.loads(line)
+            if record["name"] == "query":
+                spans.append(record["attributes"])
+    return spans
+
+
+def build_report(args, results: list, elapsed: float, spans: list, upstream: dict, app_module,
+                 relay: ByteCountingRelay, loop_lag: list) -> dict:
+    ok = [r for r in results if r["ok"]]
+    agent = [s for s in spans if s.get("path") == "agent" and "input_tokens" in s]
+    paths = {}
+    for span in spans:
+        paths[span.get("path", "unknown")] = paths.get(span.get("path", "unknown"), 0) + 1
+    errors = {}
+    for r in results:
+        if not r["ok"]:
+            errors[r["error"] or "unknown"] = errors.get(r["error"] or "unknown", 0) + 1
+    server = app_module._global_server
+    return {
+        "config": {
+            "clients": args.clients,
+            "queries_per_client": args.queries,
+            "polygon_latency_ms": args.polygon_latency_ms,
+            "rate_429": args.rate_429,
+            "first_token_ms": args.first_token_ms,
+            "tokens_per_second": args.tokens_per_second,
+            "answer_cache": not args.no_answer_cache,
+            "fast_path": not args.no_fast_path,
+            "mcp_server": os.environ.get("MCP_SERVER"),
+            "format": args.format,
+            "deflate": not args.no_deflate,
+            "render_pool": app_module.renderer.pool,
+            "table_rows": args.table_rows,
+            "seed": args.seed,
+        },
+        "queries": len(results),
+        "errors": len(results) - len(ok),
+        "error_messages": errors,
+        "elapsed_s": round(elapsed, 2),
+        "throughput_qps": round(len(ok) / elapsed, 2) if elapsed else None,
+        "latency_ms": summarize([r["latency_ms"] for r in ok]),
+        "ttft_ms": summarize([r["ttft_ms"] for r in ok if r["ttft_ms"] is not None]),
+        "ws_bytes_per_query": round(sum(r["ws_bytes"] for r in ok) / len(ok)) if ok else None,
+        # Includes the handshakes and frame headers, after compression
+        "ws_wire_bytes_per_query": round(relay.to_client / len(ok)) if ok else None,
+        "loop_lag_ms": summarize(loop_lag),
+        "paths": paths,
+        "tokens_per_agent_query": {
+            "input": round(sum(s["input_tokens"] for s in agent) / len(agent)) if agent else None,
+            "output": round(sum(s["output_tokens"] for s in agent) / len(agent)) if agent else None,
+            "model_requests": round(sum(s.get("model_requests", 0) for s in agent) / len(agent), 2) if agent else None,
+            "tool_calls": round(sum(s.get("tool_calls", 0) for s in agent) / len(agent), 2) if agent else None,
+        },
+        "routing": app_module.model_router.stats(),
+        "admission": app_module.admission.stats(),
+        "tool_cache": server.cache_stats() if server else None,
+        "render": app_module.renderer.stats(),
+        "upstream": upstream,
+    }
+
+
+def print_report(report: dict):
+    print(f"\nQueries: {report['queries']}  errors: {report['errors']}  "
+          f"elapsed: {report['elapsed_s']}s  throughput: {report['throughput_qps']} q/s")
+    for name in ("latency_ms", "ttft_ms", "loop_lag_ms"):
+        stats = report[name]
+        print(f"{name:<12} p50={stats['p50']}  p95={stats['p95']}  p99={stats['p99']}  max={stats['max']}")
+    tokens = report["tokens_per_agent_query"]
+    print(f"tokens/agent query: in={tokens['input']} out={tokens['output']}  "
+          f"model requests={tokens['model_requests']}  tool calls={tokens['tool_calls']}")
+    print(f"ws bytes/query: {report['ws_bytes_per_query']} (wire: {report['ws_wire_bytes_per_query']})  "
+          f"paths: {report['paths']}  routing: {report['routing']}")
+    print(f"render: {report['render']}")
+    print(f"tool cache: {report['tool_cache']}  admission: {report['admission']}")
+    upstream = report["upstream"]
+    print(f"upstream Polygon requests: {upstream['requests']} (429s: {upstream['throttled']})")
+    for template, count in upstream["by_endpoint"].items():
+        print(f"  {count:>6}  {template}")
+    for message, count in report["error_messages"].items():
+        print(f"error x{count}: {message}")
+
+
+async def main(args):
+    workdir = tempfile.mkdtemp(prefix="mcp-bench-")
+    polygon_port, app_port, relay_port = free_port(), free_port(), free_port()
+    configure_environment(args, workdir, polygon_port)
+
+    from benchmarks.fake_polygon import FakePolygon, create_app
+    from benchmarks.scripted_model import ScriptedModel
+
+    fake = FakePolygon(args.polygon_latency_ms, args.polygon_jitter_ms, args.rate_429, seed=args.seed)
+    app_log = open(os.path.join(workdir, "app.log"), "w")
+    # The app logs every query; keep it out of the report
+    with contextlib.redirect_stdout(app_log):
+        import app as app_module
+        from model_router import FAST_TIER, STANDARD_TIER
+        app_module.MODEL_TIERS[FAST_TIER] = ScriptedModel(
+            "scripted-fast", args.first_token_ms / 2, args.tokens_per_second * 2, args.answer_words, args.table_rows
+        )
+        app_module.MODEL_TIERS[STANDARD_TIER] = ScriptedModel(
+            "scripted-standard", args.first_token_ms, args.tokens_per_second, args.answer_words, args.table_rows
+        )
+        polygon_server, polygon_task = await serve(create_app(fake), polygon_port)
+        app_server, app_task = await serve(app_module.app, app_port)
+        relay = ByteCountingRelay(app_port)
+        await relay.start(relay_port)
+        fake.reset()  # Count only what the queries cause
+
+        plans = build_queries(args.clients, args.queries, args.seed)
+        results = []
+        loop_lag = []
+        probe = asyncio.create_task(probe_loop_lag(loop_lag))
+        url = f"ws://127.0.0.1:{relay_port}/ws?format={args.format}"
+        start = time.perf_counter()
+        outcomes = await asyncio.gather(*(
+            run_client(url, queries, results, args.timeout, not args.no_deflate) for queries in plans
+        ), return_exceptions=True)
+        elapsed = time.perf_counter() - start
+        probe.cancel()
+
+        relay.close()
+        app_server.should_exit = True
+        polygon_server.should_exit = True
+        await asyncio.gather(app_task, polygon_task, return_exceptions=True)
+    app_log.close()
+
+    for outcome in outcomes:
+        if isinstance(outcome, Exception):
+            results.append({"query": None, "ok": False, "error": f"client: {outcome!r}", "ws_bytes": 0})
+    report = build_report(args, results, elapsed, read_query_spans(os.environ["TRACE_LOG_PATH"]),
+                          fake.stats(), app_module, relay, loop_lag)
+    report["workdir"] = workdir
+    print_report(report)
+    print(f"App log and traces: {workdir}")
+    if args.out:
+        with open(args.out, "w") as f:
+            json.dump(report, f, indent=2)
+    return report
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Offline WebSocket load test with fake Polygon and scripted models")
+    parser.add_argument("--clients", type=int, default=10, help="Concurrent WebSocket clients")
+    parser.add_argument("--queries", type=int, default=5, help="Queries per client (sent one after another)")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--polygon-latency-ms", type=float, default=80)
+    parser.add_argument("--polygon-jitter-ms", type=float, default=20)
+    parser.add_argument("--rate-429", type=float, default=0.0, help="Fraction of Polygon requests answered with 429")
+    parser.add_argument("--first-token-ms", type=float, default=600, help="Standard-tier time to first token")
+    parser.add_argument("--tokens-per-second", type=float, default=80, help="Standard-tier streaming speed")
+    parser.add_argument("--answer-words", type=int, default=150)
+    parser.add_argument("--table-rows", type=int, default=0, help="Extra table rows per scripted answer")
+    parser.add_argument("--format", default="full", choices=["full", "html", "markdown"],
+                        help="Response format the clients negotiate (/ws?format=...)")
+    parser.add_argument("--no-deflate", action="store_true", help="Clients do not offer permessage-deflate")
+    parser.add_argument("--no-answer-cache", action="store_true")
+    parser.add_argument("--no-fast-path", action="store_true")
+    parser.add_argument("--timeout", type=float, default=120)
+    parser.add_argument("--env", action="append", default=[], metavar="NAME=VALUE",
+                        help="Extra app environment (e.g. --env MCP_POOL_SIZE=4)")
+    parser.add_argument("--out", help="Write the report as JSON")
+    return parser.parse_args(argv)
+
+
+if __name__ == "__main__":
+    report = asyncio.run(main(parse_args()))
+    sys.exit(1 if report["errors"] else 0)
@@ -0,0 +1,196 @@
+"""
+Scripted stand-in for the Anthropic models used by the benchmarks.
+
+The model plans the tool calls a real model would make for a query (prices,
+news, history, indicators, ...) using only the tools the run exposes, issues
+them over one or two rounds, then streams a markdown answer built from the
+tool results. Time to first token and streaming speed are simulated, and
+input tokens are estimated from everything a real request would carry
+(system prompt, history, tool results and tool schemas) so token counts
+respond to tool subsetting and history compaction.
+"""
+
+import asyncio
+import json
+import re
+from contextlib import asynccontextmanager
+from datetime import date, timedelta
+
+from pydantic_ai.messages import (
+    ModelRequest,
+    ModelResponse,
+    SystemPromptPart,
+    TextPart,
+    ToolCallPart,
+    ToolReturnPart,
+    UserPromptPart,
+)
+from pydantic_ai.models.function import AgentInfo, DeltaToolCall, FunctionModel
+
+from custom_mcp_server import CHARS_PER_TOKEN
+from model_router import NOT_TICKERS
+
+# Query words that trigger each kind of tool call
+PRICE_WORDS = {"price", "prices", "quote", "trading", "worth", "doing", "now", "today", "current"}
+NEWS_WORDS = {"news", "headline", "headlines", "sentiment", "articles"}
+HISTORY_WORDS = {"history", "historical", "performance", "trend", "compare", "month", "week", "year",
+                 "ytd", "returns", "return", "chart", "volatility"}
+INDICATOR_WORDS = {"rsi", "sma", "ema", "macd", "technical", "indicators", "overbought", "oversold", "moving"}
+DETAIL_WORDS = {"company", "about", "sector", "industry", "employees", "cap", "capitalization", "fundamentals"}
+DIVIDEND_WORDS = {"dividend", "dividends", "payout", "yield"}
+MARKET_WORDS = {"market", "open", "closed", "session"}
+
+
+def query_tickers(query: str) -> list[str]:
+    tickers = re.findall(r"\$([A-Za-z]{1,5})\b", query)
+    tickers += [w for w in re.findall(r"\b[A-Z]{1,5}\b", query) if w not in NOT_TICKERS]
+    return list(dict.fromkeys(t.upper() for t in tickers))
+
+
+def first_visible(visible: set, *names: str) -> str | None:
+    return next((name for name in names if name in visible), None)
+
+
+def plan_rounds(query: str, visible: set) -> list[list[tuple[str, dict]]]:
+    """Tool calls per model round: independent lookups first, history and comparisons after"""
+    words = set(re.findall(r"[a-z]+", query.lower()))
+    tickers = query_tickers(query)[:5]
+    first, second = [], []
+
+    def add(calls: list, names: tuple, args_for):
+        """Prefer a batch tool for several tickers, else one call per ticker with the single-ticker tool"""
+        batch = first_visible(visible, *(name for name in names if name.endswith("_batch")))
+        single = first_visible(visible, *(name for name in names if not name.endswith("_batch")))
+        if batch and len(tickers) > 1:
+            calls.append((batch, {"tickers": tickers}))
+        elif single:
+            calls.extend((single, args_for(ticker)) for ticker in tickers)
+
+    if words & MARKET_WORDS and not tickers:
+        if "get_market_status" in visible:
+            first.append(("get_market_status", {}))
+        if "get_snapshot_all_tickers" in visible:
+            first.append(("get_snapshot_all_tickers", {"tickers": "SPY,QQQ,DIA,IWM"}))
+    if tickers and (words & PRICE_WORDS or not words & (NEWS_WORDS | DETAIL_WORDS | DIVIDEND_WORDS)):
+        add(first, ("get_stock_price_batch", "get_stock_price", "get_previous_close"), lambda t: {"ticker": t})
+    if words & NEWS_WORDS:
+        add(first, ("get_ticker_news",), lambda t: {"ticker": t, "limit": 5})
+    if words & DETAIL_WORDS:
+        add(first, ("get_ticker_details_batch", "get_ticker_details"), lambda t: {"ticker": t})
+    if words & DIVIDEND_WORDS:
+        add(first, ("get_dividends",), lambda t: {"ticker": t})
+    if words & INDICATOR_WORDS and tickers:
+        if "get_indicators" in visible:
+            first.append(("get_indicators", {"tickers": tickers, "sma_windows": [50], "rsi_window": 14, "macd": True}))
+        elif "get_rsi" in visible:
+            first.extend(("get_rsi", {"ticker": t, "timespan": "day"}) for t in tickers)
+    if words & HISTORY_WORDS and "get_aggregates" in visible:
+        end = date.today()
+        start = end - timedelta(days=365 if "year" in words or "ytd" in words else 30)
+        second.extend(("get_aggregates", {
+            "ticker": t, "multiplier": 1, "timespan": "day", "from_date": str(start), "to_date": str(end),
+        }) for t in tickers)
+    return [calls for calls in (first, second) if calls]
+
+
+def current_turn(messages: list) -> tuple[str, list[ToolReturnPart], int]:
+    """The latest user prompt, the tool results since it and how many model rounds have run"""
+    returns, rounds = [], 0
+    for message in reversed(messages):
+        if isinstance(message, ModelResponse):
+            rounds += 1
+            continue
+        for part in message.parts:
+            if isinstance(part, ToolReturnPart):
+                returns.append(part)
+            elif isinstance(part, UserPromptPart):
+                return str(part.content), list(reversed(returns)), rounds
+    return "", list(reversed(returns)), rounds
+
+
+def answer_markdown(query: str, returns: list[ToolReturnPart], answer_words: int, table_rows: int = 0) -> str:
+    """A realistic answer: a summary table of tool results, an optional daily table, then commentary"""
+    lines = [f"## {query.strip().rstrip('?')}", ""]
+    if returns:
+        lines += ["| Source | Result |", "|---|---|"]
+        for part in returns:
+            text = re.sub(r"\s+", " ", part.model_response_str())[:120].replace("|", "/")
+            lines.append(f"| `{part.tool_name}` | {text} |")
+        lines.append("")
+    if table_rows:
+        # Table-heavy answers (e.g. a month of daily bars) are the expensive ones to render
+        lines += ["| Date | Open | High | Low | Close | Volume |", "|---|---:|---:|---:|---:|---:|"]
+        day = date(2025, 1, 2)
+        for i in range(table_rows):
+            close = 100 + (i * 37 % 23) - 11
+            lines.append(f"| {day + timedelta(days=i)} | {close - 0.8:.2f} | {close + 1.4:.2f} | "
+                         f"{close - 1.9:.2f} | **{close:.2f}** | {1_000_000 + i * 7919:,} |")
+        lines.append("")
+    filler = ("Based on the latest data, the move is in line with the broader market and volume "
+              "is close to its recent average, so there is no unusual activity to flag. ").split()
+    body = [filler[i % len(filler)] for i in range(answer_words)]
+    for start in range(0, len(body), 40):
+        lines.append(" ".join(body[start:start + 40]))
+        lines.append("")
+    return "\n".join(lines)
+
+
+def estimate_input_tokens(messages: list, info: AgentInfo) -> int:
+    """Roughly what a provider would bill: every message part plus the tool schemas"""
+    chars = 0
+    for message in messages:
+        for part in message.parts:
+            if isinstance(part, (SystemPromptPart, UserPromptPart)):
+                chars += len(str(part.content))
+            elif isinstance(part, ToolReturnPart):
+                chars += len(part.model_response_str())
+            elif isinstance(part, TextPart):
+                chars += len(part.content)
+            elif isinstance(part, ToolCallPart):
+                chars += len(part.args_as_json_str()) + len(part.tool_name)
+            elif isinstance(message, ModelRequest):
+                chars += len(str(getattr(part, "content", "")))
+    for tool in info.function_tools:
+        chars += len(tool.name) + len(tool.description or "") + len(json.dumps(tool.parameters_json_schema))
+    return chars // CHARS_PER_TOKEN
+
+
+class ScriptedModel(FunctionModel):
+    """FunctionModel that plays out plan_rounds with simulated latency and realistic usage"""
+
+    def __init__(self, name: str = "scripted", first_token_ms: float = 600, tokens_per_second: float = 80,
+                 answer_words: int = 150, table_rows: int = 0):
+        self.first_token_ms = first_token_ms
+        self.tokens_per_second = tokens_per_second
+        self.answer_words = answer_words
+        self.table_rows = table_rows
+        super().__init__(stream_function=self.stream, model_name=name)
+
+    async def stream(self, messages: list, info: AgentInfo):
+        await asyncio.sleep(self.first_token_ms / 1000)
+        query, returns, rounds = current_turn(messages)
+        plan = plan_rounds(query, {tool.name for tool in info.function_tools})
+        if rounds < len(plan):
+            yield {
+                i: DeltaToolCall(name=name, json_args=json.dumps(args), tool_call_id=f"call_{rounds}_{i}")
+                for i, (name, args) in enumerate(plan[rounds])
+            }
+            return
+        text = answer_markdown(query, returns, self.answer_words, self.table_rows)
+        chunk_chars = 4 * CHARS_PER_TOKEN
+        for start in range(0, len(text), chunk_chars):
+            yield text[start:start + chunk_chars]
+            await asyncio.sleep(4 / self.tokens_per_second)
+
+    @asynccontextmanager
+    async def request_stream(self, messages, model_settings, model_request_parameters, run_context=None):
+        async with super().request_stream(
+            messages, model_settings, model_request_parameters, run_context
+        ) as response:
+            info = AgentInfo(
+                function_tools=model_request_parameters.function_tools, allow_text_output=True,
+                output_tools=[], model_settings=model_settings,
+            )
+            # FunctionModel only counts a fixed overhead for streamed input
+            response._usage.input_tokens = estimate_input_tokens(messages, info)
+            yield response
@@ -0,0 +1,217 @@
+"""
+Import time and startup latency of the app, optionally against an older commit.
+
+For each tree the app is imported with `python -X importtime` (wall time and
+the heaviest modules it imports directly), then started under uvicorn, and
+the time is taken from spawning the process to the first successful health
+check (serving) and to readiness (/readyz, or for trees without it the
+first response at all, since their startup blocked until the MCP servers
+were up). The current tree is started twice: without and with the on-disk
+tool list cache. /readyz's per-step timings are included.
+
+Usage:
+    python -m benchmarks.startup
+    python -m benchmarks.startup --baseline <commit> --runs 5 --out startup.json
+"""
+
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import urllib.error
+import urllib.request
+
+from benchmarks.load_test import free_port
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def app_environment(workdir: str, mcp_server: str) -> dict:
+    return dict(
+        os.environ,
+        POLYGON_API_KEY="benchmark",
+        ANTHROPIC_API_KEY="benchmark",
+        MCP_SERVER=mcp_server,
+        WEB_CONCURRENCY="1",
+        SHARED_STATE_URL="",
+        PREFETCH_ENABLED="false",
+        TRACE_LOG_PATH="",
+        BAR_STORE_PATH=os.path.join(workdir, "bars.sqlite3"),
+        TOOLS_CACHE_PATH=os.path.join(workdir, "mcp_tools.json"),
+    )
+
+
+def parse_importtime(stderr: str, top: int) -> dict:
+    """Cumulative microseconds of `app` and of the heaviest modules it imports directly"""
+    rows = []
+    for line in stderr.splitlines():
+        if not line.startswith("import time:") or "cumulative" in line:
+            continue
+        _, cumulative_us, name = line.split("|", 2)
+        rows.append((len(name) - len(name.lstrip()), name.strip(), int(cumulative_us)))
+    app_index = next(i for i, row in enumerate(rows) if row[1] == "app")
+    app_depth = rows[app_index][0]
+    children = []
+    for depth, name, cumulative in reversed(rows[:app_index]):
+        if depth <= app_depth:
+            break
+        if depth == app_depth + 2:
+            children.append((name, cumulative))
+    children.sort(key=lambda child: -child[1])
+    return {
+        "app_ms": rows[app_index][2] / 1000,
+        "heaviest": {name: round(us / 1000, 1) for name, us in children[:top]},
+    }
+
+
+def measure_imports(tree: str, env: dict, runs: int, top: int) -> dict:
+    samples = []
+    for _ in range(runs):
+        result = subprocess.run(
+            [sys.executable, "-W", "ignore", "-X", "importtime", "-c", "import app"],
+            cwd=tree, env=env, capture_output=True, text=True, check=True,
+        )
+        samples.append(parse_importtime(result.stderr, top))
+    best = min(samples, key=lambda sample: sample["app_ms"])
+    return {
+        "import_ms_median": round(statistics.median(s["app_ms"] for s in samples), 1),
+        "import_ms_min": round(best["app_ms"], 1),
+        "heaviest_imports_ms": best["heaviest"],
+    }
+
+
+def get(url: str):
+    """(status, parsed JSON or None), or (None, None) if nothing is listening yet"""
+    try:
+        with urllib.request.urlopen(url, timeout=1) as response:
+            body = response.read()
+            status = response.status
+    except urllib.error.HTTPError as e:
+        body, status = e.read(), e.code
+    except OSError:
+        return None, None
+    try:
+        return status, json.loads(body)
+    except ValueError:
+        return status, None
+
+
+def measure_startup(tree: str, env: dict, timeout: float) -> dict:
+    port = free_port()
+    base = f"http://127.0.0.1:{port}"
+    started = time.perf_counter()
+    process = subprocess.Popen(
+        [sys.executable, "-W", "ignore", "-m", "uvicorn", "app:app", "--host", "127.0.0.1", "--port", str(port)],
+        cwd=tree, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+    )
+    serving = ready = None
+    steps = tool_list = None
+    legacy = False
+    try:
+        while time.perf_counter() - started < timeout:
+            status, _ = get(f"{base}/healthz")
+            if status is not None and serving is None:
+                serving = time.perf_counter() - started
+                legacy = status == 404
+            if legacy:
+                # No /readyz: the old startup only began serving once everything was up
+                ready = serving
+                break
+            if serving is not None:
+                status, body = get(f"{base}/readyz")
+                if status == 200:
+                    ready = time.perf_counter() - started
+                    steps = body.get("steps")
+                    tool_list = body.get("tool_list")
+                    break
+            time.sleep(0.01)
+    finally:
+        process.terminate()
+        process.wait(timeout=30)
+    return {
+        "serving_ms": round(serving * 1000, 1) if serving is not None else None,
+        "ready_ms": round(ready * 1000, 1) if ready is not None else None,
+        "tool_list": tool_list,
+        "steps_ms": {
+            name: {"start": step["started_ms"], "duration": step["duration_ms"]} for name, step in steps.items()
+        } if steps else None,
+    }
+
+
+def median_run(results: list[dict]) -> dict:
+    """The run with the median readiness time"""
+    ordered = sorted(results, key=lambda r: (r["ready_ms"] is None, r["ready_ms"] or 0))
+    return ordered[len(ordered) // 2]
+
+
+def measure_tree(label: str, tree: str, args) -> dict:
+    workdir = tempfile.mkdtemp(prefix="mcp-startup-")
+    env = app_environment(workdir, args.mcp_server)
+    report = {"tree": tree, **measure_imports(tree, env, args.runs, args.top)}
+    cold, warm = [], []
+    for _ in range(args.runs):
+        # No cached tool list, then with the one the first start wrote
+        if os.path.exists(env["TOOLS_CACHE_PATH"]):
+            os.remove(env["TOOLS_CACHE_PATH"])
+        cold.append(measure_startup(tree, env, args.timeout))
+        warm.append(measure_startup(tree, env, args.timeout))
+    report["startup_cold_tools"] = median_run(cold)
+    report["startup_warm_tools"] = median_run(warm)
+    print_tree(label, report)
+    return report
+
+
+def print_tree(label: str, report: dict):
+    print(f"\n{label}: {report['tree']}")
+    print(f"  import app: median {report['import_ms_median']}ms (min {report['import_ms_min']}ms)")
+    for name, ms in report["heaviest_imports_ms"].items():
+        print(f"    {ms:>8}ms  {name}")
+    for key in ("startup_cold_tools", "startup_warm_tools"):
+        run = report[key]
+        print(f"  {key}: serving {run['serving_ms']}ms  ready {run['ready_ms']}ms"
+              + (f"  (tool list from {run['tool_list']})" if run["tool_list"] else ""))
+        for name, step in (run["steps_ms"] or {}).items():
+            print(f"    {name:<12} +{step['start']}ms  took {step['duration']}ms")
+
+
+def extract(ref: str) -> str:
+    """The tree at a git ref, in a temporary directory"""
+    target = tempfile.mkdtemp(prefix="mcp-baseline-")
+    archive = subprocess.run(["git", "archive", ref], cwd=ROOT, capture_output=True, check=True).stdout
+    subprocess.run(["tar", "-x", "-C", target], input=archive, check=True)
+    return target
+
+
+def main(args):
+    report = {"config": vars(args), "current": measure_tree("current", ROOT, args)}
+    if args.baseline:
+        report["baseline"] = measure_tree(f"baseline ({args.baseline})", extract(args.baseline), args)
+        before, after = report["baseline"], report["current"]
+        print("\nbefore -> after")
+        print(f"  import app: {before['import_ms_median']}ms -> {after['import_ms_median']}ms")
+        for key in ("serving_ms", "ready_ms"):
+            print(f"  {key} (warm tools): {before['startup_warm_tools'][key]}ms -> "
+                  f"{after['startup_warm_tools'][key]}ms")
+    if args.out:
+        with open(args.out, "w") as f:
+            json.dump(report, f, indent=2)
+    return report
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Measure import time and time to serving/ready")
+    parser.add_argument("--baseline", help="Git ref to compare against (e.g. a commit before a change)")
+    parser.add_argument("--runs", type=int, default=3, help="Imports and starts per tree (the median is reported)")
+    parser.add_argument("--mcp-server", default="custom", choices=["custom", "inprocess", "polygon"])
+    parser.add_argument("--top", type=int, default=8, help="How many of the heaviest imports to list")
+    parser.add_argument("--timeout", type=float, default=60, help="Seconds to wait for readiness")
+    parser.add_argument("--out", help="Write the report as JSON")
+    return parser.parse_args(argv)
+
+
+if __name__ == "__main__":
+    main(parse_args())
@@ -0,0 +1,132 @@
+"""
+Per-tool-call latency: custom_mcp_server over stdio vs in-process.
+
+Both modes serve the same tool calls from the fake Polygon server. With
+--polygon-latency-ms 0 (the default) the difference is the transport itself:
+JSON-RPC encoding, pipe I/O and the subprocess's event loop for stdio, a
+coroutine call for in-process. Calls are timed in two phases: "cold", with
+arguments not seen before (Polygon is called), and "warm", with repeated
+arguments (served from custom_mcp_server's response cache).
+
+Usage:
+    python -m benchmarks.tool_latency --iterations 200
+    python -m benchmarks.tool_latency --concurrency 8 --polygon-latency-ms 50 --out tool_latency.json
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import sys
+import tempfile
+import time
+
+from benchmarks.load_test import TICKERS, free_port, serve, summarize
+
+# (tool, arguments) with {t} filled per call
+TOOL_CALLS = [
+    ("get_stock_price", {"ticker": "{t}"}),
+    ("get_ticker_details", {"ticker": "{t}"}),
+    ("get_ticker_news", {"ticker": "{t}", "limit": 5}),
+    ("get_stock_price_batch", {"tickers": ["{t}", "SPY", "QQQ"]}),
+    ("get_previous_close", {"ticker": "{t}"}),
+]
+
+
+def fill(arguments: dict, ticker: str) -> dict:
+    return json.loads(json.dumps(arguments).replace("{t}", ticker))
+
+
+def cold_tickers(iterations: int) -> list[str]:
+    """Distinct tickers so cold calls never hit a cache"""
+    letters = "ABCDEFGHIJKLMNOPQRSTUVWXYZ"
+    return [f"Z{letters[i // 676 % 26]}{letters[i // 26 % 26]}{letters[i % 26]}" for i in range(iterations)]
+
+
+async def time_calls(server, calls: list[tuple[str, dict]], concurrency: int) -> dict:
+    """Milliseconds per call, grouped by tool"""
+    timings = {}
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def one(name, arguments):
+        async with semaphore:
+            started = time.perf_counter()
+            await server.call_tool(name, arguments, None, None)
+            timings.setdefault(name, []).append((time.perf_counter() - started) * 1000)
+
+    await asyncio.gather(*(one(name, arguments) for name, arguments in calls))
+    return timings
+
+
+async def measure(server, mode: str, args) -> dict:
+    results = {}
+    async with server:
+        for phase, tickers in (("cold", cold_tickers(args.iterations)), ("warm", TICKERS)):
+            calls = [
+                (name, fill(arguments, tickers[i % len(tickers)]))
+                for i in range(args.iterations) for name, arguments in TOOL_CALLS
+            ]
+            if phase == "warm":
+                await time_calls(server, calls[:len(TOOL_CALLS) * len(TICKERS)], args.concurrency)
+            timings = await time_calls(server, calls, args.concurrency)
+            results[phase] = {
+                "all": summarize([ms for values in timings.values() for ms in values]),
+                "by_tool": {name: summarize(values) for name, values in timings.items()},
+            }
+    print(f"{mode:<10} cold p50={results['cold']['all']['p50']}ms p95={results['cold']['all']['p95']}ms   "
+          f"warm p50={results['warm']['all']['p50']}ms p95={results['warm']['all']['p95']}ms")
+    return results
+
+
+async def main(args):
+    workdir = tempfile.mkdtemp(prefix="mcp-tool-bench-")
+    polygon_port = free_port()
+    os.environ.update({
+        "POLYGON_API_KEY": "benchmark",
+        "POLYGON_BASE_URL": f"http://127.0.0.1:{polygon_port}",
+        "POLYGON_HTTP2": "false",
+        "BAR_STORE_PATH": os.path.join(workdir, "bars.sqlite3"),
+    })
+
+    from pydantic_ai.mcp import MCPServerStdio
+    from benchmarks.fake_polygon import FakePolygon, create_app
+    from inprocess_tools import InProcessToolServer
+
+    fake = FakePolygon(args.polygon_latency_ms, 0, 0.0)
+    polygon_server, polygon_task = await serve(create_app(fake), polygon_port)
+
+    script = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "custom_mcp_server.py")
+    modes = {
+        "stdio": lambda: MCPServerStdio(command=sys.executable, args=[script], env=os.environ.copy()),
+        "inprocess": lambda: InProcessToolServer(),
+    }
+    report = {"config": vars(args), "modes": {}}
+    for mode in args.modes:
+        report["modes"][mode] = await measure(modes[mode](), mode, args)
+        report["modes"][mode]["upstream_requests"] = fake.stats()["requests"]
+        fake.reset()
+
+    polygon_server.should_exit = True
+    await polygon_task
+    if {"stdio", "inprocess"} <= set(report["modes"]):
+        for phase in ("cold", "warm"):
+            stdio, inprocess = (report["modes"][m][phase]["all"]["p50"] for m in ("stdio", "inprocess"))
+            print(f"{phase} p50 saved per call: {round(stdio - inprocess, 2)}ms")
+    if args.out:
+        with open(args.out, "w") as f:
+            json.dump(report, f, indent=2)
+    return report
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Compare per-tool-call latency of stdio and in-process tools")
+    parser.add_argument("--iterations", type=int, default=100, help="Calls per tool and phase")
+    parser.add_argument("--concurrency", type=int, default=1)
+    parser.add_argument("--polygon-latency-ms", type=float, default=0)
+    parser.add_argument("--modes", nargs="+", default=["stdio", "inprocess"], choices=["stdio", "inprocess"])
+    parser.add_argument("--out", help="Write the report as JSON")
+    return parser.parse_args(argv)
+
+
+if __name__ == "__main__":
+    asyncio.run(main(parse_args()))
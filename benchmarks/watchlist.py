@@ -0,0 +1,194 @@
+"""
+Watchlist subscriptions under load: upstream calls and pushed bytes.
+
+Runs the real app in-process against the fake Polygon (with snapshot prices
+drifting every --tick-seconds), connects N WebSocket clients that each
+subscribe to a random watchlist drawn from a ticker universe, and keeps them
+connected for --duration seconds. Reports how many snapshot requests Polygon
+saw per poll (compared with every session polling its own watchlist), how
+many quote updates each client received, how long the first quotes took,
+and WebSocket bytes per client.
+
+Usage:
+    python -m benchmarks.watchlist
+    python -m benchmarks.watchlist --clients 200 --tickers-per-client 10 --universe 120 --duration 30
+"""
+
+import argparse
+import asyncio
+import contextlib
+import json
+import os
+import random
+import statistics
+import sys
+import tempfile
+import time
+
+from benchmarks.load_test import free_port, serve, summarize
+
+SNAPSHOT_TEMPLATE = "/v2/snapshot/locale/us/markets/stocks/tickers"
+
+
+def configure_environment(args, workdir: str, polygon_port: int):
+    """App environment; must run before app is imported"""
+    os.environ.update({
+        "POLYGON_API_KEY": "benchmark",
+        "ANTHROPIC_API_KEY": "benchmark",
+        "POLYGON_BASE_URL": f"http://127.0.0.1:{polygon_port}",
+        "POLYGON_HTTP2": "false",
+        # Watchlists need no model or tools; in-process tools avoid spawning MCP servers
+        "MCP_SERVER": "inprocess",
+        "WEB_CONCURRENCY": "1",
+        "SHARED_STATE_URL": "",
+        "BAR_STORE_PATH": os.path.join(workdir, "bars.sqlite3"),
+        "TRACE_LOG_PATH": os.path.join(workdir, "traces.jsonl"),
+        "PREFETCH_ENABLED": "false",
+        "WATCHLIST_INTERVAL": str(args.interval),
+        "WATCHLIST_MAX_TICKERS": str(max(args.tickers_per_client, 1)),
+    })
+
+
+def universe(size: int) -> list[str]:
+    """Synthetic tickers: real-looking large caps first, then generated symbols"""
+    base = ["SPY", "QQQ", "AAPL", "MSFT", "NVDA", "AMZN", "GOOGL", "META", "TSLA", "AMD", "NFLX", "KO"]
+    generated = [f"T{i:03d}" for i in range(max(0, size - len(base)))]
+    return (base + generated)[:size]
+
+
+async def run_client(url: str, tickers: list[str], duration: float, results: list):
+    import websockets
+    async with websockets.connect(url, max_size=None) as ws:
+        hello = json.loads(await ws.recv())
+        if hello.get("type") != "connected":
+            results.append({"ok": False, "error": hello.get("message")})
+            return
+        subscribed = time.perf_counter()
+        await ws.send(json.dumps({"type": "subscribe", "tickers": tickers}))
+        quoted = set()
+        first_full = None
+        messages = updates = received = 0
+        deadline = subscribed + duration
+        while (remaining := deadline - time.perf_counter()) > 0:
+            try:
+                raw = await asyncio.wait_for(ws.recv(), remaining)
+            except asyncio.TimeoutError:
+                break
+            received += len(raw)
+            message = json.loads(raw)
+            if message.get("type") == "error":
+                results.append({"ok": False, "error": message.get("message")})
+                return
+            if message.get("type") not in ("watchlist", "quotes"):
+                continue
+            messages += 1
+            quotes = message.get("quotes") or {}
+            if message["type"] == "quotes":
+                updates += len(quotes)
+            quoted.update(quotes)
+            if first_full is None and quoted >= set(tickers):
+                first_full = time.perf_counter()
+        results.append({
+            "ok": first_full is not None,
+            "error": None if first_full is not None else "never received every quote",
+            "first_quotes_ms": (first_full - subscribed) * 1000 if first_full else None,
+            "messages": messages,
+            "quote_updates": updates,
+            "ws_bytes": received,
+        })
+
+
+async def main(args):
+    workdir = tempfile.mkdtemp(prefix="mcp-watchlist-")
+    polygon_port, app_port = free_port(), free_port()
+    configure_environment(args, workdir, polygon_port)
+
+    from benchmarks.fake_polygon import FakePolygon, create_app
+
+    fake = FakePolygon(args.polygon_latency_ms, 0, 0.0, seed=args.seed, tick_seconds=args.tick_seconds)
+    rng = random.Random(args.seed)
+    tickers = universe(args.universe)
+    plans = [rng.sample(tickers, min(args.tickers_per_client, len(tickers))) for _ in range(args.clients)]
+
+    app_log = open(os.path.join(workdir, "app.log"), "w")
+    with contextlib.redirect_stdout(app_log):
+        import app as app_module
+        polygon_server, polygon_task = await serve(create_app(fake), polygon_port)
+        app_server, app_task = await serve(app_module.app, app_port)
+        await app_module.startup.wait(timeout=60)
+        fake.reset()
+
+        results = []
+        url = f"ws://127.0.0.1:{app_port}/ws"
+        start = time.perf_counter()
+        await asyncio.gather(*(run_client(url, plan, args.duration, results) for plan in plans),
+                             return_exceptions=True)
+        elapsed = time.perf_counter() - start
+        poller = app_module.watchlist.stats()
+
+        app_server.should_exit = True
+        polygon_server.should_exit = True
+        await asyncio.gather(app_task, polygon_task, return_exceptions=True)
+    app_log.close()
+
+    upstream = fake.stats()
+    snapshot_calls = upstream["by_endpoint"].get(SNAPSHOT_TEMPLATE, 0)
+    ok = [r for r in results if r["ok"]]
+    watched = len(set().union(*map(set, plans)))
+    report = {
+        "config": vars(args),
+        "clients": len(results),
+        "errors": sum(not r["ok"] for r in results),
+        "elapsed_s": round(elapsed, 2),
+        "watched_tickers": watched,
+        "polls": poller["polls"],
+        "upstream_requests": upstream["requests"],
+        "snapshot_requests": snapshot_calls,
+        "snapshot_requests_per_poll": round(snapshot_calls / poller["polls"], 2) if poller["polls"] else None,
+        # The same watchlists polled by each session on its own, one snapshot call per session per interval
+        "per_session_polling_requests": len(plans) * poller["polls"],
+        "first_quotes_ms": summarize([r["first_quotes_ms"] for r in ok]),
+        "quote_updates_per_client": round(statistics.mean(r["quote_updates"] for r in ok), 1) if ok else 0,
+        "messages_per_client": round(statistics.mean(r["messages"] for r in ok), 1) if ok else 0,
+        "ws_bytes_per_client": round(statistics.mean(r["ws_bytes"] for r in ok)) if ok else 0,
+        "pushes": poller["pushes"],
+        "quotes_pushed": poller["quotes_pushed"],
+        "workdir": workdir,
+    }
+    print_report(report)
+    if args.out:
+        with open(args.out, "w") as f:
+            json.dump(report, f, indent=2)
+    return report
+
+
+def print_report(report: dict):
+    print(f"Clients: {report['clients']}  errors: {report['errors']}  elapsed: {report['elapsed_s']}s  "
+          f"watched tickers: {report['watched_tickers']}")
+    print(f"polls: {report['polls']}  snapshot requests: {report['snapshot_requests']} "
+          f"({report['snapshot_requests_per_poll']} per poll; per-session polling would make "
+          f"{report['per_session_polling_requests']})  all Polygon requests: {report['upstream_requests']}")
+    first = report["first_quotes_ms"]
+    print(f"first quotes ms  p50={first['p50']}  p95={first['p95']}  max={first['max']}")
+    print(f"per client: {report['messages_per_client']} messages, {report['quote_updates_per_client']} quote "
+          f"updates, {report['ws_bytes_per_client']} bytes")
+    print(f"App log and traces: {report['workdir']}")
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Watchlist subscriptions against the fake Polygon")
+    parser.add_argument("--clients", type=int, default=50, help="Concurrent WebSocket clients")
+    parser.add_argument("--tickers-per-client", type=int, default=5)
+    parser.add_argument("--universe", type=int, default=40, help="Tickers the watchlists are drawn from")
+    parser.add_argument("--interval", type=float, default=1.0, help="WATCHLIST_INTERVAL for the app")
+    parser.add_argument("--tick-seconds", type=float, default=1.0, help="How often fake snapshot prices move")
+    parser.add_argument("--duration", type=float, default=10.0, help="Seconds each client stays subscribed")
+    parser.add_argument("--polygon-latency-ms", type=float, default=50)
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--out", help="Write the report as JSON")
+    return parser.parse_args(argv)
+
+
+if __name__ == "__main__":
+    report = asyncio.run(main(parse_args()))
+    sys.exit(1 if report["errors"] else 0)
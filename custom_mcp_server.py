@@ -8,34 +8,1113 @@ Reduces token usage by ~40-50%
 import os
 import sys
 import json
+import time
+import sqlite3
+import random
 import asyncio
+import threading
+from collections import OrderedDict, deque
+from datetime import date, datetime, timedelta, timezone
+from email.utils import parsedate_to_datetime
 from typing import Any, Sequence
+from zoneinfo import ZoneInfo
 import httpx
+import numpy as np
 from mcp.server import Server
 from mcp.server.stdio import stdio_server
 from mcp.types import Tool, TextContent, CallToolResult
 
-# Get API key from environment
-POLYGON_API_KEY = os.getenv("POLYGON_API_KEY")
-BASE_URL = "https://api.polygon.io"
+from tracing import LatencyHistogram
+
+BASE_URL = os.getenv("POLYGON_BASE_URL", "https://api.polygon.io").rstrip("/")
 
 # Initialize MCP server
 app = Server("polygon-stocks-only")
 
-# HTTP client for API calls
-http_client = httpx.AsyncClient(timeout=30.0)
+# US equities trade on New York time
+MARKET_TZ = ZoneInfo("America/New_York")
+
+
+# ------------- Polygon Client -------------
+try:
+    import h2  # noqa: F401  (enables HTTP/2 in httpx)
+    HTTP2_AVAILABLE = True
+except ImportError:
+    HTTP2_AVAILABLE = False
+
+def endpoint_template(endpoint: str) -> str:
+    """Group endpoints for metrics: /v2/aggs/ticker/AAPL/range/1/day/... -> /v2/aggs/ticker/{ticker}/range"""
+    parts = endpoint.split("/")
+    for i, part in enumerate(parts):
+        if i > 0 and parts[i - 1] in ("ticker", "tickers") and part:
+            parts[i] = "{ticker}"
+            if "range" in parts:
+                return "/".join(parts[:parts.index("range") + 1])
+    return "/".join(parts)
+
+
+def retry_after_seconds(response: httpx.Response, default: float) -> float:
+    """Delay requested by a 429 response (Retry-After seconds or HTTP date)"""
+    value = response.headers.get("retry-after")
+    if not value:
+        return default
+    try:
+        return max(float(value), 0.0)
+    except ValueError:
+        pass
+    try:
+        return max((parsedate_to_datetime(value) - datetime.now(timezone.utc)).total_seconds(), 0.0)
+    except (TypeError, ValueError):
+        return default
+
+
+class RequestScheduler:
+    """Shared gate for Polygon requests: bounded concurrency plus a global 429 pause.
+
+    When any request is told to back off, every request waits until the
+    Retry-After deadline instead of each one hammering the API on its own.
+    """
+
+    def __init__(self, max_concurrency: int):
+        self.semaphore = asyncio.Semaphore(max_concurrency)
+        self.paused_until = 0.0
+
+    def pause(self, seconds: float):
+        self.paused_until = max(self.paused_until, time.monotonic() + seconds)
+
+    async def wait_turn(self):
+        while (delay := self.paused_until - time.monotonic()) > 0:
+            await asyncio.sleep(delay)
+
+
+class PolygonClient:
+    """Pooled (HTTP/2 when available) Polygon client with retries and latency metrics"""
+
+    def __init__(self, max_connections=20, max_keepalive=10, keepalive_expiry=30.0, http2=True,
+                 timeout=30.0, max_retries=3, backoff_base=0.25, backoff_cap=8.0,
+                 default_retry_after=1.0, max_concurrency=16):
+        self.http2 = http2 and HTTP2_AVAILABLE
+        self.http = httpx.AsyncClient(
+            timeout=timeout,
+            http2=self.http2,
+            limits=httpx.Limits(
+                max_connections=max_connections,
+                max_keepalive_connections=max_keepalive,
+                keepalive_expiry=keepalive_expiry,
+            ),
+        )
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.backoff_cap = backoff_cap
+        self.default_retry_after = default_retry_after
+        self.scheduler = RequestScheduler(max_concurrency)
+        self.histograms = {}
+        self.counters = {"requests": 0, "retries": 0, "rate_limited": 0, "failures": 0}
+        # Called with (endpoint template, start ns, end ns, status, response bytes) per attempt
+        self.listeners = []
+
+    def _observe(self, template: str, histogram: LatencyHistogram, start_ns: int, status: Any, size: int):
+        end_ns = time.time_ns()
+        histogram.observe((end_ns - start_ns) / 1e6)
+        for listener in self.listeners:
+            listener(template, start_ns, end_ns, status, size)
+
+    def backoff(self, attempt: int) -> float:
+        """Full-jitter exponential backoff"""
+        return random.uniform(0, min(self.backoff_cap, self.backoff_base * 2 ** attempt))
+
+    async def get(self, url: str, params: dict = None) -> httpx.Response:
+        """GET with retries on 5xx/transport errors and Retry-After handling on 429"""
+        template = endpoint_template(httpx.URL(url).path)
+        histogram = self.histograms.setdefault(template, LatencyHistogram())
+        for attempt in range(self.max_retries + 1):
+            await self.scheduler.wait_turn()
+            async with self.scheduler.semaphore:
+                start_ns = time.time_ns()
+                self.counters["requests"] += 1
+                try:
+                    response = await self.http.get(url, params=params)
+                except httpx.TransportError as e:
+                    self._observe(template, histogram, start_ns, type(e).__name__, 0)
+                    if attempt == self.max_retries:
+                        self.counters["failures"] += 1
+                        raise
+                    response = None
+                else:
+                    self._observe(template, histogram, start_ns, response.status_code, len(response.content))
+
+            # Back off outside the semaphore, so an outage does not fill every slot with sleepers
+            if response is None:
+                self.counters["retries"] += 1
+                await asyncio.sleep(self.backoff(attempt))
+                continue
+            if response.status_code == 429 and attempt < self.max_retries:
+                self.counters["rate_limited"] += 1
+                self.counters["retries"] += 1
+                self.scheduler.pause(retry_after_seconds(response, self.default_retry_after))
+                continue
+            if response.status_code >= 500 and attempt < self.max_retries:
+                self.counters["retries"] += 1
+                await asyncio.sleep(self.backoff(attempt))
+                continue
+            if response.is_error:
+                self.counters["failures"] += 1
+            response.raise_for_status()
+            return response
+
+    def stats(self) -> dict:
+        return {
+            "http2": self.http2,
+            **self.counters,
+            "endpoints": {name: h.stats() for name, h in sorted(self.histograms.items())},
+        }
+
+
+polygon_client = PolygonClient(
+    max_connections=int(os.getenv("POLYGON_MAX_CONNECTIONS", "20")),
+    max_keepalive=int(os.getenv("POLYGON_MAX_KEEPALIVE", "10")),
+    keepalive_expiry=float(os.getenv("POLYGON_KEEPALIVE_EXPIRY", "30")),
+    http2=os.getenv("POLYGON_HTTP2", "true").lower() == "true",
+    max_retries=int(os.getenv("POLYGON_MAX_RETRIES", "3")),
+    max_concurrency=int(os.getenv("POLYGON_MAX_CONCURRENCY", "16")),
+)
+
+
+# ------------- Response Cache -------------
+def seconds_until_next_session_open(now: datetime = None) -> float:
+    """Seconds until the next regular session open (9:30 ET, weekdays; holidays ignored)"""
+    now = (now or datetime.now(MARKET_TZ)).astimezone(MARKET_TZ)
+    candidate = now.replace(hour=9, minute=30, second=0, microsecond=0)
+    if candidate <= now:
+        candidate += timedelta(days=1)
+    while candidate.weekday() >= 5:
+        candidate += timedelta(days=1)
+    return (candidate.astimezone(timezone.utc) - now.astimezone(timezone.utc)).total_seconds()
+
+
+def cache_ttl_for(endpoint: str, params: dict) -> float:
+    """TTL policy in seconds for an endpoint; 0 means never cache"""
+    if endpoint.startswith("/v2/snapshot/"):
+        return 0
+    if endpoint == "/v1/marketstatus/now":
+        return 15
+    if endpoint.startswith("/v2/aggs/ticker/") and endpoint.endswith("/prev"):
+        return seconds_until_next_session_open()
+    if endpoint.startswith("/v2/aggs/ticker/"):
+        # Ranges that end before today are immutable history
+        to_date = endpoint.rstrip("/").rsplit("/", 1)[-1]
+        if to_date < str(datetime.now(MARKET_TZ).date()):
+            return 6 * 3600
+        return 60
+    if endpoint.startswith("/v1/open-close/"):
+        return 6 * 3600
+    if endpoint.startswith("/v3/reference/"):
+        return 6 * 3600
+    if endpoint.startswith("/v2/reference/news"):
+        return 300
+    if endpoint.startswith("/v1/indicators/"):
+        return 60
+    return 0
+
+
+class ResponseCache:
+    """Bounded LRU cache of parsed Polygon responses with per-entry expiry"""
+
+    def __init__(self, max_entries=1024, ttl_policy=cache_ttl_for):
+        self.max_entries = max_entries
+        self.ttl_policy = ttl_policy
+        self.entries = OrderedDict()  # key -> (expires_at, data)
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    @staticmethod
+    def make_key(endpoint: str, params: dict) -> str:
+        """Key on endpoint + normalized params (sorted, stringified, no API key).
+
+        adjusted=true is Polygon's default, so it is left out: the prefetcher's and the
+        fast path's bare /prev calls share entries with tools that pass it explicitly.
+        """
+        normalized = sorted(
+            (k, str(v).lower() if isinstance(v, bool) else str(v))
+            for k, v in (params or {}).items()
+            if k != "apiKey" and v is not None
+        )
+        normalized = [(k, v) for k, v in normalized if not (k == "adjusted" and v.lower() == "true")]
+        return endpoint + "?" + "&".join(f"{k}={v}" for k, v in normalized)
+
+    def get(self, key: str):
+        """Return cached data or None, counting the hit/miss"""
+        entry = self.entries.get(key)
+        if entry is not None:
+            expires_at, data = entry
+            if expires_at > time.monotonic():
+                self.entries.move_to_end(key)
+                self.hits += 1
+                return data
+            del self.entries[key]
+        self.misses += 1
+        return None
+
+    def put(self, key: str, data: Any, ttl: float):
+        """Store data for ttl seconds, evicting least recently used entries"""
+        if ttl <= 0 or self.max_entries <= 0:
+            return
+        self.entries[key] = (time.monotonic() + ttl, data)
+        self.entries.move_to_end(key)
+        while len(self.entries) > self.max_entries:
+            self.entries.popitem(last=False)
+            self.evictions += 1
+
+    def clear(self):
+        self.entries.clear()
+
+    def stats(self) -> dict:
+        total = self.hits + self.misses
+        return {
+            "size": len(self.entries),
+            "max_entries": self.max_entries,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "hit_rate": round(self.hits / total, 3) if total else 0.0,
+        }
+
+
+response_cache = ResponseCache(max_entries=int(os.getenv("POLYGON_CACHE_MAX_ENTRIES", "1024")))
+
+
+# ------------- Request Coalescing -------------
+class SingleFlight:
+    """Share one in-flight request between concurrent callers with the same key"""
+
+    def __init__(self):
+        self.inflight = {}  # key -> asyncio.Task
+        self.started = 0
+        self.coalesced = 0
+
+    async def do(self, key: str, fn):
+        """Await fn() once per key; concurrent callers share its result or error"""
+        task = self.inflight.get(key)
+        if task is None:
+            task = asyncio.create_task(fn())
+            self.inflight[key] = task
+            self.started += 1
+            task.add_done_callback(lambda t: self._forget(key, t))
+        else:
+            self.coalesced += 1
+        # Shield so one cancelled caller does not cancel the shared request
+        return await asyncio.shield(task)
+
+    def _forget(self, key: str, task: asyncio.Task):
+        if self.inflight.get(key) is task:
+            del self.inflight[key]
+
+    def stats(self) -> dict:
+        return {
+            "in_flight": len(self.inflight),
+            "started": self.started,
+            "coalesced": self.coalesced,
+        }
+
+
+request_coalescer = SingleFlight()
 
 
 async def call_polygon_api(endpoint: str, params: dict = None) -> dict:
-    """Make API call to Polygon.io"""
+    """Make API call to Polygon.io (served from the response cache when fresh)"""
     if params is None:
         params = {}
-    params["apiKey"] = POLYGON_API_KEY
-    
-    url = f"{BASE_URL}{endpoint}"
-    response = await http_client.get(url, params=params)
-    response.raise_for_status()
-    return response.json()
+
+    ttl = response_cache.ttl_policy(endpoint, params)
+    key = response_cache.make_key(endpoint, params)
+    if ttl > 0:
+        cached = response_cache.get(key)
+        if cached is not None:
+            return cached
+
+    async def fetch():
+        # Read per request: the app may import this module before its .env is loaded
+        request_params = dict(params, apiKey=os.getenv("POLYGON_API_KEY"))
+        url = f"{BASE_URL}{endpoint}"
+        response = await polygon_client.get(url, params=request_params)
+        data = response.json()
+        response_cache.put(key, data, ttl)
+        return data
+
+    return await request_coalescer.do(key, fetch)
+
+
+# ------------- Batch Helpers -------------
+BATCH_MAX_TICKERS = 50
+batch_semaphore = asyncio.Semaphore(int(os.getenv("POLYGON_BATCH_CONCURRENCY", "8")))
+
+
+def parse_tickers(value: Any) -> list[str]:
+    """Normalize a list or comma-separated string of tickers (uppercased, deduplicated)"""
+    if isinstance(value, str):
+        value = value.split(",")
+    tickers = []
+    for ticker in value or []:
+        ticker = str(ticker).strip().upper()
+        if ticker and ticker not in tickers:
+            tickers.append(ticker)
+    if not tickers:
+        # An empty list would become tickers="" and return the whole-market snapshot
+        raise ValueError("At least one ticker is required")
+    if len(tickers) > BATCH_MAX_TICKERS:
+        raise ValueError(f"At most {BATCH_MAX_TICKERS} tickers per batch call")
+    return tickers
+
+
+def compact_prev_close(data: dict) -> dict:
+    """Reduce a /prev response to its OHLCV bar"""
+    results = data.get("results") or []
+    if not results:
+        raise ValueError("No data returned")
+    bar = results[0]
+    return {k: bar[k] for k in ("o", "h", "l", "c", "v", "vw", "t") if k in bar}
+
+
+def compact_ticker_details(data: dict) -> dict:
+    """Reduce a ticker details response to the commonly used fields"""
+    details = data.get("results") or {}
+    if not details:
+        raise ValueError("No data returned")
+    fields = (
+        "name", "market_cap", "primary_exchange", "sic_description",
+        "total_employees", "list_date", "share_class_shares_outstanding", "homepage_url",
+    )
+    return {k: details[k] for k in fields if details.get(k) is not None}
+
+
+def compact_snapshot(snapshot: dict) -> dict:
+    """Reduce one ticker snapshot to price and daily change"""
+    return {
+        "price": (snapshot.get("lastTrade") or {}).get("p") or (snapshot.get("day") or {}).get("c"),
+        "change": snapshot.get("todaysChange"),
+        "change_pct": snapshot.get("todaysChangePerc"),
+        "prev_close": (snapshot.get("prevDay") or {}).get("c"),
+        "volume": (snapshot.get("day") or {}).get("v"),
+        "updated": snapshot.get("updated"),
+    }
+
+
+def describe_error(e: Exception) -> str:
+    """Short per-ticker error text (never echoes the request URL or API key)"""
+    if isinstance(e, httpx.HTTPStatusError):
+        if e.response.status_code == 429:
+            return "HTTP 429 (Polygon rate limit still exceeded after retries)"
+        return f"HTTP {e.response.status_code}"
+    return str(e) or type(e).__name__
+
+
+async def fan_out(tickers: list[str], fetch) -> dict:
+    """Run fetch(ticker) for each ticker with bounded concurrency and merge the results"""
+    async def run_one(ticker):
+        async with batch_semaphore:
+            try:
+                return ticker, await fetch(ticker), None
+            except Exception as e:
+                return ticker, None, describe_error(e)
+
+    merged = {"results": {}, "errors": {}}
+    for ticker, result, error in await asyncio.gather(*(run_one(t) for t in tickers)):
+        if error is None:
+            merged["results"][ticker] = result
+        else:
+            merged["errors"][ticker] = error
+    if not merged["errors"]:
+        del merged["errors"]
+    return merged
+
+
+async def batch_stock_prices(tickers: list[str]) -> dict:
+    """Latest prices for many tickers from one snapshot call, falling back to per-ticker prev close.
+
+    Snapshot results are compact_snapshot quotes; fallback results are compact_prev_close
+    bars and the response is marked source="prev_close".
+    """
+    if not tickers:
+        raise ValueError("At least one ticker is required")
+    try:
+        data = await call_polygon_api(
+            "/v2/snapshot/locale/us/markets/stocks/tickers",
+            {"tickers": ",".join(tickers)}
+        )
+    except Exception as e:
+        if not (isinstance(e, httpx.HTTPStatusError) and e.response.status_code in (401, 403)):
+            # Throttling, outages and transport errors: fanning out to /prev would only multiply them
+            return {"results": {}, "errors": {ticker: describe_error(e) for ticker in tickers}}
+        # Snapshots need a higher Polygon plan; previous close works everywhere
+        async def fetch_prev(ticker):
+            return compact_prev_close(await call_polygon_api(f"/v2/aggs/ticker/{ticker}/prev"))
+        merged = await fan_out(tickers, fetch_prev)
+        # Results are previous-close bars, not live quotes (and cost one call per ticker)
+        merged["source"] = "prev_close"
+        return merged
+
+    snapshots = {item.get("ticker"): item for item in data.get("tickers") or []}
+    merged = {"results": {}, "errors": {}}
+    for ticker in tickers:
+        if ticker in snapshots:
+            merged["results"][ticker] = compact_snapshot(snapshots[ticker])
+        else:
+            merged["errors"][ticker] = "Not found in snapshot"
+    if not merged["errors"]:
+        del merged["errors"]
+    return merged
+
+
+# ------------- Pagination -------------
+# Hard cap on rows read across all pages of one tool call
+PAGINATION_MAX_ROWS = int(os.getenv("POLYGON_PAGINATION_MAX_ROWS", "50000"))
+
+
+class PolygonPager:
+    """Async iterator over result pages that follows next_url, prefetching one page ahead.
+
+    Pages are yielded one at a time so consumers can process them without
+    holding the full history in memory. After iteration, rows/pages report
+    what was read and truncated tells whether max_rows cut the results short.
+    """
+
+    def __init__(self, endpoint: str, params: dict = None, max_rows: int = None):
+        self.endpoint = endpoint
+        self.params = params or {}
+        self.max_rows = max_rows or PAGINATION_MAX_ROWS
+        self.rows = 0
+        self.pages = 0
+        self.truncated = False
+
+    async def __aiter__(self):
+        fetch = asyncio.create_task(call_polygon_api(self.endpoint, dict(self.params)))
+        try:
+            while fetch is not None:
+                page = await fetch
+                fetch = None
+                self.pages += 1
+                results = page.get("results") or []
+                if isinstance(results, list) and self.rows + len(results) > self.max_rows:
+                    results = results[:self.max_rows - self.rows]
+                    page = dict(page, results=results)
+                    self.truncated = True
+                self.rows += len(results) if isinstance(results, list) else 1
+                next_url = page.get("next_url")
+                if next_url and self.rows < self.max_rows:
+                    # Start the next request before handing this page to the consumer
+                    url = httpx.URL(next_url)
+                    fetch = asyncio.create_task(call_polygon_api(url.path, dict(url.params)))
+                elif next_url:
+                    self.truncated = True
+                yield page
+        finally:
+            if fetch is not None:
+                fetch.cancel()
+
+
+async def iter_pages(source: Any):
+    """Yield pages from a single response dict or an async page iterator (PolygonPager, StoredBars)"""
+    if isinstance(source, dict):
+        yield source
+    else:
+        async for page in source:
+            yield page
+
+
+async def iter_records(source: Any, values_key: str = None):
+    """Yield individual records from every page of a response"""
+    async for page in iter_pages(source):
+        records = page.get("results") or []
+        if values_key:
+            records = records.get(values_key) or [] if isinstance(records, dict) else []
+        for record in records:
+            yield record
+
+
+# ------------- Local Bar Store -------------
+BAR_STORE_PATH = os.getenv(
+    "BAR_STORE_PATH",
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), ".cache", "bars.sqlite3")
+)
+# Split-adjusted history changes when a split happens, so it is re-fetched after this age
+BAR_STORE_ADJUSTED_MAX_AGE = float(os.getenv("BAR_STORE_ADJUSTED_MAX_AGE_DAYS", "7")) * 86400
+BAR_COLUMNS = ("t", "o", "h", "l", "c", "v", "vw", "n")
+
+
+def aggregates_endpoint(ticker: str, multiplier: Any, timespan: str, from_date: Any, to_date: Any) -> str:
+    return f"/v2/aggs/ticker/{ticker}/range/{multiplier}/{timespan}/{from_date}/{to_date}"
+
+
+def day_start_ms(day: date) -> int:
+    """Epoch milliseconds of midnight ET on day"""
+    return int(datetime.combine(day, datetime.min.time(), MARKET_TZ).timestamp() * 1000)
+
+
+class BarStore:
+    """On-disk SQLite store of OHLCV bars with per-series date coverage.
+
+    Each series (ticker, timespan, adjusted) records which date intervals
+    have been fetched completely. Queries only fetch the missing intervals
+    from Polygon, merge them in, and then serve the requested range from the
+    store. Only single-unit minute/hour/day bars are stored because their
+    timestamps always fall inside the requested dates; Polygon anchors
+    multi-unit buckets (e.g. 5-minute) to each request's from date, so bars
+    stitched from separate gap fetches would not line up. Days from today on
+    are never marked covered since their bars are still changing.
+    """
+
+    STORED_TIMESPANS = ("minute", "hour", "day")
+    PAGE_ROWS = 5000
+
+    def __init__(self, path: str, adjusted_max_age: float = BAR_STORE_ADJUSTED_MAX_AGE):
+        self.path = path
+        self.adjusted_max_age = adjusted_max_age
+        self.conn = None
+        self.lock = threading.Lock()
+        self.full_hits = 0
+        self.gap_fetches = 0
+
+    def _connect(self) -> sqlite3.Connection:
+        if self.conn is None:
+            os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+            conn = sqlite3.connect(self.path, check_same_thread=False)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS bars ("
+                "series TEXT, t INTEGER, o REAL, h REAL, l REAL, c REAL, v REAL, vw REAL, n INTEGER, "
+                "PRIMARY KEY (series, t)) WITHOUT ROWID"
+            )
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS coverage (series TEXT, start TEXT, end TEXT, fetched_at REAL)"
+            )
+            conn.execute("CREATE INDEX IF NOT EXISTS coverage_series ON coverage (series)")
+            conn.commit()
+            self.conn = conn
+        return self.conn
+
+    def _missing(self, series: str, start: date, end: date, adjusted: bool) -> list[tuple[date, date]]:
+        """Date intervals in [start, end] not yet covered for series"""
+        with self.lock:
+            conn = self._connect()
+            if adjusted:
+                conn.execute(
+                    "DELETE FROM coverage WHERE series = ? AND fetched_at < ?",
+                    (series, time.time() - self.adjusted_max_age)
+                )
+                conn.commit()
+            covered = conn.execute(
+                "SELECT start, end FROM coverage WHERE series = ? ORDER BY start", (series,)
+            ).fetchall()
+        gaps, cursor = [], start
+        for covered_start, covered_end in covered:
+            covered_start, covered_end = date.fromisoformat(covered_start), date.fromisoformat(covered_end)
+            if covered_end < cursor:
+                continue
+            if covered_start > end:
+                break
+            if covered_start > cursor:
+                gaps.append((cursor, covered_start - timedelta(days=1)))
+            cursor = covered_end + timedelta(days=1)
+            if cursor > end:
+                break
+        if cursor <= end:
+            gaps.append((cursor, end))
+        return gaps
+
+    def _insert(self, series: str, bars: list[dict]):
+        with self.lock:
+            conn = self._connect()
+            conn.executemany(
+                "INSERT OR REPLACE INTO bars VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                [(series, *(bar.get(k) for k in BAR_COLUMNS)) for bar in bars if bar.get("t") is not None]
+            )
+            conn.commit()
+
+    def _mark_covered(self, series: str, start: date, end: date):
+        """Record [start, end] as fetched, merging with overlapping or adjacent intervals"""
+        with self.lock:
+            conn = self._connect()
+            rows = conn.execute(
+                "SELECT start, end, fetched_at FROM coverage WHERE series = ? AND start <= ? AND end >= ?",
+                (series, str(end + timedelta(days=1)), str(start - timedelta(days=1)))
+            ).fetchall()
+            fetched_at = time.time()
+            for row_start, row_end, row_fetched_at in rows:
+                start = min(start, date.fromisoformat(row_start))
+                end = max(end, date.fromisoformat(row_end))
+                fetched_at = min(fetched_at, row_fetched_at)
+            conn.execute(
+                "DELETE FROM coverage WHERE series = ? AND start <= ? AND end >= ?",
+                (series, str(end + timedelta(days=1)), str(start - timedelta(days=1)))
+            )
+            conn.execute(
+                "INSERT INTO coverage VALUES (?, ?, ?, ?)", (series, str(start), str(end), fetched_at)
+            )
+            conn.commit()
+
+    def _read(self, series: str, after_t: int, before_t: int, limit: int) -> list[dict]:
+        """Bars with after_t < t < before_t in time order"""
+        with self.lock:
+            rows = self._connect().execute(
+                "SELECT t, o, h, l, c, v, vw, n FROM bars WHERE series = ? AND t > ? AND t < ? "
+                "ORDER BY t LIMIT ?",
+                (series, after_t, before_t, limit)
+            ).fetchall()
+        return [{k: v for k, v in zip(BAR_COLUMNS, row) if v is not None} for row in rows]
+
+    async def query(self, ticker: str, multiplier: Any, timespan: str,
+                    from_date: str, to_date: str, adjusted: bool) -> "StoredBars":
+        """Fill any missing intervals from Polygon, then return the range from the store"""
+        if str(multiplier) != "1":
+            raise ValueError("Only multiplier 1 bars are stored")
+        start, end = date.fromisoformat(from_date), date.fromisoformat(to_date)
+        series = f"{ticker.upper()}|{multiplier}|{timespan}|{int(adjusted)}"
+        last_final_day = datetime.now(MARKET_TZ).date() - timedelta(days=1)
+
+        gaps = await asyncio.to_thread(self._missing, series, start, end, adjusted)
+        if gaps:
+            self.gap_fetches += 1
+            await asyncio.gather(*(
+                self._fill(series, ticker, multiplier, timespan, gap_start, gap_end, adjusted, last_final_day)
+                for gap_start, gap_end in gaps
+            ))
+        else:
+            self.full_hits += 1
+        return StoredBars(self, series, day_start_ms(start) - 1, day_start_ms(end + timedelta(days=1)))
+
+    async def _fill(self, series, ticker, multiplier, timespan, start, end, adjusted, last_final_day):
+        pager = PolygonPager(
+            aggregates_endpoint(ticker, multiplier, timespan, start, end),
+            {"adjusted": str(adjusted).lower(), "limit": 50000},
+            max_rows=sys.maxsize
+        )
+        async for page in pager:
+            await asyncio.to_thread(self._insert, series, page.get("results") or [])
+        covered_end = min(end, last_final_day)
+        if covered_end >= start:
+            await asyncio.to_thread(self._mark_covered, series, start, covered_end)
+
+    def stats(self) -> dict:
+        return {"path": self.path, "full_hits": self.full_hits, "gap_fetches": self.gap_fetches}
+
+
+class StoredBars:
+    """Async iterator over a bar range in the store, read in keyset-paginated pages"""
+
+    def __init__(self, store: BarStore, series: str, after_t: int, before_t: int, max_rows: int = None):
+        self.store = store
+        self.series = series
+        self.after_t = after_t
+        self.before_t = before_t
+        self.max_rows = max_rows or PAGINATION_MAX_ROWS
+        self.rows = 0
+        self.truncated = False
+
+    async def __aiter__(self):
+        after_t = self.after_t
+        while self.rows < self.max_rows:
+            limit = min(self.store.PAGE_ROWS, self.max_rows - self.rows)
+            bars = await asyncio.to_thread(self.store._read, self.series, after_t, self.before_t, limit)
+            if not bars:
+                return
+            self.rows += len(bars)
+            after_t = bars[-1]["t"]
+            yield {"results": bars}
+        self.truncated = bool(await asyncio.to_thread(self.store._read, self.series, after_t, self.before_t, 1))
+
+
+bar_store = BarStore(BAR_STORE_PATH) if BAR_STORE_PATH else None
+
+
+async def aggregates_source(arguments: dict) -> Any:
+    """Bars for get_aggregates: from the local store when possible, else paged from Polygon"""
+    adjusted = arguments.get("adjusted", True)
+    if (bar_store is not None and arguments["timespan"] in BarStore.STORED_TIMESPANS
+            and str(arguments["multiplier"]) == "1"):
+        try:
+            return await bar_store.query(
+                arguments["ticker"], arguments["multiplier"], arguments["timespan"],
+                arguments["from_date"], arguments["to_date"], adjusted
+            )
+        except (ValueError, sqlite3.Error) as e:
+            # Non-ISO dates or an unusable store file: go straight to Polygon
+            print(f"[BarStore] Falling back to Polygon: {e}", file=sys.stderr)
+    return PolygonPager(
+        aggregates_endpoint(
+            arguments["ticker"], arguments["multiplier"], arguments["timespan"],
+            arguments["from_date"], arguments["to_date"]
+        ),
+        {"adjusted": str(adjusted).lower(), "limit": 50000}
+    )
+
+
+# ------------- Output Encoding -------------
+# Rough budget for a single tool result; ~4 characters per token
+TOOL_OUTPUT_MAX_TOKENS = int(os.getenv("TOOL_OUTPUT_MAX_TOKENS", "3000"))
+CHARS_PER_TOKEN = 4
+
+
+def format_value(value: Any) -> str:
+    """Render a scalar for a CSV cell"""
+    if value is None:
+        return ""
+    if isinstance(value, float):
+        value = round(value, 4)
+        return str(int(value)) if value.is_integer() else str(value)
+    text = str(value)
+    if any(c in text for c in ',"\n'):
+        text = '"' + text.replace('"', '""').replace("\n", " ") + '"'
+    return text
+
+
+def format_timestamp(ms: Any, intraday: bool) -> str:
+    """Render a Polygon millisecond timestamp in market time"""
+    if not isinstance(ms, (int, float)):
+        return format_value(ms)
+    moment = datetime.fromtimestamp(ms / 1000, MARKET_TZ)
+    return moment.strftime("%Y-%m-%d %H:%M" if intraday else "%Y-%m-%d")
+
+
+class TableWriter:
+    """Incremental CSV renderer that keeps the head and tail of the rows within max_chars.
+
+    Rows are added one at a time; only the rows that fit the budget are held
+    in memory, so arbitrarily long streams render in bounded space.
+    """
+
+    def __init__(self, columns: list[str], max_chars: int):
+        self.header = ",".join(columns)
+        self.half = max(max_chars - len(self.header), 0) // 2
+        self.head, self.tail = [], deque()
+        self.head_chars = self.tail_chars = 0
+        self.total = 0
+
+    def add(self, row: list):
+        line = ",".join(format_value(v) for v in row)
+        self.total += 1
+        if not self.tail and self.head_chars + len(line) + 1 <= self.half:
+            self.head.append(line)
+            self.head_chars += len(line) + 1
+            return
+        self.tail.append(line)
+        self.tail_chars += len(line) + 1
+        while self.tail and self.tail_chars > self.half:
+            self.tail_chars -= len(self.tail.popleft()) + 1
+
+    def render(self) -> str:
+        omitted = self.total - len(self.head) - len(self.tail)
+        lines = [self.header, *self.head]
+        if omitted:
+            lines.append(f"... {omitted} rows omitted ...")
+        lines.extend(self.tail)
+        return "\n".join(lines)
+
+
+def truncate_text(text: str, max_chars: int) -> str:
+    """Cut text to max_chars with an explicit truncation marker"""
+    if len(text) <= max_chars:
+        return text
+    omitted = (len(text) - max_chars) // CHARS_PER_TOKEN
+    return text[:max_chars] + f"\n[truncated: ~{omitted} tokens omitted]"
+
+
+def compact_json(data: Any) -> str:
+    return json.dumps(data, separators=(",", ":"), default=str)
+
+
+def row_cap_note(source: Any) -> str:
+    """Marker appended when pagination stopped at the row cap"""
+    if getattr(source, "truncated", False):
+        return f"\n[row cap reached: first {source.rows} rows shown, more results available]"
+    return ""
+
+
+class BarSummary:
+    """Running open/high/low/close/volume over a stream of bars"""
+
+    def __init__(self):
+        self.open = self.close = self.high = self.low = None
+        self.volume = 0
+
+    def add(self, bar: dict) -> dict:
+        if self.open is None:
+            self.open = bar.get("o")
+        self.close = bar.get("c")
+        if bar.get("h") is not None:
+            self.high = bar["h"] if self.high is None else max(self.high, bar["h"])
+        if bar.get("l") is not None:
+            self.low = bar["l"] if self.low is None else min(self.low, bar["l"])
+        self.volume += bar.get("v") or 0
+        return bar
+
+    def describe(self) -> str:
+        return (
+            f"open={format_value(self.open)} high={format_value(self.high)} "
+            f"low={format_value(self.low)} close={format_value(self.close)} "
+            f"volume={format_value(self.volume)}"
+        )
+
+
+async def encode_aggregates(source: Any, arguments: dict, max_chars: int) -> str:
+    intraday = arguments.get("timespan") in ("second", "minute", "hour")
+    summary = BarSummary()
+    columns = ["t", "o", "h", "l", "c", "v", "vw", "n"]
+    writer = TableWriter(columns, max_chars - 200)
+    async for bar in iter_records(source):
+        summary.add(bar)
+        writer.add([format_timestamp(bar.get("t"), intraday)] + [bar.get(k) for k in columns[1:]])
+    return (
+        f"{arguments.get('ticker')} {arguments.get('multiplier')}/{arguments.get('timespan')} "
+        f"bars={writer.total} {summary.describe()}\n{writer.render()}{row_cap_note(source)}"
+    )
+
+
+async def encode_news(source: Any, arguments: dict, max_chars: int) -> str:
+    lines = []
+    async for article in iter_records(source):
+        lines.append(compact_json({
+            "title": article.get("title"),
+            "published": article.get("published_utc"),
+            "publisher": (article.get("publisher") or {}).get("name"),
+            "url": article.get("article_url"),
+            "summary": truncate_text(article.get("description") or "", 300),
+        }))
+    return "\n".join(lines) or "No articles"
+
+
+def table_encoder(columns: list[str], values_key: str = None):
+    """Build an encoder that renders a list of records (optionally nested) as CSV"""
+    async def encode(source: Any, arguments: dict, max_chars: int) -> str:
+        intraday = arguments.get("timespan") in ("second", "minute", "hour")
+        writer = TableWriter(columns, max_chars - 100)
+        async for record in iter_records(source, values_key):
+            writer.add([
+                format_timestamp(record.get(c), intraday) if c == "timestamp" else record.get(c)
+                for c in columns
+            ])
+        return f"rows={writer.total}\n{writer.render()}{row_cap_note(source)}"
+    return encode
+
+
+OUTPUT_ENCODERS = {
+    "get_aggregates": encode_aggregates,
+    "get_ticker_news": encode_news,
+    "get_dividends": table_encoder(
+        ["ex_dividend_date", "pay_date", "cash_amount", "currency", "frequency", "dividend_type"]
+    ),
+    "get_stock_splits": table_encoder(["execution_date", "split_from", "split_to"]),
+    "search_tickers": table_encoder(["ticker", "name", "primary_exchange", "type", "active"]),
+    "get_sma": table_encoder(["timestamp", "value"], "values"),
+    "get_ema": table_encoder(["timestamp", "value"], "values"),
+    "get_rsi": table_encoder(["timestamp", "value"], "values"),
+    "get_macd": table_encoder(["timestamp", "value", "signal", "histogram"], "values"),
+}
+
+# Envelope fields that carry no information for the model
+DROPPED_FIELDS = ("request_id", "status", "next_url")
+
+
+async def encode_tool_output(name: str, arguments: dict, data: Any, max_tokens: int = None) -> str:
+    """Project a tool result to the fields the model needs and fit it in the token budget.
+
+    data is either a parsed response dict or an async page iterator
+    (PolygonPager, StoredBars), whose pages are streamed through the encoder
+    one at a time.
+    """
+    max_chars = (max_tokens or TOOL_OUTPUT_MAX_TOKENS) * CHARS_PER_TOKEN
+    encoder = OUTPUT_ENCODERS.get(name)
+    paged = hasattr(data, "__aiter__")
+    if encoder is not None and (paged or isinstance(data, dict)):
+        text = await encoder(data, arguments, max_chars)
+    else:
+        if paged:
+            data = [page async for page in data]
+        if isinstance(data, dict):
+            data = {k: v for k, v in data.items() if k not in DROPPED_FIELDS}
+        text = compact_json(data)
+    return truncate_text(text, max_chars)
+
+
+# ------------- Indicator Engine -------------
+# Indicators over these timespans are computed locally from aggregate bars
+INDICATOR_TIMESPANS = ("day", "week", "month")
+INDICATOR_MAX_BARS = 2000
+CALENDAR_DAYS_PER_BAR = {"day": 1.5, "week": 7, "month": 31}
+MACD_SHORT, MACD_LONG, MACD_SIGNAL = 12, 26, 9
+
+
+def sma_kernel(closes: np.ndarray, window: int) -> np.ndarray:
+    """Rolling mean via cumulative sums; NaN until the window is full"""
+    out = np.full(len(closes), np.nan)
+    if len(closes) >= window:
+        sums = np.cumsum(np.insert(closes, 0, 0.0))
+        out[window - 1:] = (sums[window:] - sums[:-window]) / window
+    return out
+
+
+def ewm_kernel(values: np.ndarray, alpha: float, seed: float = None) -> np.ndarray:
+    """Exponentially weighted mean y[i] = alpha*x[i] + (1-alpha)*y[i-1], vectorized per block.
+
+    Within a block y[k] = d^k * (seed + alpha * sum_{j<=k} x[j] * d^-j) with
+    d = 1 - alpha; blocks are sized so d^-k stays within float range.
+    """
+    decay = 1.0 - alpha
+    out = np.empty(len(values))
+    if len(values) == 0:
+        return out
+    if decay <= 0:
+        out[:] = values
+        return out
+    prev = values[0] if seed is None else seed
+    block = len(values) if decay >= 1 else max(1, int(250 / -np.log10(decay)))
+    for start in range(0, len(values), block):
+        chunk = values[start:start + block]
+        powers = np.arange(1, len(chunk) + 1)
+        out[start:start + len(chunk)] = decay ** powers * (prev + alpha * np.cumsum(chunk * decay ** -powers))
+        prev = out[start + len(chunk) - 1]
+    return out
+
+
+def ema_kernel(closes: np.ndarray, window: int) -> np.ndarray:
+    """EMA with alpha = 2/(window+1), seeded with the first close"""
+    return ewm_kernel(closes, 2.0 / (window + 1))
+
+
+def rsi_kernel(closes: np.ndarray, window: int) -> np.ndarray:
+    """Wilder's RSI: smoothed gains/losses seeded with their simple mean over the first window"""
+    out = np.full(len(closes), np.nan)
+    if len(closes) <= window:
+        return out
+    changes = np.diff(closes)
+    gains, losses = np.clip(changes, 0, None), np.clip(-changes, 0, None)
+    alpha = 1.0 / window
+    avg_gain = ewm_kernel(gains[window:], alpha, gains[:window].mean())
+    avg_loss = ewm_kernel(losses[window:], alpha, losses[:window].mean())
+    avg_gain = np.insert(avg_gain, 0, gains[:window].mean())
+    avg_loss = np.insert(avg_loss, 0, losses[:window].mean())
+    with np.errstate(divide="ignore", invalid="ignore"):
+        rsi = 100.0 - 100.0 / (1.0 + avg_gain / avg_loss)
+    rsi[avg_loss == 0] = 100.0
+    out[window:] = rsi
+    return out
+
+
+def macd_kernel(closes: np.ndarray, short: int = MACD_SHORT, long: int = MACD_LONG,
+                signal: int = MACD_SIGNAL) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """MACD line, signal line and histogram"""
+    line = ema_kernel(closes, short) - ema_kernel(closes, long)
+    signal_line = ema_kernel(line, signal)
+    return line, signal_line, line - signal_line
+
+
+def warmup_bars(kind: str, window: int) -> int:
+    """Bars of history needed before the first reported value is stable"""
+    if kind == "sma":
+        return window
+    if kind == "ema":
+        return 5 * window + 50
+    if kind == "rsi":
+        return 10 * window + 50
+    return 5 * (MACD_LONG + MACD_SIGNAL) + 50
+
+
+async def load_closes(ticker: str, timespan: str, end: date, bars_needed: int) -> tuple[np.ndarray, np.ndarray]:
+    """Timestamps and closes of the last bars_needed bars up to end (from the bar store/cache)"""
+    bars_needed = min(bars_needed, INDICATOR_MAX_BARS)
+    start = end - timedelta(days=int(bars_needed * CALENDAR_DAYS_PER_BAR[timespan]) + 10)
+    source = await aggregates_source({
+        "ticker": ticker, "multiplier": 1, "timespan": timespan,
+        "from_date": str(start), "to_date": str(end), "adjusted": True,
+    })
+    timestamps, closes = [], []
+    async for bar in iter_records(source):
+        if bar.get("c") is not None:
+            timestamps.append(bar["t"])
+            closes.append(bar["c"])
+    if not closes:
+        raise ValueError(f"No bars available for {ticker}")
+    return np.asarray(timestamps, dtype=np.int64), np.asarray(closes, dtype=np.float64)
+
+
+def indicator_end_date(timestamp: Any) -> date:
+    return date.fromisoformat(timestamp) if timestamp else datetime.now(MARKET_TZ).date()
+
+
+async def local_indicator(kind: str, ticker: str, timespan: str, window: int, timestamp: str = None) -> dict:
+    """One indicator computed from bars, in the shape of Polygon's /v1/indicators response"""
+    limit = 1 if timestamp else 10
+    timestamps, closes = await load_closes(
+        ticker, timespan, indicator_end_date(timestamp), warmup_bars(kind, window) + limit
+    )
+    if kind == "macd":
+        line, signal_line, histogram = macd_kernel(closes)
+        columns = {"value": line, "signal": signal_line, "histogram": histogram}
+    else:
+        kernel = {"sma": sma_kernel, "ema": ema_kernel, "rsi": rsi_kernel}[kind]
+        columns = {"value": kernel(closes, window)}
+    values = []
+    for i in range(len(closes) - 1, -1, -1):
+        if len(values) >= limit or np.isnan(columns["value"][i]):
+            break
+        values.append({"timestamp": int(timestamps[i]), **{k: float(v[i]) for k, v in columns.items()}})
+    if not values:
+        raise ValueError(f"Not enough bars for {kind.upper()}({window}) on {ticker}")
+    return {"results": {"values": values}, "source": "computed from aggregates"}
+
+
+async def indicator_data(kind: str, arguments: dict, window: int = None) -> dict:
+    """Indicator computed locally from bars, falling back to Polygon's indicator endpoint"""
+    timespan = arguments["timespan"]
+    if timespan in INDICATOR_TIMESPANS:
+        try:
+            return await local_indicator(kind, arguments["ticker"], timespan, window, arguments.get("timestamp"))
+        except (ValueError, httpx.HTTPError, sqlite3.Error) as e:
+            print(f"[Indicators] Falling back to Polygon for {kind}: {e}", file=sys.stderr)
+    params = {"timestamp": arguments.get("timestamp"), "timespan": timespan, "window": window}
+    return await call_polygon_api(
+        f"/v1/indicators/{kind}/{arguments['ticker']}",
+        {k: v for k, v in params.items() if v is not None}
+    )
+
+
+def rounded(value: float) -> Any:
+    return None if np.isnan(value) else round(float(value), 4)
+
+
+async def latest_indicators(ticker: str, arguments: dict) -> dict:
+    """Latest close plus every requested indicator for one ticker from a single bars fetch"""
+    sma_windows = arguments.get("sma_windows") or []
+    ema_windows = arguments.get("ema_windows") or []
+    rsi_window = arguments.get("rsi_window")
+    macd = arguments.get("macd", False)
+    timespan = arguments.get("timespan", "day")
+    if timespan not in INDICATOR_TIMESPANS:
+        raise ValueError(f"timespan must be one of {', '.join(INDICATOR_TIMESPANS)}")
+
+    needed = [warmup_bars("sma", w) for w in sma_windows] + [warmup_bars("ema", w) for w in ema_windows]
+    if rsi_window:
+        needed.append(warmup_bars("rsi", rsi_window))
+    if macd:
+        needed.append(warmup_bars("macd", 0))
+    timestamps, closes = await load_closes(
+        ticker, timespan, indicator_end_date(arguments.get("timestamp")), max(needed, default=1)
+    )
+
+    result = {
+        "date": format_timestamp(int(timestamps[-1]), False),
+        "close": rounded(closes[-1]),
+    }
+    for window in sma_windows:
+        result[f"sma_{window}"] = rounded(sma_kernel(closes, window)[-1])
+    for window in ema_windows:
+        result[f"ema_{window}"] = rounded(ema_kernel(closes, window)[-1])
+    if rsi_window:
+        result[f"rsi_{rsi_window}"] = rounded(rsi_kernel(closes, rsi_window)[-1])
+    if macd:
+        line, signal_line, histogram = macd_kernel(closes)
+        result.update(macd=rounded(line[-1]), macd_signal=rounded(signal_line[-1]), macd_hist=rounded(histogram[-1]))
+    return result
 
 
 @app.list_tools()
@@ -234,6 +1313,77 @@ async def list_tools() -> list[Tool]:
                 },
                 "required": []
             }
+        ),
+        Tool(
+            name="get_indicators",
+            description="Get several technical indicators (SMA/EMA windows, RSI, MACD) for one or more tickers in one call",
+            inputSchema={
+                "type": "object",
+                "properties": {
+                    "tickers": {
+                        "type": "array",
+                        "items": {"type": "string"},
+                        "minItems": 1,
+                        "description": "List of stock ticker symbols (1-50)"
+                    },
+                    "timespan": {"type": "string", "description": "day, week, month (default: day)"},
+                    "timestamp": {"type": "string", "description": "As-of date (YYYY-MM-DD, default: latest)"},
+                    "sma_windows": {"type": "array", "items": {"type": "integer"}, "description": "SMA windows (e.g., [20, 50, 200])"},
+                    "ema_windows": {"type": "array", "items": {"type": "integer"}, "description": "EMA windows (e.g., [12, 26])"},
+                    "rsi_window": {"type": "integer", "description": "RSI window (e.g., 14)"},
+                    "macd": {"type": "boolean", "description": "Include MACD (12, 26, 9)"}
+                },
+                "required": ["tickers"]
+            }
+        ),
+        Tool(
+            name="get_stock_price_batch",
+            description="Get latest prices for several tickers in one call (use instead of repeated get_stock_price)",
+            inputSchema={
+                "type": "object",
+                "properties": {
+                    "tickers": {
+                        "type": "array",
+                        "items": {"type": "string"},
+                        "minItems": 1,
+                        "description": "List of stock ticker symbols (1-50)"
+                    }
+                },
+                "required": ["tickers"]
+            }
+        ),
+        Tool(
+            name="get_previous_close_batch",
+            description="Get previous day's OHLC for several tickers in one call",
+            inputSchema={
+                "type": "object",
+                "properties": {
+                    "tickers": {
+                        "type": "array",
+                        "items": {"type": "string"},
+                        "minItems": 1,
+                        "description": "List of stock ticker symbols (1-50)"
+                    },
+                    "adjusted": {"type": "boolean", "description": "Adjusted for splits (default: true)"}
+                },
+                "required": ["tickers"]
+            }
+        ),
+        Tool(
+            name="get_ticker_details_batch",
+            description="Get company details for several tickers in one call",
+            inputSchema={
+                "type": "object",
+                "properties": {
+                    "tickers": {
+                        "type": "array",
+                        "items": {"type": "string"},
+                        "minItems": 1,
+                        "description": "List of stock ticker symbols (1-50)"
+                    }
+                },
+                "required": ["tickers"]
+            }
         )
     ]
 
@@ -253,10 +1403,7 @@ async def call_tool(name: str, arguments: Any) -> Sequence[TextContent]:
             )
             
         elif name == "get_aggregates":
-            data = await call_polygon_api(
-                f"/v2/aggs/ticker/{arguments['ticker']}/range/{arguments['multiplier']}/{arguments['timespan']}/{arguments['from_date']}/{arguments['to_date']}",
-                {"adjusted": str(arguments.get("adjusted", True)).lower()}
-            )
+            data = await aggregates_source(arguments)
             
         elif name == "get_ticker_details":
             data = await call_polygon_api(f"/v3/reference/tickers/{arguments['ticker']}")
@@ -272,10 +1419,10 @@ async def call_tool(name: str, arguments: Any) -> Sequence[TextContent]:
             data = await call_polygon_api("/v1/marketstatus/now")
             
         elif name == "get_dividends":
-            data = await call_polygon_api(f"/v3/reference/dividends", {"ticker": arguments['ticker']})
+            data = PolygonPager("/v3/reference/dividends", {"ticker": arguments['ticker'], "limit": 1000})
             
         elif name == "get_stock_splits":
-            data = await call_polygon_api(f"/v3/reference/splits", {"ticker": arguments['ticker']})
+            data = PolygonPager("/v3/reference/splits", {"ticker": arguments['ticker'], "limit": 1000})
             
         elif name == "get_daily_open_close":
             adjusted = arguments.get("adjusted", True)
@@ -286,52 +1433,28 @@ async def call_tool(name: str, arguments: Any) -> Sequence[TextContent]:
             
         elif name == "search_tickers":
             limit = arguments.get("limit", 10)
-            data = await call_polygon_api(
+            data = PolygonPager(
                 "/v3/reference/tickers",
-                {"search": arguments['search'], "limit": limit, "market": "stocks"}
+                {"search": arguments['search'], "limit": min(limit, 1000), "market": "stocks"},
+                max_rows=limit
             )
             
         elif name == "get_sma":
-            params = {
-                "timestamp": arguments.get("timestamp"),
-                "timespan": arguments["timespan"],
-                "window": arguments.get("window", 50)
-            }
-            data = await call_polygon_api(
-                f"/v1/indicators/sma/{arguments['ticker']}",
-                {k: v for k, v in params.items() if v is not None}
-            )
+            data = await indicator_data("sma", arguments, arguments.get("window", 50))
             
         elif name == "get_ema":
-            params = {
-                "timestamp": arguments.get("timestamp"),
-                "timespan": arguments["timespan"],
-                "window": arguments.get("window", 12)
-            }
-            data = await call_polygon_api(
-                f"/v1/indicators/ema/{arguments['ticker']}",
-                {k: v for k, v in params.items() if v is not None}
-            )
+            data = await indicator_data("ema", arguments, arguments.get("window", 12))
             
         elif name == "get_rsi":
-            params = {
-                "timestamp": arguments.get("timestamp"),
-                "timespan": arguments["timespan"],
-                "window": arguments.get("window", 14)
-            }
-            data = await call_polygon_api(
-                f"/v1/indicators/rsi/{arguments['ticker']}",
-                {k: v for k, v in params.items() if v is not None}
-            )
+            data = await indicator_data("rsi", arguments, arguments.get("window", 14))
             
         elif name == "get_macd":
-            params = {
-                "timestamp": arguments.get("timestamp"),
-                "timespan": arguments["timespan"]
-            }
-            data = await call_polygon_api(
-                f"/v1/indicators/macd/{arguments['ticker']}",
-                {k: v for k, v in params.items() if v is not None}
+            data = await indicator_data("macd", arguments)
+            
+        elif name == "get_indicators":
+            data = await fan_out(
+                parse_tickers(arguments["tickers"]),
+                lambda ticker: latest_indicators(ticker, arguments)
             )
             
         elif name == "get_snapshot_all_tickers":
@@ -340,13 +1463,30 @@ async def call_tool(name: str, arguments: Any) -> Sequence[TextContent]:
                 endpoint = f"/v2/snapshot/locale/us/markets/stocks/tickers/{arguments['tickers']}"
             data = await call_polygon_api(endpoint)
             
+        elif name == "get_stock_price_batch":
+            data = await batch_stock_prices(parse_tickers(arguments["tickers"]))
+            
+        elif name == "get_previous_close_batch":
+            adjusted = str(arguments.get("adjusted", True)).lower()
+            
+            async def fetch_prev(ticker):
+                return compact_prev_close(
+                    await call_polygon_api(f"/v2/aggs/ticker/{ticker}/prev", {"adjusted": adjusted})
+                )
+            data = await fan_out(parse_tickers(arguments["tickers"]), fetch_prev)
+            
+        elif name == "get_ticker_details_batch":
+            async def fetch_details(ticker):
+                return compact_ticker_details(await call_polygon_api(f"/v3/reference/tickers/{ticker}"))
+            data = await fan_out(parse_tickers(arguments["tickers"]), fetch_details)
+            
         else:
             return [TextContent(type="text", text=f"Unknown tool: {name}")]
         
-        return [TextContent(type="text", text=json.dumps(data, indent=2))]
+        return [TextContent(type="text", text=await encode_tool_output(name, arguments, data))]
         
     except Exception as e:
-        return [TextContent(type="text", text=f"Error: {str(e)}")]
+        return [TextContent(type="text", text=f"Error: {describe_error(e)}")]
 
 
 async def main():
@@ -0,0 +1,158 @@
+"""
+Token-aware compaction of per-session conversation history.
+
+Old turns are shrunk in stages until the history fits the token ceiling:
+1. Large tool results in old turns are replaced with short digests
+2. Old turns are collapsed to the user's question and the final answer
+3. The oldest turns are dropped
+
+A turn (user prompt, tool calls, tool results, answer) is only ever rewritten
+or removed as a whole, so every tool_use keeps its matching tool_result.
+The most recent turns are always kept intact.
+"""
+
+from dataclasses import replace
+
+from pydantic_ai.messages import (
+    ModelMessage, ModelRequest, ModelResponse, RetryPromptPart, SystemPromptPart,
+    TextPart, ToolCallPart, ToolReturnPart, UserPromptPart,
+)
+
+CHARS_PER_TOKEN = 4
+
+
+def part_text(part) -> str:
+    """Text the model sees for a message part (used for size estimates)"""
+    if isinstance(part, ToolReturnPart):
+        return part.model_response_str()
+    if isinstance(part, ToolCallPart):
+        return part.tool_name + part.args_as_json_str()
+    content = getattr(part, "content", "")
+    return content if isinstance(content, str) else str(content)
+
+
+def estimate_tokens(messages: list[ModelMessage]) -> int:
+    return sum(len(part_text(part)) for message in messages for part in message.parts) // CHARS_PER_TOKEN
+
+
+def split_turns(messages: list[ModelMessage]) -> tuple[list[SystemPromptPart], list[list[ModelMessage]]]:
+    """Separate system prompt parts and group messages into turns starting at each user prompt"""
+    system_parts, turns = [], []
+    for message in messages:
+        if isinstance(message, ModelRequest):
+            system_parts.extend(p for p in message.parts if isinstance(p, SystemPromptPart))
+            parts = [p for p in message.parts if not isinstance(p, SystemPromptPart)]
+            if not parts:
+                continue
+            message = replace(message, parts=parts)
+            if any(isinstance(p, UserPromptPart) for p in parts) or not turns:
+                turns.append([])
+        elif not turns:
+            turns.append([])
+        turns[-1].append(message)
+    return system_parts, turns
+
+
+def digest_tool_results(turn: list[ModelMessage], max_chars: int) -> list[ModelMessage]:
+    """Replace large tool results with a truncated digest, keeping tool_call_id and tool_name"""
+    compacted = []
+    for message in turn:
+        if isinstance(message, ModelRequest):
+            parts = []
+            for part in message.parts:
+                if isinstance(part, ToolReturnPart):
+                    text = part.model_response_str()
+                    if len(text) > max_chars:
+                        part = replace(part, content=(
+                            f"[digest of earlier {part.tool_name} result, "
+                            f"~{len(text) // CHARS_PER_TOKEN} tokens] {text[:max_chars]}..."
+                        ))
+                parts.append(part)
+            message = replace(message, parts=parts)
+        compacted.append(message)
+    return compacted
+
+
+def collapse_turn(turn: list[ModelMessage]) -> list[ModelMessage]:
+    """Reduce a turn to its user prompt and final text answer (no tool calls left to pair)"""
+    prompts = [
+        p for m in turn if isinstance(m, ModelRequest) for p in m.parts if isinstance(p, UserPromptPart)
+    ]
+    responses = [m for m in turn if isinstance(m, ModelResponse)]
+    answer = ""
+    if responses:
+        answer = "".join(p.content for p in responses[-1].parts if isinstance(p, TextPart))
+    if not prompts or not answer:
+        return []
+    return [ModelRequest(parts=prompts), ModelResponse(parts=[TextPart(answer)])]
+
+
+def validate_tool_pairs(messages: list[ModelMessage]) -> bool:
+    """True if every tool call is answered by the next request and every result has its call"""
+    pending = set()
+    for message in messages:
+        if isinstance(message, ModelResponse):
+            if pending:
+                return False
+            pending = {p.tool_call_id for p in message.parts if isinstance(p, ToolCallPart)}
+        else:
+            results = {
+                p.tool_call_id for p in message.parts
+                if isinstance(p, (ToolReturnPart, RetryPromptPart)) and p.tool_name
+            }
+            if not results <= pending:
+                return False
+            pending -= results
+    return not pending
+
+
+class HistoryManager:
+    """Keeps a session's message history under a token ceiling"""
+
+    def __init__(self, max_tokens=6000, keep_recent_turns=2, digest_chars=400):
+        self.max_tokens = max_tokens
+        self.keep_recent_turns = keep_recent_turns
+        self.digest_chars = digest_chars
+
+    def compact(self, messages: list[ModelMessage]) -> list[ModelMessage]:
+        """History under the token ceiling; tool calls and results stay paired if they were before"""
+        compacted = self._compact(messages)
+        if validate_tool_pairs(compacted) or not validate_tool_pairs(messages):
+            return compacted
+        # Never hand the model an unpaired tool_use/tool_result; fall back to the intact recent turns
+        print("[History] Compaction broke tool call pairs; keeping only the recent turns")
+        system_parts, turns = split_turns(messages)
+        return self._assemble(system_parts, turns[-self.keep_recent_turns:] if self.keep_recent_turns else [])
+
+    @staticmethod
+    def _assemble(system_parts: list[SystemPromptPart], turns: list[list[ModelMessage]]) -> list[ModelMessage]:
+        result = [m for turn in turns for m in turn]
+        if system_parts and result and isinstance(result[0], ModelRequest):
+            result[0] = replace(result[0], parts=[*system_parts, *result[0].parts])
+        elif system_parts:
+            result.insert(0, ModelRequest(parts=list(system_parts)))
+        return result
+
+    def _compact(self, messages: list[ModelMessage]) -> list[ModelMessage]:
+        if estimate_tokens(messages) <= self.max_tokens:
+            return list(messages)
+
+        system_parts, turns = split_turns(messages)
+        split = max(len(turns) - self.keep_recent_turns, 0)
+        old, recent = turns[:split], turns[split:]
+
+        def build() -> list[ModelMessage]:
+            return self._assemble(system_parts, old + recent)
+
+        old = [digest_tool_results(turn, self.digest_chars) for turn in old]
+        if estimate_tokens(build()) <= self.max_tokens:
+            return build()
+
+        for i in range(len(old)):
+            old[i] = collapse_turn(old[i])
+            if estimate_tokens(build()) <= self.max_tokens:
+                return build()
+
+        while old and estimate_tokens(build()) > self.max_tokens:
+            old.pop(0)
+        return build()
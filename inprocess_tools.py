@@ -0,0 +1,71 @@
+"""
+custom_mcp_server's tools as an in-process toolset.
+
+Instead of spawning custom_mcp_server.py and talking to it over stdio, its
+list_tools/call_tool handlers are called directly, so a tool call costs a
+coroutine call rather than JSON-RPC serialization, pipe I/O and a second
+event loop. Calls share the app's Polygon client, response cache and request
+coalescing with the fast path and the prefetcher. The toolset looks like an
+MCP server to MCPServerPool (async context manager, list_tools, get_tools,
+call_tool), so tool-result caching, tracing and call listeners still apply.
+"""
+
+from typing import Any
+
+import pydantic_core
+from pydantic_ai import RunContext
+from pydantic_ai.mcp import TOOL_SCHEMA_VALIDATOR
+from pydantic_ai.tools import ToolDefinition
+from pydantic_ai.toolsets import AbstractToolset, ToolsetTool
+
+import custom_mcp_server
+
+
+def map_text_result(text: str) -> Any:
+    """Decode a tool's text the way pydantic-ai's MCP client does (JSON objects/arrays are parsed)"""
+    if text.startswith(("[", "{")):
+        try:
+            return pydantic_core.from_json(text)
+        except ValueError:
+            pass
+    return text
+
+
+class InProcessToolServer(AbstractToolset[Any]):
+    """custom_mcp_server's handlers called as plain coroutines in the app's event loop"""
+
+    def __init__(self, id: str = "custom-inprocess", max_retries: int = 1):
+        self._id = id
+        self.max_retries = max_retries
+
+    @property
+    def id(self) -> str | None:
+        return self._id
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *args: Any) -> bool | None:
+        return None
+
+    async def list_tools(self):
+        return await custom_mcp_server.list_tools()
+
+    async def get_tools(self, ctx: RunContext[Any]) -> dict[str, ToolsetTool[Any]]:
+        return {
+            tool.name: ToolsetTool(
+                toolset=self,
+                tool_def=ToolDefinition(
+                    name=tool.name, description=tool.description, parameters_json_schema=tool.inputSchema
+                ),
+                max_retries=self.max_retries,
+                args_validator=TOOL_SCHEMA_VALIDATOR,
+            )
+            for tool in await self.list_tools()
+        }
+
+    async def call_tool(self, name: str, tool_args: dict[str, Any], ctx: RunContext[Any],
+                        tool: ToolsetTool[Any]) -> Any:
+        contents = await custom_mcp_server.call_tool(name, tool_args)
+        results = [map_text_result(content.text) for content in contents]
+        return results[0] if len(results) == 1 else results
@@ -0,0 +1,358 @@
+"""
+Pool of MCP server subprocesses exposed to the agent as a single toolset.
+
+Tool calls are routed to the member with the fewest outstanding requests, so
+concurrent sessions no longer queue behind each other on one stdio pipe.
+A background task health-checks every member and replaces processes that
+stop responding. The tool list can be cached on disk, so a restarted app
+does not have to wait for an MCP server to list its tools again.
+"""
+
+import asyncio
+import contextlib
+import dataclasses
+import json
+import os
+import sys
+import time
+from typing import Any, Callable
+
+from pydantic_ai import RunContext
+from pydantic_ai.exceptions import ModelRetry
+from pydantic_ai.mcp import TOOL_SCHEMA_VALIDATOR, MCPServer
+from pydantic_ai.tools import ToolDefinition
+from pydantic_ai.toolsets import AbstractToolset, ToolsetTool
+
+
+# Tool-result cache TTLs (seconds) by substring of the tool name; first match wins
+TOOL_CACHE_TTLS = (
+    ("snapshot", 0),
+    ("last_trade", 0),
+    ("last_quote", 0),
+    ("market_status", 15),
+    ("previous_close", 900),
+    ("news", 300),
+    ("details", 6 * 3600),
+    ("dividends", 6 * 3600),
+    ("splits", 6 * 3600),
+    ("search_tickers", 6 * 3600),
+    ("financials", 6 * 3600),
+)
+DEFAULT_TOOL_CACHE_TTL = 60
+
+
+def tool_cache_ttl(name: str) -> float:
+    for fragment, ttl in TOOL_CACHE_TTLS:
+        if fragment in name:
+            return ttl
+    return DEFAULT_TOOL_CACHE_TTL
+
+
+class PoolMember:
+    """One MCP server process and its routing counters"""
+
+    def __init__(self, index: int):
+        self.index = index
+        self.server = None
+        self.task = None
+        self.ready = asyncio.Event()
+        self.stop = asyncio.Event()
+        self.healthy = False
+        self.outstanding = 0
+        self.calls = 0
+        self.errors = 0
+        self.restarts = 0
+        self.restarting = False
+
+    def stats(self) -> dict:
+        return {
+            "index": self.index,
+            "healthy": self.healthy,
+            "queue_depth": self.outstanding,
+            "calls": self.calls,
+            "errors": self.errors,
+            "restarts": self.restarts,
+        }
+
+
+class MCPServerPool(AbstractToolset[Any]):
+    """Keeps size MCP servers warm and load-balances tool calls across them.
+
+    Each server is entered and exited by its own owner task, because the MCP
+    stdio client must be closed from the task that opened it. Restarting a
+    member stops its owner task and starts a fresh one with a new server.
+    """
+
+    def __init__(self, factory: Callable[[], MCPServer], size: int = 2,
+                 health_interval: float = 30.0, health_timeout: float = 10.0, id: str = "mcp-pool",
+                 cache=None, cache_ttl: Callable[[str], float] = tool_cache_ttl, tracer=None,
+                 tools_cache_path: str | None = None, tools_fingerprint: str = "",
+                 tools_cache_max_age: float = 86400, max_retries: int = 1):
+        self.factory = factory
+        self.tracer = tracer
+        self.cache = cache
+        self.cache_ttl = cache_ttl
+        self.cache_hits = 0
+        self.cache_misses = 0
+        self.call_listeners = []  # Called with (name, tool_args) for every tool call
+        self.size = size
+        self.health_interval = health_interval
+        self.health_timeout = health_timeout
+        self._id = id
+        self.members = []
+        self.tools_cache_path = tools_cache_path
+        self.tools_fingerprint = tools_fingerprint  # Cached tools from a different server version are ignored
+        self.tools_cache_max_age = tools_cache_max_age
+        self.tools_source = None  # "disk" or "server" once the tool list is known
+        self.max_retries = max_retries
+        self._tools = None
+        self._running_count = 0
+        self._enter_lock = asyncio.Lock()
+        self._health_task = None
+
+    @property
+    def id(self) -> str | None:
+        return self._id
+
+    # ------------- Lifecycle -------------
+    async def __aenter__(self):
+        async with self._enter_lock:
+            if self._running_count == 0:
+                self.members = [PoolMember(i) for i in range(self.size)]
+                await asyncio.gather(*(self._start_member(m) for m in self.members))
+                if not any(m.healthy for m in self.members):
+                    await self._stop_all()
+                    raise RuntimeError("No MCP server in the pool could be started")
+                self._health_task = asyncio.create_task(self._health_loop())
+            self._running_count += 1
+        return self
+
+    async def __aexit__(self, *args: Any) -> bool | None:
+        async with self._enter_lock:
+            self._running_count -= 1
+            if self._running_count == 0:
+                if self._health_task is not None:
+                    self._health_task.cancel()
+                    self._health_task = None
+                await self._stop_all()
+        return None
+
+    async def _own_member(self, member: PoolMember):
+        """Owner task: holds the server context open until asked to stop"""
+        server = self.factory()
+        try:
+            async with server:
+                member.server = server
+                member.healthy = True
+                member.ready.set()
+                await member.stop.wait()
+        except Exception as e:
+            print(f"[MCPPool] Member {member.index} failed: {e}", file=sys.stderr)
+        finally:
+            member.healthy = False
+            member.ready.set()
+
+    async def _start_member(self, member: PoolMember):
+        member.ready.clear()
+        member.stop.clear()
+        member.task = asyncio.create_task(self._own_member(member))
+        await member.ready.wait()
+
+    async def _stop_member(self, member: PoolMember):
+        member.healthy = False
+        member.stop.set()
+        if member.task is not None:
+            _, pending = await asyncio.wait({member.task}, timeout=self.health_timeout)
+            for task in pending:
+                task.cancel()
+        member.task = None
+        member.server = None
+
+    async def _stop_all(self):
+        await asyncio.gather(*(self._stop_member(m) for m in self.members))
+
+    async def restart_member(self, member: PoolMember):
+        if member.restarting:
+            return
+        member.restarting = True
+        try:
+            print(f"[MCPPool] Restarting member {member.index}", file=sys.stderr)
+            await self._stop_member(member)
+            member.restarts += 1
+            await self._start_member(member)
+        finally:
+            member.restarting = False
+
+    # ------------- Health Checks -------------
+    async def _check(self, member: PoolMember) -> bool:
+        if member.server is None or member.task is None or member.task.done():
+            return False
+        try:
+            await asyncio.wait_for(member.server.list_tools(), timeout=self.health_timeout)
+            return True
+        except Exception:
+            return False
+
+    async def _health_loop(self):
+        while True:
+            await asyncio.sleep(self.health_interval)
+            for member in self.members:
+                # A busy member is evidently alive; probing it would only add to its queue
+                if member.outstanding:
+                    continue
+                if not await self._check(member):
+                    await self.restart_member(member)
+
+    # ------------- Toolset -------------
+    def _pick(self) -> PoolMember:
+        healthy = [m for m in self.members if m.healthy and m.server is not None]
+        if not healthy:
+            raise RuntimeError("No healthy MCP server available")
+        return min(healthy, key=lambda m: (m.outstanding, m.calls))
+
+    async def get_tools(self, ctx: RunContext[Any]) -> dict[str, ToolsetTool[Any]]:
+        # All members run the same server, so the tool list is fetched once (or read from disk)
+        await self.load_tools()
+        return self._tools
+
+    async def load_tools(self, fetch: bool = True) -> bool:
+        """Load the tool list from the disk cache or, if fetch, from a running member; returns whether it is known"""
+        if self._tools is None:
+            tool_defs = await asyncio.to_thread(self._read_tools_cache)
+            if tool_defs is not None:
+                self.tools_source = "disk"
+            else:
+                if not fetch:
+                    return False
+                tools = await self._pick().server.get_tools(None)
+                tool_defs = [tool.tool_def for tool in tools.values()]
+                self.tools_source = "server"
+                await asyncio.to_thread(self._write_tools_cache, tool_defs)
+            self._tools = {
+                tool_def.name: ToolsetTool(
+                    toolset=self, tool_def=tool_def, max_retries=self.max_retries,
+                    args_validator=TOOL_SCHEMA_VALIDATOR,
+                )
+                for tool_def in tool_defs
+            }
+        return True
+
+    def _read_tools_cache(self) -> list[ToolDefinition] | None:
+        if not self.tools_cache_path:
+            return None
+        try:
+            with open(self.tools_cache_path) as f:
+                cached = json.load(f)
+            if cached["fingerprint"] != self.tools_fingerprint:
+                return None
+            if time.time() - cached["saved_at"] > self.tools_cache_max_age:
+                return None
+            return [ToolDefinition(**tool_def) for tool_def in cached["tools"]]
+        except (OSError, ValueError, KeyError, TypeError):
+            return None
+
+    def _write_tools_cache(self, tool_defs: list[ToolDefinition]):
+        if not self.tools_cache_path:
+            return
+        try:
+            os.makedirs(os.path.dirname(self.tools_cache_path) or ".", exist_ok=True)
+            payload = json.dumps({
+                "fingerprint": self.tools_fingerprint,
+                "saved_at": time.time(),
+                "tools": [dataclasses.asdict(tool_def) for tool_def in tool_defs],
+            })
+            # Written to a temp file and renamed, so other workers never read half a file
+            temp_path = f"{self.tools_cache_path}.{os.getpid()}.tmp"
+            with open(temp_path, "w") as f:
+                f.write(payload)
+            os.replace(temp_path, self.tools_cache_path)
+        except (OSError, TypeError, ValueError) as e:
+            print(f"[MCPPool] Could not cache the tool list: {e}", file=sys.stderr)
+
+    async def call_tool(self, name: str, tool_args: dict[str, Any], ctx: RunContext[Any],
+                        tool: ToolsetTool[Any]) -> Any:
+        for listener in self.call_listeners:
+            listener(name, tool_args)
+        ttl = self.cache_ttl(name) if self.cache is not None else 0
+        if ttl <= 0:
+            return await self._call_member(name, tool_args, ctx, tool)
+
+        key = self._cache_key(name, tool_args)
+        cached = await asyncio.to_thread(self.cache.get, key)
+        if cached is not None:
+            self.cache_hits += 1
+            return cached
+        self.cache_misses += 1
+        result = await self._call_member(name, tool_args, ctx, tool)
+        await self._cache_result(key, result, ttl)
+        return result
+
+    async def refresh(self, name: str, tool_args: dict[str, Any]) -> bool:
+        """Re-run a cacheable tool call and overwrite its cached result (used for prefetching)"""
+        ttl = self.cache_ttl(name) if self.cache is not None else 0
+        if ttl <= 0:
+            return False
+        result = await self._call_member(name, tool_args, None, None)
+        return await self._cache_result(self._cache_key(name, tool_args), result, ttl)
+
+    @staticmethod
+    def _cache_key(name: str, tool_args: dict[str, Any]) -> str:
+        return f"tool:{name}:{json.dumps(tool_args, sort_keys=True, default=str)}"
+
+    async def _cache_result(self, key: str, result: Any, ttl: float) -> bool:
+        try:
+            json.dumps(result)
+        except (TypeError, ValueError):
+            return False  # Binary/non-JSON content is not shared
+        if isinstance(result, str) and result.startswith("Error"):
+            return False
+        await asyncio.to_thread(self.cache.set, key, result, ttl)
+        return True
+
+    def _span(self, name: str, tool_args: dict[str, Any]):
+        if self.tracer is None:
+            return contextlib.nullcontext()
+        return self.tracer.span("tool_call", tool=name, args_bytes=len(json.dumps(tool_args, default=str)))
+
+    async def _call_member(self, name: str, tool_args: dict[str, Any], ctx: RunContext[Any],
+                           tool: ToolsetTool[Any]) -> Any:
+        """One MCP round trip (traced: member, retry and result size)"""
+        with self._span(name, tool_args) as span:
+            result = await self._call_any_member(name, tool_args, ctx, tool, span)
+            if span is not None:
+                span.set(result_bytes=len(result if isinstance(result, str) else json.dumps(result, default=str)))
+            return result
+
+    async def _call_any_member(self, name: str, tool_args: dict[str, Any], ctx: RunContext[Any],
+                               tool: ToolsetTool[Any], span) -> Any:
+        member = self._pick()
+        if span is not None:
+            span.set(member=member.index)
+        member.outstanding += 1
+        member.calls += 1
+        try:
+            return await member.server.call_tool(name, tool_args, ctx, tool)
+        except ModelRetry:
+            raise
+        except Exception:
+            # Transport failure: take the member out of rotation and retry once elsewhere
+            member.errors += 1
+            member.healthy = False
+            asyncio.create_task(self.restart_member(member))
+            other = self._pick()
+            if span is not None:
+                span.set(retried_on=other.index)
+            other.outstanding += 1
+            other.calls += 1
+            try:
+                return await other.server.call_tool(name, tool_args, ctx, tool)
+            finally:
+                other.outstanding -= 1
+        finally:
+            member.outstanding -= 1
+
+    def stats(self) -> list[dict]:
+        return [m.stats() for m in self.members]
+
+    def cache_stats(self) -> dict:
+        return {"hits": self.cache_hits, "misses": self.cache_misses}
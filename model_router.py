@@ -0,0 +1,122 @@
+"""
+Tiered model routing: simple lookups go to a fast, cheap model.
+
+Each query is scored on the number of tickers it mentions, analysis verbs,
+length, and how much conversation precedes it. Simple queries run on the
+fast tier with a small request budget; if that run fails, exhausts its
+budget, or asks for a tool outside its subset, the query is re-run on the
+standard tier. Every decision is logged as one JSON line for tuning.
+"""
+
+import json
+import os
+import re
+import time
+from dataclasses import dataclass, field
+from typing import TYPE_CHECKING
+
+if TYPE_CHECKING:
+    from pydantic_ai.usage import UsageLimits
+
+
+FAST_TIER = "fast"
+STANDARD_TIER = "standard"
+
+ANALYSIS_WORDS = {
+    "analyze", "analyse", "analysis", "compare", "comparison", "versus", "vs", "recommend",
+    "should", "why", "explain", "evaluate", "forecast", "predict", "prediction", "outlook",
+    "invest", "investment", "strategy", "risk", "risks", "valuation", "undervalued",
+    "overvalued", "correlation", "trend", "trends", "sentiment", "bet", "portfolio", "thesis",
+    "pros", "cons", "summarize", "summary", "report", "breakdown", "calculate", "estimate",
+}
+
+# Uppercase words that look like tickers but are not
+NOT_TICKERS = {"I", "A", "THE", "AND", "OR", "OF", "USD", "ETF", "CEO", "EPS", "PE", "RSI",
+               "SMA", "EMA", "MACD", "YTD", "IPO", "AI", "US", "NYSE", "OK"}
+
+
+def count_tickers(query: str) -> int:
+    tickers = set(re.findall(r"\$([A-Za-z]{1,5})\b", query))
+    tickers |= {w for w in re.findall(r"\b[A-Z]{1,5}\b", query) if w not in NOT_TICKERS}
+    return len({t.upper() for t in tickers})
+
+
+@dataclass
+class RouteDecision:
+    tier: str
+    reasons: list = field(default_factory=list)
+    tickers: int = 0
+    escalated_from: str | None = None
+    escalation_reason: str | None = None
+
+
+class ModelRouter:
+    """Chooses a tier per query and logs routing outcomes"""
+
+    def __init__(self, max_fast_tickers=2, max_fast_words=25, max_fast_history=6,
+                 fast_request_limit=4, log_path=None):
+        self.max_fast_tickers = max_fast_tickers
+        self.max_fast_words = max_fast_words
+        self.max_fast_history = max_fast_history
+        self.fast_request_limit = fast_request_limit
+        self.log_path = log_path
+        self.counts = {FAST_TIER: 0, STANDARD_TIER: 0, "escalations": 0}
+
+    def route(self, query: str, message_history: list, full_tools: bool) -> RouteDecision:
+        words = re.findall(r"[a-z]+", query.lower())
+        tickers = count_tickers(query)
+        reasons = []
+        if tickers > self.max_fast_tickers:
+            reasons.append(f"tickers={tickers}")
+        analysis = sorted(set(words) & ANALYSIS_WORDS)
+        if analysis:
+            reasons.append(f"analysis={','.join(analysis)}")
+        if len(words) > self.max_fast_words:
+            reasons.append(f"words={len(words)}")
+        if len(message_history) > self.max_fast_history:
+            reasons.append(f"history={len(message_history)}")
+        if full_tools:
+            reasons.append("all_tools")
+        tier = STANDARD_TIER if reasons else FAST_TIER
+        return RouteDecision(tier=tier, reasons=reasons or ["simple"], tickers=tickers)
+
+    def usage_limits(self, decision: RouteDecision) -> "UsageLimits | None":
+        """The fast tier gets a small request budget; running out of it triggers escalation"""
+        if decision.tier == FAST_TIER:
+            from pydantic_ai.usage import UsageLimits
+            return UsageLimits(request_limit=self.fast_request_limit)
+        return None
+
+    def escalate(self, decision: RouteDecision, reason: str) -> RouteDecision:
+        self.counts["escalations"] += 1
+        return RouteDecision(
+            tier=STANDARD_TIER, reasons=decision.reasons, tickers=decision.tickers,
+            escalated_from=decision.tier, escalation_reason=reason,
+        )
+
+    def log(self, decision: RouteDecision, query: str, elapsed: float, usage=None, ok: bool = True):
+        self.counts[decision.tier] += 1
+        record = {
+            "ts": round(time.time(), 3),
+            "tier": decision.tier,
+            "reasons": decision.reasons,
+            "tickers": decision.tickers,
+            "query_words": len(query.split()),
+            "escalated_from": decision.escalated_from,
+            "escalation_reason": decision.escalation_reason,
+            "elapsed": round(elapsed, 3),
+            "ok": ok,
+        }
+        if usage is not None:
+            record["input_tokens"] = usage.input_tokens or 0
+            record["output_tokens"] = usage.output_tokens or 0
+            record["requests"] = usage.requests
+        line = json.dumps(record)
+        print(f"[Router] {line}")
+        if self.log_path:
+            os.makedirs(os.path.dirname(self.log_path) or ".", exist_ok=True)
+            with open(self.log_path, "a") as f:
+                f.write(line + "\n")
+
+    def stats(self) -> dict:
+        return dict(self.counts)
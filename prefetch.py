@@ -0,0 +1,186 @@
+"""
+Background warm-up of hot tickers and market status.
+
+HotTickers keeps decaying counts of the tickers (and exact tool calls) users
+ask for. The Prefetcher periodically re-runs the hottest cacheable tool calls
+through the MCP pool so their results sit fresh in the tool-result cache,
+and warms previous close and ticker details in the app's direct Polygon
+client (used by the fast path). The refresh interval follows
+/v1/marketstatus/now, and a rolling hourly budget caps Polygon calls.
+"""
+
+import asyncio
+import json
+import math
+import time
+from collections import deque
+
+# Refresh interval in seconds by market state from /v1/marketstatus/now
+PREFETCH_INTERVALS = {"open": 60, "extended-hours": 300, "closed": 1800}
+
+
+class HotTickers:
+    """Exponentially decaying popularity counts for tickers and tool calls"""
+
+    def __init__(self, half_life: float = 3600.0, max_entries: int = 500):
+        self.decay = math.log(2) / half_life
+        self.max_entries = max_entries
+        self.tickers = {}  # ticker -> (score, updated)
+        self.calls = {}    # (tool name, args json) -> (score, updated)
+
+    def _bump(self, table: dict, key, now: float):
+        score, updated = table.get(key, (0.0, now))
+        table[key] = (score * math.exp(-self.decay * (now - updated)) + 1.0, now)
+        if len(table) > self.max_entries:
+            # Forget the coldest quarter
+            coldest = sorted(table, key=lambda k: self._score(table, k, now))[:self.max_entries // 4]
+            for k in coldest:
+                del table[k]
+
+    def _score(self, table: dict, key, now: float) -> float:
+        score, updated = table[key]
+        return score * math.exp(-self.decay * (now - updated))
+
+    def record_tickers(self, tickers):
+        now = time.time()
+        for ticker in tickers:
+            if ticker:
+                self._bump(self.tickers, str(ticker).strip().upper(), now)
+
+    def record_call(self, name: str, tool_args: dict):
+        """MCPServerPool call listener: remember the call and the tickers it mentions"""
+        tickers = []
+        if tool_args.get("ticker"):
+            tickers.append(tool_args["ticker"])
+        value = tool_args.get("tickers")
+        if isinstance(value, str):
+            tickers.extend(value.split(","))
+        elif isinstance(value, list):
+            tickers.extend(value)
+        if not tickers:
+            return
+        self.record_tickers(tickers)
+        self._bump(self.calls, (name, json.dumps(tool_args, sort_keys=True, default=str)), time.time())
+
+    def top_tickers(self, n: int) -> list[str]:
+        now = time.time()
+        return sorted(self.tickers, key=lambda k: -self._score(self.tickers, k, now))[:n]
+
+    def top_calls(self, n: int) -> list[tuple[str, dict]]:
+        now = time.time()
+        keys = sorted(self.calls, key=lambda k: -self._score(self.calls, k, now))[:n]
+        return [(name, json.loads(args)) for name, args in keys]
+
+
+class Prefetcher:
+    """Market-hours-aware refresh loop with an hourly Polygon call budget"""
+
+    def __init__(self, hot: HotTickers, pool=None, seed_tickers=(), top_n: int = 10,
+                 calls_per_hour: int = 300, on_calls=None):
+        self.hot = hot
+        self.pool = pool
+        self.top_n = top_n
+        self.calls_per_hour = calls_per_hour
+        self.on_calls = on_calls  # Reports Polygon calls spent (e.g. to the rate limiter)
+        self.spent = deque()      # Timestamps of calls in the last hour
+        self.market = None
+        self.cycles = 0
+        self.last_cycle = None
+        self.task = None
+        hot.record_tickers(seed_tickers)
+
+    # ------------- Budget -------------
+    def remaining_budget(self) -> int:
+        cutoff = time.time() - 3600
+        while self.spent and self.spent[0] < cutoff:
+            self.spent.popleft()
+        return self.calls_per_hour - len(self.spent)
+
+    def _spend(self, calls: int = 1) -> bool:
+        if self.remaining_budget() < calls:
+            return False
+        now = time.time()
+        self.spent.extend([now] * calls)
+        if self.on_calls:
+            self.on_calls(calls)
+        return True
+
+    # ------------- Refresh -------------
+    async def _market_status(self) -> str:
+        # Imported where used so importing this module (and the app) stays cheap
+        import custom_mcp_server
+        if not self._spend():
+            return self.market or "closed"
+        data = await custom_mcp_server.call_polygon_api("/v1/marketstatus/now")
+        return data.get("market") or "closed"
+
+    async def _warm_direct(self, tickers: list[str]):
+        """Previous close and details in the direct client; one batched snapshot to keep connections warm"""
+        import custom_mcp_server
+        for ticker in tickers:
+            for endpoint in (f"/v2/aggs/ticker/{ticker}/prev", f"/v3/reference/tickers/{ticker}"):
+                key = custom_mcp_server.response_cache.make_key(endpoint, {})
+                if custom_mcp_server.response_cache.get(key) is not None or not self._spend():
+                    continue
+                try:
+                    await custom_mcp_server.call_polygon_api(endpoint)
+                except Exception as e:
+                    print(f"[Prefetch] {endpoint} failed: {custom_mcp_server.describe_error(e)}")
+        if tickers and self.market == "open" and self._spend():
+            try:
+                await custom_mcp_server.batch_stock_prices(tickers)
+            except Exception as e:
+                print(f"[Prefetch] Snapshot failed: {custom_mcp_server.describe_error(e)}")
+
+    async def _warm_pool(self):
+        """Re-run the hottest cacheable tool calls so the tool-result cache stays fresh"""
+        if self.pool is None or not self.pool.members:
+            return
+        for name, tool_args in self.hot.top_calls(self.top_n):
+            if self.pool.cache_ttl(name) <= 0 or not self._spend():
+                continue
+            try:
+                await self.pool.refresh(name, tool_args)
+            except Exception as e:
+                print(f"[Prefetch] {name} failed: {e}")
+
+    async def run_cycle(self):
+        previous = self.market
+        self.market = await self._market_status()
+        if previous is not None and previous != self.market:
+            print(f"[Prefetch] Market is now {self.market}")
+        await self._warm_direct(self.hot.top_tickers(self.top_n))
+        await self._warm_pool()
+        self.cycles += 1
+        self.last_cycle = time.time()
+
+    async def _loop(self):
+        import custom_mcp_server
+        while True:
+            try:
+                await self.run_cycle()
+            except Exception as e:
+                print(f"[Prefetch] Cycle failed: {custom_mcp_server.describe_error(e)}")
+            interval = PREFETCH_INTERVALS.get(self.market, PREFETCH_INTERVALS["closed"])
+            if self.market != "open":
+                # Wake up for the opening bell, when previous closes roll over
+                interval = min(interval, custom_mcp_server.seconds_until_next_session_open() + 5)
+            await asyncio.sleep(interval)
+
+    def start(self):
+        if self.task is None:
+            self.task = asyncio.create_task(self._loop())
+
+    async def stop(self):
+        if self.task is not None:
+            self.task.cancel()
+            self.task = None
+
+    def stats(self) -> dict:
+        return {
+            "market": self.market,
+            "cycles": self.cycles,
+            "last_cycle": self.last_cycle,
+            "budget_remaining": self.remaining_budget(),
+            "hot_tickers": self.hot.top_tickers(self.top_n),
+        }
@@ -0,0 +1,195 @@
+"""
+Per-client rate limiting with upstream budget accounting.
+
+Each client key (IP address or session) gets a token bucket for requests and
+a token bucket for Anthropic tokens. Process-wide buckets cap total Anthropic
+token and Polygon call spend. Requests that cannot run yet are queued and
+released round-robin across clients, so one heavy user cannot starve others.
+"""
+
+import asyncio
+import time
+from abc import ABC, abstractmethod
+from collections import OrderedDict, deque
+
+
+class TokenBucket:
+    """Classic token bucket; the balance may go negative to record overspend"""
+
+    def __init__(self, capacity: float, refill_per_second: float):
+        self.capacity = capacity
+        self.refill_per_second = refill_per_second
+        self.tokens = capacity
+        self.updated = time.monotonic()
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.refill_per_second)
+        self.updated = now
+
+    def available(self) -> float:
+        self._refill()
+        return self.tokens
+
+    def wait_time(self, amount: float) -> float:
+        """Seconds until amount can be taken (0 if it can be taken now)"""
+        deficit = amount - self.available()
+        if deficit <= 0:
+            return 0.0
+        if self.refill_per_second <= 0:
+            return float("inf")
+        return deficit / self.refill_per_second
+
+    def take(self, amount: float):
+        self._refill()
+        self.tokens -= amount
+
+
+class BaseRateLimiter(ABC):
+    """Interface the app relies on; alternative backends (e.g. shared state) implement it"""
+
+    @abstractmethod
+    async def acquire(self, key: str) -> tuple[bool, float]:
+        """Wait for a slot for key. Returns (True, seconds waited) or (False, estimated wait)."""
+
+    async def estimate_wait(self, key: str) -> float:
+        """Seconds a new request from key would currently have to wait"""
+        return 0.0
+
+    @abstractmethod
+    def record_usage(self, key: str, input_tokens: int = 0, output_tokens: int = 0, polygon_calls: int = 0):
+        """Debit what a finished run actually consumed; must not block the event loop"""
+
+    def stats(self) -> dict:
+        return {}
+
+
+class RateLimiter(BaseRateLimiter):
+    """In-process fair limiter keyed per client.
+
+    A request may start when its client has a request token available, its
+    client token bucket is not in debt, and the global token/Polygon buckets
+    are not in debt. Usage is debited after the run, so an expensive query
+    delays that client's next one (and everyone's, only once the global
+    budget is exhausted).
+    """
+
+    def __init__(self, requests_per_minute=3, burst=3, tokens_per_minute=30000,
+                 global_tokens_per_minute=30000, polygon_calls_per_minute=0, max_wait=30):
+        self.requests_per_minute = requests_per_minute
+        self.burst = burst
+        self.tokens_per_minute = tokens_per_minute
+        self.max_wait = max_wait
+        self.request_buckets = {}
+        self.token_buckets = {}
+        self.global_tokens = TokenBucket(global_tokens_per_minute, global_tokens_per_minute / 60)
+        self.polygon_calls = (
+            TokenBucket(polygon_calls_per_minute, polygon_calls_per_minute / 60)
+            if polygon_calls_per_minute else None
+        )
+        self.waiters = OrderedDict()  # key -> deque of futures, in round-robin order
+        self.usage = {}
+        self._timer = None
+
+    def _prune(self):
+        """Forget idle clients whose buckets have fully refilled"""
+        for key in list(self.request_buckets):
+            if (key not in self.waiters
+                    and self.request_buckets[key].available() >= self.burst
+                    and self.token_buckets[key].available() >= self.tokens_per_minute):
+                del self.request_buckets[key], self.token_buckets[key]
+                self.usage.pop(key, None)
+
+    def _buckets(self, key: str) -> tuple[TokenBucket, TokenBucket]:
+        if key not in self.request_buckets:
+            if len(self.request_buckets) >= 10000:
+                self._prune()
+            self.request_buckets[key] = TokenBucket(self.burst, self.requests_per_minute / 60)
+            self.token_buckets[key] = TokenBucket(self.tokens_per_minute, self.tokens_per_minute / 60)
+        return self.request_buckets[key], self.token_buckets[key]
+
+    def _wait_time(self, key: str) -> float:
+        """Seconds until key is allowed to start a request"""
+        requests, tokens = self._buckets(key)
+        waits = [requests.wait_time(1), tokens.wait_time(0), self.global_tokens.wait_time(0)]
+        if self.polygon_calls is not None:
+            waits.append(self.polygon_calls.wait_time(0))
+        return max(waits)
+
+    def _grant(self, key: str):
+        self._buckets(key)[0].take(1)
+        self.usage.setdefault(key, {"requests": 0, "input_tokens": 0, "output_tokens": 0, "polygon_calls": 0})
+        self.usage[key]["requests"] += 1
+
+    def _dispatch(self):
+        """Release queued requests round-robin across keys while capacity allows"""
+        self._timer = None
+        next_wait = None
+        progressed = True
+        while progressed and self.waiters:
+            progressed = False
+            for key in list(self.waiters):
+                queue = self.waiters[key]
+                while queue and queue[0].done():
+                    queue.popleft()
+                if not queue:
+                    del self.waiters[key]
+                    continue
+                wait = self._wait_time(key)
+                if wait > 0:
+                    next_wait = wait if next_wait is None else min(next_wait, wait)
+                    continue
+                self._grant(key)
+                queue.popleft().set_result(True)
+                # Move this key to the back so other clients go next
+                self.waiters.move_to_end(key)
+                progressed = True
+                break
+        if self.waiters and next_wait is not None and next_wait != float("inf"):
+            self._timer = asyncio.get_running_loop().call_later(next_wait, self._dispatch)
+
+    async def estimate_wait(self, key: str) -> float:
+        return self._estimate_wait(key)
+
+    def _estimate_wait(self, key: str) -> float:
+        queued_ahead = len(self.waiters.get(key, ()))
+        return self._wait_time(key) + queued_ahead * 60 / self.requests_per_minute
+
+    async def acquire(self, key: str) -> tuple[bool, float]:
+        if key not in self.waiters and self._wait_time(key) == 0:
+            self._grant(key)
+            return True, 0.0
+
+        estimate = self._estimate_wait(key)
+        if estimate > self.max_wait:
+            return False, estimate
+
+        started = time.monotonic()
+        future = asyncio.get_running_loop().create_future()
+        self.waiters.setdefault(key, deque()).append(future)
+        if self._timer is not None:
+            self._timer.cancel()
+        self._dispatch()
+        try:
+            await asyncio.wait_for(future, timeout=self.max_wait)
+        except asyncio.TimeoutError:
+            return False, self._wait_time(key)
+        return True, time.monotonic() - started
+
+    def record_usage(self, key: str, input_tokens: int = 0, output_tokens: int = 0, polygon_calls: int = 0):
+        total = input_tokens + output_tokens
+        self._buckets(key)[1].take(total)
+        self.global_tokens.take(total)
+        if self.polygon_calls is not None:
+            self.polygon_calls.take(polygon_calls)
+        usage = self.usage.setdefault(key, {"requests": 0, "input_tokens": 0, "output_tokens": 0, "polygon_calls": 0})
+        usage["input_tokens"] += input_tokens
+        usage["output_tokens"] += output_tokens
+        usage["polygon_calls"] += polygon_calls
+
+    def stats(self) -> dict:
+        return {
+            "queued": sum(len(q) for q in self.waiters.values()),
+            "global_tokens_available": round(self.global_tokens.available()),
+            "clients": self.usage,
+        }
@@ -0,0 +1,97 @@
+"""
+Markdown rendering off the event loop.
+
+markdown.markdown is pure Python: a long, table-heavy answer can take tens
+of milliseconds, and on the event loop that stalls every other connection.
+MarkdownRenderer renders in a thread or process pool and keeps an LRU cache
+of results keyed by a hash of the text, so answers that repeat (the answer
+cache, common questions) are rendered once per worker. Short texts are
+rendered inline, where handing them to the pool costs more than rendering.
+"""
+
+import asyncio
+import hashlib
+import multiprocessing
+import time
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+MARKDOWN_EXTENSIONS = ['tables', 'fenced_code']
+
+
+def render_markdown(text: str) -> str:
+    """Render markdown to HTML (module-level so process pools can pickle it)"""
+    import markdown
+    return markdown.markdown(text, extensions=MARKDOWN_EXTENSIONS)
+
+
+class MarkdownRenderer:
+    """Async markdown rendering with a pool and a render cache keyed by text hash"""
+
+    def __init__(self, pool: str = "thread", workers: int = 2, cache_size: int = 256,
+                 inline_below: int = 2000):
+        self.pool = pool                  # "thread", "process" or "inline"
+        self.workers = workers
+        self.cache_size = cache_size
+        self.inline_below = inline_below  # characters; shorter texts skip the pool
+        self.cache = OrderedDict()
+        self.executor = None
+        self.hits = 0
+        self.misses = 0
+        self.offloaded = 0
+        self.render_ms = 0.0
+
+    def _executor(self):
+        # Created on first use so importing the app does not start threads or processes
+        if self.executor is None:
+            if self.pool == "process":
+                # Spawned, not forked: a forked child would hold copies of open client sockets,
+                # so closed connections would never see EOF
+                self.executor = ProcessPoolExecutor(
+                    max_workers=self.workers, mp_context=multiprocessing.get_context("spawn")
+                )
+            else:
+                self.executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="markdown")
+        return self.executor
+
+    @staticmethod
+    def key(text: str) -> str:
+        return hashlib.blake2b(text.encode(), digest_size=16).hexdigest()
+
+    async def render(self, text: str) -> str:
+        """HTML for a markdown text, from the cache or rendered without blocking the loop"""
+        key = self.key(text)
+        html = self.cache.get(key)
+        if html is not None:
+            self.cache.move_to_end(key)
+            self.hits += 1
+            return html
+
+        self.misses += 1
+        started = time.perf_counter()
+        if self.pool == "inline" or len(text) < self.inline_below:
+            html = render_markdown(text)
+        else:
+            self.offloaded += 1
+            html = await asyncio.get_running_loop().run_in_executor(self._executor(), render_markdown, text)
+        self.render_ms += (time.perf_counter() - started) * 1000
+
+        self.cache[key] = html
+        while len(self.cache) > self.cache_size:
+            self.cache.popitem(last=False)
+        return html
+
+    def shutdown(self):
+        if self.executor is not None:
+            self.executor.shutdown(wait=False, cancel_futures=True)
+            self.executor = None
+
+    def stats(self) -> dict:
+        return {
+            "pool": self.pool,
+            "cached": len(self.cache),
+            "hits": self.hits,
+            "misses": self.misses,
+            "offloaded": self.offloaded,
+            "render_ms": round(self.render_ms, 2),
+        }
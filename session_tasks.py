@@ -0,0 +1,182 @@
+"""
+Per-session query tasks and process-wide admission control.
+
+Each WebSocket session hands its queries to a SessionTasks runner, which
+executes them one at a time from a small bounded queue while the socket
+keeps reading, so a client can cancel the running query (or a queued one)
+and a disconnect cancels its work immediately. The AdmissionController caps
+how many agent runs execute at once across the whole process; runs beyond
+the cap wait in FIFO order and are told their position as it changes.
+"""
+
+import asyncio
+import itertools
+from collections import deque
+from contextlib import asynccontextmanager
+
+
+class AdmissionRejected(Exception):
+    """The admission queue is full"""
+
+
+class _Waiter:
+    __slots__ = ("granted", "moved")
+
+    def __init__(self):
+        self.granted = False
+        self.moved = asyncio.Event()
+
+
+class AdmissionController:
+    """Caps concurrent agent runs process-wide, admitting waiters first come, first served"""
+
+    def __init__(self, max_concurrent: int = 8, max_queued: int = 50):
+        self.max_concurrent = max_concurrent
+        self.max_queued = max_queued
+        self.active = 0
+        self.waiters = deque()
+        self.admitted = 0
+        self.rejected = 0
+
+    def _dispatch(self):
+        while self.waiters and self.active < self.max_concurrent:
+            waiter = self.waiters.popleft()
+            waiter.granted = True
+            self.active += 1
+            waiter.moved.set()
+        # Everyone still queued has moved up
+        for waiter in self.waiters:
+            waiter.moved.set()
+
+    async def acquire(self, on_position=None):
+        """Wait for a run slot; on_position(position) is awaited whenever the queue position changes"""
+        if self.active < self.max_concurrent and not self.waiters:
+            self.active += 1
+            self.admitted += 1
+            return
+        if len(self.waiters) >= self.max_queued:
+            self.rejected += 1
+            raise AdmissionRejected(f"{len(self.waiters)} runs already waiting")
+
+        waiter = _Waiter()
+        self.waiters.append(waiter)
+        last_position = None
+        try:
+            while True:
+                waiter.moved.clear()
+                if waiter.granted:
+                    break
+                position = self.waiters.index(waiter) + 1
+                if on_position is not None and position != last_position:
+                    last_position = position
+                    await on_position(position)
+                if not waiter.granted and not waiter.moved.is_set():
+                    await waiter.moved.wait()
+        except BaseException:
+            # Cancelled while queued (or while being told the position)
+            if waiter.granted:
+                self.release()
+            else:
+                self.waiters.remove(waiter)
+                self._dispatch()
+            raise
+        self.admitted += 1
+
+    def release(self):
+        self.active -= 1
+        self._dispatch()
+
+    @asynccontextmanager
+    async def slot(self, on_position=None):
+        await self.acquire(on_position)
+        try:
+            yield
+        finally:
+            self.release()
+
+    def stats(self) -> dict:
+        return {
+            "active": self.active,
+            "queued": len(self.waiters),
+            "max_concurrent": self.max_concurrent,
+            "max_queued": self.max_queued,
+            "admitted": self.admitted,
+            "rejected": self.rejected,
+        }
+
+
+class SessionTasks:
+    """Runs one session's queries sequentially from a bounded queue, with cancellation"""
+
+    def __init__(self, run, on_cancelled=None, max_pending: int = 3):
+        self.run = run                    # async run(query_id, query_text)
+        self.on_cancelled = on_cancelled  # async on_cancelled(query_id, query_text)
+        self.max_pending = max_pending
+        self.pending = deque()            # (query_id, query_text) not yet started
+        self.wakeup = asyncio.Event()
+        self.current = None               # (query_id, query_text, task) while running
+        self.ids = itertools.count(1)
+        self.worker = asyncio.create_task(self._work())
+
+    def submit(self, query_text: str, query_id=None):
+        """Queue a query; returns its id, or None if the session already has too much queued"""
+        if len(self.pending) >= self.max_pending:
+            return None
+        query_id = query_id if query_id is not None else next(self.ids)
+        self.pending.append((query_id, query_text))
+        self.wakeup.set()
+        return query_id
+
+    def cancel(self, query_id=None) -> list:
+        """Cancel one query by id, or the running query and everything queued; returns cancelled ids"""
+        cancelled = []
+        for item in list(self.pending):
+            if query_id is None or item[0] == query_id:
+                # Never started, so it is reported right away
+                self.pending.remove(item)
+                self._notify(*item)
+                cancelled.append(item[0])
+        if self.current is not None and (query_id is None or self.current[0] == query_id):
+            # The worker reports it once the task has actually stopped
+            self.current[2].cancel()
+            cancelled.append(self.current[0])
+        return cancelled
+
+    def _notify(self, query_id, query_text):
+        if self.on_cancelled is not None:
+            asyncio.create_task(self.on_cancelled(query_id, query_text))
+
+    async def _work(self):
+        while True:
+            while not self.pending:
+                self.wakeup.clear()
+                await self.wakeup.wait()
+            query_id, query_text = self.pending.popleft()
+            task = asyncio.create_task(self.run(query_id, query_text))
+            self.current = (query_id, query_text, task)
+            try:
+                # wait() does not propagate the task's cancellation into this worker
+                await asyncio.wait({task})
+            finally:
+                self.current = None
+            if task.cancelled():
+                self._notify(query_id, query_text)
+            elif task.exception() is not None:
+                print(f"[Session] Query {query_id} failed: {task.exception()!r}")
+
+    async def close(self):
+        """Cancel everything (e.g. on disconnect) and wait for the running query to stop"""
+        self.pending.clear()
+        self.on_cancelled = None
+        running = self.current[2] if self.current is not None else None
+        self.worker.cancel()
+        if running is not None:
+            running.cancel()
+            await asyncio.wait({running})
+        await asyncio.wait({self.worker})
+
+    def stats(self) -> dict:
+        return {
+            "running": self.current[0] if self.current is not None else None,
+            "pending": [item[0] for item in self.pending],
+        }
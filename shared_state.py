@@ -0,0 +1,229 @@
+"""
+State shared between uvicorn worker processes on one box.
+
+Stores expose a small Redis-like surface (get/set with expiry) plus an atomic
+multi-bucket token-bucket operation used for rate limiting. InProcessStore is
+the single-worker stand-in; SQLiteStore keeps the same data in a local SQLite
+file so every worker sees the same counters and cached tool results.
+"""
+
+import asyncio
+import json
+import os
+import random
+import sqlite3
+import threading
+import time
+from typing import Any
+
+from rate_limiter import BaseRateLimiter
+
+# Buckets untouched this long have long since refilled to capacity, so their rows can go
+BUCKET_IDLE_SECONDS = 3600
+
+
+class InProcessStore:
+    """Dictionary-backed store for a single worker process"""
+
+    shared = False
+
+    def __init__(self):
+        self.values = {}   # key -> (expires_at or None, value)
+        self.buckets = {}  # name -> (tokens, updated)
+        self.lock = threading.Lock()
+
+    def get(self, key: str) -> Any:
+        with self.lock:
+            entry = self.values.get(key)
+            if entry is None:
+                return None
+            expires_at, value = entry
+            if expires_at is not None and expires_at <= time.time():
+                del self.values[key]
+                return None
+            return value
+
+    def set(self, key: str, value: Any, ex: float = None):
+        with self.lock:
+            self.values[key] = (time.time() + ex if ex else None, value)
+            if len(self.values) > 10000:
+                now = time.time()
+                self.values = {k: v for k, v in self.values.items() if v[0] is None or v[0] > now}
+
+    def consume(self, buckets: list[tuple[str, float, float, float, float]]) -> float:
+        """Atomically refill each (name, capacity, refill_per_second, required, amount) bucket.
+
+        If every bucket holds at least `required` tokens, subtract `amount` from
+        each and return 0. Otherwise change nothing and return the seconds until
+        all of them would be satisfied.
+        """
+        with self.lock:
+            now = time.time()
+            levels = {}
+            for name, capacity, rate, _, _ in buckets:
+                tokens, updated = self.buckets.get(name, (capacity, now))
+                levels[name] = min(capacity, tokens + (now - updated) * rate)
+            wait = bucket_wait(buckets, levels)
+            if wait == 0:
+                for name, _, _, _, amount in buckets:
+                    levels[name] -= amount
+            for name in levels:
+                self.buckets[name] = (levels[name], now)
+            if len(self.buckets) > 10000:
+                self.buckets = {k: v for k, v in self.buckets.items() if v[1] > now - BUCKET_IDLE_SECONDS}
+            return wait
+
+
+class SQLiteStore:
+    """Store backed by a SQLite file shared by all workers on the machine"""
+
+    shared = True
+
+    def __init__(self, path: str):
+        self.path = path
+        self.local = threading.local()
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        conn = self._conn()
+        conn.execute("CREATE TABLE IF NOT EXISTS kv (key TEXT PRIMARY KEY, value TEXT, expires_at REAL)")
+        conn.execute("CREATE TABLE IF NOT EXISTS buckets (name TEXT PRIMARY KEY, tokens REAL, updated REAL)")
+
+    def _conn(self) -> sqlite3.Connection:
+        # One connection per thread; autocommit mode so transactions are explicit
+        conn = getattr(self.local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=5.0, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            self.local.conn = conn
+        return conn
+
+    def get(self, key: str) -> Any:
+        row = self._conn().execute(
+            "SELECT value FROM kv WHERE key = ? AND (expires_at IS NULL OR expires_at > ?)",
+            (key, time.time())
+        ).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def set(self, key: str, value: Any, ex: float = None):
+        conn = self._conn()
+        conn.execute(
+            "INSERT OR REPLACE INTO kv VALUES (?, ?, ?)",
+            (key, json.dumps(value), time.time() + ex if ex else None)
+        )
+        if random.random() < 0.01:
+            conn.execute("DELETE FROM kv WHERE expires_at IS NOT NULL AND expires_at <= ?", (time.time(),))
+
+    def consume(self, buckets: list[tuple[str, float, float, float, float]]) -> float:
+        """Same contract as InProcessStore.consume, atomic across processes"""
+        conn = self._conn()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            now = time.time()
+            levels = {}
+            for name, capacity, rate, _, _ in buckets:
+                row = conn.execute("SELECT tokens, updated FROM buckets WHERE name = ?", (name,)).fetchone()
+                tokens, updated = row if row else (capacity, now)
+                levels[name] = min(capacity, tokens + (now - updated) * rate)
+            wait = bucket_wait(buckets, levels)
+            if wait == 0:
+                for name, _, _, _, amount in buckets:
+                    levels[name] -= amount
+            conn.executemany(
+                "INSERT OR REPLACE INTO buckets VALUES (?, ?, ?)",
+                [(name, tokens, now) for name, tokens in levels.items()]
+            )
+            if random.random() < 0.01:
+                # Per-client buckets of clients that went away
+                conn.execute("DELETE FROM buckets WHERE updated < ?", (now - BUCKET_IDLE_SECONDS,))
+            conn.execute("COMMIT")
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+        return wait
+
+
+def bucket_wait(buckets: list[tuple[str, float, float, float, float]], levels: dict) -> float:
+    """Seconds until every bucket holds its required tokens"""
+    wait = 0.0
+    for name, _, rate, required, _ in buckets:
+        deficit = required - levels[name]
+        if deficit > 0:
+            wait = max(wait, deficit / rate if rate > 0 else float("inf"))
+    return wait
+
+
+def create_store(url: str):
+    """Store for a SHARED_STATE_URL: empty for in-process, sqlite:///path for a shared file"""
+    if not url:
+        return InProcessStore()
+    if url.startswith("sqlite:///"):
+        return SQLiteStore(url[len("sqlite:///"):])
+    raise ValueError(f"Unsupported SHARED_STATE_URL: {url}")
+
+
+class SharedRateLimiter(BaseRateLimiter):
+    """Rate limiter whose buckets live in a shared store, so all workers enforce one budget.
+
+    Uses the same per-client and global buckets as RateLimiter. Waiting
+    requests poll the store instead of sitting in an in-process queue; the
+    per-client buckets still stop one heavy client from starving others.
+    Store operations (which may wait on SQLite's lock) run in a thread.
+    """
+
+    POLL_INTERVAL = 0.5
+
+    def __init__(self, store, requests_per_minute=3, burst=3, tokens_per_minute=30000,
+                 global_tokens_per_minute=30000, polygon_calls_per_minute=0, max_wait=30):
+        self.store = store
+        self.requests_per_minute = requests_per_minute
+        self.burst = burst
+        self.tokens_per_minute = tokens_per_minute
+        self.global_tokens_per_minute = global_tokens_per_minute
+        self.polygon_calls_per_minute = polygon_calls_per_minute
+        self.max_wait = max_wait
+
+    def _buckets(self, key: str, take_request: bool) -> list[tuple]:
+        buckets = [
+            (f"requests:{key}", self.burst, self.requests_per_minute / 60, 1, 1 if take_request else 0),
+            (f"tokens:{key}", self.tokens_per_minute, self.tokens_per_minute / 60, 0, 0),
+            ("tokens:*", self.global_tokens_per_minute, self.global_tokens_per_minute / 60, 0, 0),
+        ]
+        if self.polygon_calls_per_minute:
+            buckets.append(("polygon:*", self.polygon_calls_per_minute, self.polygon_calls_per_minute / 60, 0, 0))
+        return buckets
+
+    async def estimate_wait(self, key: str) -> float:
+        return await asyncio.to_thread(self.store.consume, self._buckets(key, take_request=False))
+
+    async def acquire(self, key: str) -> tuple[bool, float]:
+        started = time.monotonic()
+        while True:
+            wait = await asyncio.to_thread(self.store.consume, self._buckets(key, take_request=True))
+            waited = time.monotonic() - started
+            if wait == 0:
+                return True, waited
+            if waited + wait > self.max_wait:
+                return False, wait
+            await asyncio.sleep(min(wait, self.POLL_INTERVAL))
+
+    def record_usage(self, key: str, input_tokens: int = 0, output_tokens: int = 0, polygon_calls: int = 0):
+        total = input_tokens + output_tokens
+        debits = [
+            (f"tokens:{key}", self.tokens_per_minute, self.tokens_per_minute / 60, float("-inf"), total),
+            ("tokens:*", self.global_tokens_per_minute, self.global_tokens_per_minute / 60, float("-inf"), total),
+        ]
+        if self.polygon_calls_per_minute:
+            debits.append(
+                ("polygon:*", self.polygon_calls_per_minute, self.polygon_calls_per_minute / 60, float("-inf"), polygon_calls)
+            )
+        try:
+            loop = asyncio.get_running_loop()
+        except RuntimeError:
+            self.store.consume(debits)
+            return
+        # Called from sync callbacks and cancellation handlers, so debit in the background
+        loop.run_in_executor(None, self.store.consume, debits).add_done_callback(_log_debit_failure)
+
+
+def _log_debit_failure(future):
+    if not future.cancelled() and future.exception() is not None:
+        print(f"[RateLimit] Failed to record usage: {future.exception()!r}")
@@ -0,0 +1,118 @@
+"""
+Background startup pipeline.
+
+The app starts serving as soon as its (lightweight) module is imported; the
+slow parts of startup (importing pydantic_ai and the MCP client, spawning
+MCP servers, building the agents) run afterwards as named steps. A step
+starts as soon as the steps it depends on have finished, so independent
+ones (e.g. MCP subprocesses booting while the agent stack is imported)
+overlap. /healthz reports the process as alive while this runs; /readyz
+only once every step has finished.
+"""
+
+import asyncio
+import time
+
+
+class StartupFailed(Exception):
+    """A startup step raised"""
+
+
+class _Step:
+    __slots__ = ("name", "run", "after", "task", "started", "finished", "error")
+
+    def __init__(self, name: str, run, after: tuple):
+        self.name = name
+        self.run = run      # async run()
+        self.after = after  # names of steps that must finish first
+        self.task = None
+        self.started = None
+        self.finished = None
+        self.error = None
+
+
+class StartupPipeline:
+    """Named async steps with dependencies, run in the background with per-step timings"""
+
+    def __init__(self):
+        self.steps = {}
+        self.created = time.monotonic()
+        self.launched = None
+
+    def add(self, name: str, run, after=()):
+        self.steps[name] = _Step(name, run, tuple(after))
+
+    def start(self):
+        """Launch every step; returns immediately"""
+        self.launched = time.monotonic()
+        for step in self.steps.values():
+            step.task = asyncio.create_task(self._run(step))
+
+    async def _run(self, step: _Step):
+        try:
+            for name in step.after:
+                dependency = self.steps[name]
+                await asyncio.wait({dependency.task})
+                if dependency.error is not None:
+                    raise StartupFailed(f"{name} failed")
+            step.started = time.monotonic()
+            await step.run()
+        except asyncio.CancelledError:
+            step.error = "cancelled"
+            raise
+        except Exception as e:
+            step.error = f"{type(e).__name__}: {e}"
+            print(f"[Startup] {step.name} failed: {step.error}")
+        finally:
+            step.finished = time.monotonic()
+
+    @property
+    def ready(self) -> bool:
+        return bool(self.steps) and all(s.finished is not None and s.error is None for s in self.steps.values())
+
+    @property
+    def failed(self) -> bool:
+        return any(s.error is not None for s in self.steps.values())
+
+    async def wait(self, timeout: float | None = None):
+        """Wait for every step; raises StartupFailed if one failed"""
+        tasks = {step.task for step in self.steps.values() if step.task is not None}
+        if tasks:
+            await asyncio.wait(tasks, timeout=timeout)
+        if self.failed:
+            errors = {s.name: s.error for s in self.steps.values() if s.error is not None}
+            raise StartupFailed(", ".join(f"{name}: {error}" for name, error in errors.items()))
+        if not self.ready:
+            raise StartupFailed("still starting")
+
+    async def stop(self):
+        for step in self.steps.values():
+            if step.task is not None and not step.task.done():
+                step.task.cancel()
+        await asyncio.gather(*(s.task for s in self.steps.values() if s.task is not None), return_exceptions=True)
+
+    def stats(self) -> dict:
+        """Status and timings (ms since the pipeline was launched) per step"""
+        def ms(value):
+            return round((value - self.launched) * 1000, 1) if value is not None and self.launched else None
+
+        steps = {}
+        for step in self.steps.values():
+            if step.error is not None:
+                status = "failed"
+            elif step.finished is not None:
+                status = "done"
+            elif step.started is not None:
+                status = "running"
+            else:
+                status = "waiting"
+            steps[step.name] = {
+                "status": status,
+                "after": list(step.after),
+                "started_ms": ms(step.started),
+                "finished_ms": ms(step.finished),
+                "duration_ms": round((step.finished - step.started) * 1000, 1)
+                if step.started is not None and step.finished is not None else None,
+                "error": step.error,
+            }
+        return {"ready": self.ready, "failed": self.failed, "steps": steps}
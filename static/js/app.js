@@ -2,14 +2,31 @@
 let ws = null;
 let isConnected = false;
 
+// Render markdown here when marked is available, so the server only sends markdown
+const clientRender = typeof window.marked !== 'undefined';
+
+// Streaming state for the response currently being generated
+let streamedHtml = '';
+let streamedPending = '';
+let streamedMarkdown = '';
+let renderScheduled = false;
+let liveTools = [];
+
+// Watchlist tickers (kept across reloads) and the latest pushed quote per ticker
+let watchlistTickers = JSON.parse(localStorage.getItem('watchlist') || '[]');
+let watchlistQuotes = {};
+let watchlistErrors = {};
+
 // DOM Elements
 const queryInput = document.getElementById('queryInput');
 const submitBtn = document.getElementById('submitBtn');
 const clearBtn = document.getElementById('clearBtn');
 const retryBtn = document.getElementById('retryBtn');
+const cancelBtn = document.getElementById('cancelBtn');
 const responseSection = document.getElementById('responseSection');
 const responseContent = document.getElementById('responseContent');
 const loadingState = document.getElementById('loadingState');
+const loadingText = document.getElementById('loadingText');
 const errorState = document.getElementById('errorState');
 const errorMessage = document.getElementById('errorMessage');
 const toolsUsed = document.getElementById('toolsUsed');
@@ -17,11 +34,15 @@ const toolsList = document.getElementById('toolsList');
 const statusDot = document.querySelector('.status-dot');
 const statusText = document.querySelector('.status-text');
 const exampleBtns = document.querySelectorAll('.example-btn');
+const watchlistInput = document.getElementById('watchlistInput');
+const watchlistAddBtn = document.getElementById('watchlistAddBtn');
+const watchlistQuotesEl = document.getElementById('watchlistQuotes');
 
 // Initialize WebSocket connection
 function connectWebSocket() {
     const protocol = window.location.protocol === 'https:' ? 'wss:' : 'ws:';
-    const wsUrl = `${protocol}//${window.location.host}/ws`;
+    const format = clientRender ? 'markdown' : 'html';
+    const wsUrl = `${protocol}//${window.location.host}/ws?format=${format}`;
     
     ws = new WebSocket(wsUrl);
     
@@ -60,12 +81,59 @@ function handleWebSocketMessage(data) {
     switch (data.type) {
         case 'connected':
             console.log('Server:', data.message);
+            // A new connection starts with an empty watchlist on the server
+            if (watchlistTickers.length > 0) {
+                ws.send(JSON.stringify({ type: 'subscribe', tickers: watchlistTickers }));
+            }
+            break;
+            
+        case 'watchlist':
+            // The server's view of this connection's watchlist, with the quotes it already has
+            watchlistTickers = data.tickers;
+            localStorage.setItem('watchlist', JSON.stringify(watchlistTickers));
+            watchlistQuotes = data.quotes || {};
+            watchlistErrors = data.errors || {};
+            renderWatchlist([]);
+            break;
+            
+        case 'quotes':
+            // Only the quotes that changed since the last poll
+            Object.assign(watchlistQuotes, data.quotes);
+            Object.assign(watchlistErrors, data.errors || {});
+            Object.keys(data.quotes).forEach(ticker => delete watchlistErrors[ticker]);
+            renderWatchlist(Object.keys(data.quotes));
             break;
             
         case 'processing':
             showLoading();
             break;
             
+        case 'queued':
+            // Waiting for a free slot on a busy server
+            showLoading(data.message);
+            break;
+            
+        case 'cancelled':
+            showCancelled();
+            break;
+            
+        case 'text_delta':
+            showStreamingText(data.data);
+            break;
+            
+        case 'stream_reset':
+            // The server is re-running the query; drop what was streamed so far
+            showLoading();
+            break;
+            
+        case 'tool_call_start':
+            updateLiveTool(data.data.tool_call_id, data.data.tool_name, true);
+            break;
+            
+        case 'tool_call_end':
+            updateLiveTool(data.data.tool_call_id, data.data.tool_name, false);
+            break;
+            
         case 'response':
             showResponse(data.data);
             break;
@@ -94,11 +162,82 @@ function updateStatus(status, text) {
 }
 
 // Show loading state
-function showLoading() {
+function showLoading(message = 'Analyzing market data...') {
     responseSection.style.display = 'none';
     errorState.style.display = 'none';
     loadingState.style.display = 'flex';
+    loadingText.textContent = message;
     submitBtn.disabled = true;
+    streamedHtml = '';
+    streamedPending = '';
+    streamedMarkdown = '';
+    liveTools = [];
+}
+
+// Markdown to HTML in the browser (format=markdown)
+function renderMarkdown(text) {
+    return window.marked.parse(text || '');
+}
+
+// Escape raw text before inserting it as HTML
+function escapeHtml(text) {
+    const div = document.createElement('div');
+    div.textContent = text;
+    return div.innerHTML;
+}
+
+// Show the response section while a response is still streaming in
+function showStreamingSection() {
+    if (responseSection.style.display !== 'block') {
+        loadingState.style.display = 'none';
+        errorState.style.display = 'none';
+        responseSection.style.display = 'block';
+    }
+}
+
+// Append rendered blocks and show the unfinished block as plain text
+function showStreamingText(delta) {
+    showStreamingSection();
+    if (delta.text !== undefined) {
+        // Raw markdown: re-render at most once per frame
+        streamedMarkdown += delta.text;
+        if (!renderScheduled) {
+            renderScheduled = true;
+            requestAnimationFrame(() => {
+                renderScheduled = false;
+                // Skip if the final response (or a reset) arrived in the meantime
+                if (streamedMarkdown) {
+                    responseContent.innerHTML = renderMarkdown(streamedMarkdown);
+                }
+            });
+        }
+        return;
+    }
+    streamedHtml += delta.html_append || '';
+    // format=html sends only what the unfinished block gained since the last delta
+    if (delta.pending_append !== undefined) {
+        streamedPending += delta.pending_append;
+    } else {
+        streamedPending = delta.pending || '';
+    }
+    const pending = streamedPending ? `<p class="streaming-pending">${escapeHtml(streamedPending)}</p>` : '';
+    responseContent.innerHTML = streamedHtml + pending;
+}
+
+// Show tools as they start and finish
+function updateLiveTool(toolCallId, toolName, running) {
+    showStreamingSection();
+    let tool = liveTools.find(t => t.id === toolCallId);
+    if (!tool) {
+        tool = { id: toolCallId, name: toolName };
+        liveTools.push(tool);
+    }
+    tool.running = running;
+    
+    toolsUsed.style.display = 'block';
+    toolsList.innerHTML = liveTools
+        .map(t => `<span class="tool-tag${t.running ? ' running' : ''}">${t.name}</span>`)
+        .join('');
 }
 
 // Show response
@@ -109,7 +248,17 @@ function showResponse(data) {
     submitBtn.disabled = false;
     
     // Display response content
-    responseContent.innerHTML = data.output;
+    streamedMarkdown = '';
+    responseContent.innerHTML = data.output !== undefined ? data.output : renderMarkdown(data.raw_output);
+    
+    // Note when the answer came from the server's answer cache
+    if (data.cache && data.cache.hit) {
+        const freshUntil = new Date(data.cache.fresh_until).toLocaleTimeString();
+        const note = document.createElement('p');
+        note.className = 'cache-note';
+        note.textContent = `Cached answer from ${Math.round(data.cache.age_seconds)}s ago (market ${data.cache.market_phase}, fresh until ${freshUntil})`;
+        responseContent.appendChild(note);
+    }
     
     // Display tools used
     if (data.tools_used && data.tools_used.length > 0) {
@@ -135,6 +284,61 @@ function showError(message) {
     errorMessage.textContent = message;
 }
 
+// Stop waiting after a cancel; keep whatever was already streamed
+function showCancelled() {
+    loadingState.style.display = 'none';
+    submitBtn.disabled = false;
+    queryInput.focus();
+}
+
+// Ask the server to stop the running query
+function cancelQuery() {
+    if (ws && ws.readyState === WebSocket.OPEN) {
+        ws.send(JSON.stringify({ type: 'cancel' }));
+    }
+}
+
+// Watchlist tags: price and daily change per ticker, briefly highlighted when updated
+function renderWatchlist(updated) {
+    watchlistQuotesEl.innerHTML = watchlistTickers.map(ticker => {
+        const quote = watchlistQuotes[ticker];
+        let body = '<span class="muted">…</span>';
+        if (watchlistErrors[ticker]) {
+            body = `<span class="muted">${escapeHtml(watchlistErrors[ticker])}</span>`;
+        } else if (quote && quote.price != null) {
+            body = `<span>${quote.price.toFixed(2)}</span>`;
+            if (quote.change_pct != null) {
+                const pct = quote.change_pct;
+                const sign = pct > 0 ? '+' : '';
+                body += `<span class="${pct >= 0 ? 'up' : 'down'}">${sign}${pct.toFixed(2)}%</span>`;
+            } else {
+                // Previous close (no snapshot access on this Polygon plan)
+                body += '<span class="muted">close</span>';
+            }
+        }
+        const cls = updated.includes(ticker) ? 'quote-tag updated' : 'quote-tag';
+        return `<span class="${cls}"><strong>${ticker}</strong>${body}` +
+            `<button class="quote-remove" data-ticker="${ticker}" title="Stop watching">×</button></span>`;
+    }).join('');
+    if (updated.length > 0) {
+        // Let the highlight fade out once it has been painted
+        requestAnimationFrame(() => requestAnimationFrame(() => {
+            watchlistQuotesEl.querySelectorAll('.quote-tag.updated')
+                .forEach(tag => tag.classList.remove('updated'));
+        }));
+    }
+}
+
+// Add the tickers typed into the watchlist input
+function addToWatchlist() {
+    const tickers = watchlistInput.value.split(/[\s,]+/).filter(Boolean);
+    if (tickers.length === 0 || !isConnected) {
+        return;
+    }
+    ws.send(JSON.stringify({ type: 'subscribe', tickers }));
+    watchlistInput.value = '';
+}
+
 // Submit query
 function submitQuery() {
     const query = queryInput.value.trim();
@@ -185,6 +389,30 @@ queryInput.addEventListener('keydown', (e) => {
 
 clearBtn.addEventListener('click', clearResponse);
 
+cancelBtn.addEventListener('click', cancelQuery);
+
+watchlistAddBtn.addEventListener('click', addToWatchlist);
+
+watchlistInput.addEventListener('keydown', (e) => {
+    if (e.key === 'Enter') {
+        addToWatchlist();
+    }
+});
+
+watchlistQuotesEl.addEventListener('click', (e) => {
+    const ticker = e.target.getAttribute('data-ticker');
+    if (ticker && isConnected) {
+        ws.send(JSON.stringify({ type: 'unsubscribe', tickers: [ticker] }));
+    }
+});
+
+document.addEventListener('keydown', (e) => {
+    // Escape cancels a running query
+    if (e.key === 'Escape' && submitBtn.disabled) {
+        cancelQuery();
+    }
+});
+
 retryBtn.addEventListener('click', () => {
     errorState.style.display = 'none';
     submitQuery();
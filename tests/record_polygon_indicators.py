@@ -0,0 +1,56 @@
+"""
+Record Polygon /v1/indicators responses (and the daily bars they are computed
+from) as fixtures for tests/test_indicators.py.
+
+Usage (needs a real key; writes tests/fixtures/polygon_indicators_<TICKER>.json):
+    POLYGON_API_KEY=... python tests/record_polygon_indicators.py AAPL SPY --end 2025-06-30
+"""
+
+import argparse
+import json
+import os
+from datetime import date, timedelta
+
+import httpx
+
+BASE_URL = os.getenv("POLYGON_BASE_URL", "https://api.polygon.io").rstrip("/")
+FIXTURES_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "fixtures")
+# (kind, window) pairs recorded per ticker; MACD uses Polygon's defaults (12, 26, 9)
+INDICATORS = [("sma", 20), ("sma", 50), ("ema", 12), ("ema", 50), ("rsi", 14), ("macd", None)]
+
+
+def record(client: httpx.Client, ticker: str, end: date, years: int) -> dict:
+    start = end - timedelta(days=365 * years)
+    bars = client.get(
+        f"{BASE_URL}/v2/aggs/ticker/{ticker}/range/1/day/{start}/{end}",
+        params={"adjusted": "true", "sort": "asc", "limit": 50000},
+    ).raise_for_status().json().get("results") or []
+    indicators = {}
+    for kind, window in INDICATORS:
+        params = {"timespan": "day", "adjusted": "true", "series_type": "close", "order": "desc",
+                  "limit": 50, "timestamp.lte": str(end)}
+        if window:
+            params["window"] = window
+        response = client.get(f"{BASE_URL}/v1/indicators/{kind}/{ticker}", params=params).raise_for_status()
+        indicators[f"{kind}_{window}" if window else kind] = response.json().get("results", {}).get("values", [])
+    return {"ticker": ticker, "end": str(end), "bars": bars, "indicators": indicators}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Record Polygon indicator fixtures")
+    parser.add_argument("tickers", nargs="+")
+    parser.add_argument("--end", default=str(date.today() - timedelta(days=1)), help="Last date (YYYY-MM-DD)")
+    parser.add_argument("--years", type=int, default=3, help="Years of daily bars to record")
+    args = parser.parse_args()
+
+    with httpx.Client(params={"apiKey": os.environ["POLYGON_API_KEY"]}, timeout=30) as client:
+        for ticker in args.tickers:
+            fixture = record(client, ticker.upper(), date.fromisoformat(args.end), args.years)
+            path = os.path.join(FIXTURES_DIR, f"polygon_indicators_{ticker.upper()}.json")
+            with open(path, "w") as f:
+                json.dump(fixture, f)
+            print(f"{path}: {len(fixture['bars'])} bars, {len(fixture['indicators'])} indicators")
+
+
+if __name__ == "__main__":
+    main()
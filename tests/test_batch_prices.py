@@ -0,0 +1,44 @@
+"""batch_stock_prices falls back to previous closes only when snapshots are not in the plan"""
+
+import asyncio
+
+import httpx
+import pytest
+
+import custom_mcp_server as server
+
+
+def status_error(status: int) -> httpx.HTTPStatusError:
+    request = httpx.Request("GET", "https://api.polygon.io/v2/snapshot/locale/us/markets/stocks/tickers")
+    return httpx.HTTPStatusError(f"HTTP {status}", request=request, response=httpx.Response(status, request=request))
+
+
+def fake_polygon(monkeypatch, snapshot_error: Exception):
+    calls = []
+
+    async def call_polygon_api(endpoint, params=None):
+        calls.append(endpoint)
+        if "/snapshot/" in endpoint:
+            raise snapshot_error
+        return {"results": [{"o": 1.0, "h": 2.0, "l": 0.5, "c": 1.5, "v": 1000, "t": 1_700_000_000_000}]}
+
+    monkeypatch.setattr(server, "call_polygon_api", call_polygon_api)
+    return calls
+
+
+@pytest.mark.parametrize("status", [401, 403])
+def test_falls_back_to_prev_close_without_snapshot_access(monkeypatch, status):
+    calls = fake_polygon(monkeypatch, status_error(status))
+    data = asyncio.run(server.batch_stock_prices(["AAPL", "MSFT"]))
+    assert set(data["results"]) == {"AAPL", "MSFT"}
+    assert len(calls) == 3
+
+
+@pytest.mark.parametrize("error", [status_error(429), status_error(503), httpx.ConnectError("down")],
+                         ids=["429", "503", "transport"])
+def test_other_snapshot_failures_do_not_fan_out(monkeypatch, error):
+    calls = fake_polygon(monkeypatch, error)
+    data = asyncio.run(server.batch_stock_prices(["AAPL", "MSFT"]))
+    assert data["results"] == {}
+    assert set(data["errors"]) == {"AAPL", "MSFT"}
+    assert len(calls) == 1
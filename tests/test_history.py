@@ -0,0 +1,122 @@
+"""History compaction keeps every tool call paired with its result"""
+
+import asyncio
+import json
+
+import pytest
+from pydantic_ai import Agent
+from pydantic_ai.messages import (
+    ModelRequest, ModelResponse, SystemPromptPart, TextPart, ToolCallPart, ToolReturnPart, UserPromptPart,
+)
+from pydantic_ai.models.function import AgentInfo, FunctionModel
+
+import history
+from history import HistoryManager, estimate_tokens, split_turns, validate_tool_pairs
+
+TICKERS = ["AAPL", "MSFT", "NVDA", "TSLA", "AMZN", "META", "GOOGL", "SPY"]
+
+
+def scripted_model(parallel: bool) -> FunctionModel:
+    """Calls tools for the tickers in the prompt (in parallel or one per round), then answers"""
+    def respond(messages, info: AgentInfo) -> ModelResponse:
+        prompt = next(p.content for m in reversed(messages) if isinstance(m, ModelRequest)
+                      for p in m.parts if isinstance(p, UserPromptPart))
+        tickers = [t for t in TICKERS if t in prompt]
+        turn_start = max(i for i, m in enumerate(messages) if isinstance(m, ModelRequest)
+                         and any(isinstance(p, UserPromptPart) for p in m.parts))
+        called = sum(isinstance(p, ToolCallPart) for m in messages[turn_start:] for p in m.parts)
+        if parallel and not called:
+            return ModelResponse(parts=[
+                ToolCallPart("get_aggregates", {"ticker": t}, tool_call_id=f"{t}-{len(messages)}-{i}")
+                for i, t in enumerate(tickers)
+            ] + [ToolCallPart("get_market_status", {}, tool_call_id=f"status-{len(messages)}")])
+        if not parallel and called < len(tickers):
+            t = tickers[called]
+            return ModelResponse(parts=[ToolCallPart("get_aggregates", {"ticker": t},
+                                                     tool_call_id=f"{t}-{len(messages)}")])
+        return ModelResponse(parts=[TextPart(f"Summary for {', '.join(tickers)}: " + "trend up. " * 40)])
+    return FunctionModel(respond)
+
+
+def build_agent(parallel: bool) -> Agent:
+    agent = Agent(scripted_model(parallel), system_prompt="You are a market analyst.")
+
+    @agent.tool_plain
+    def get_aggregates(ticker: str) -> str:
+        return json.dumps([{"t": i, "o": 1.0, "h": 2.0, "l": 0.5, "c": 1.5, "v": 1000} for i in range(60)])
+
+    @agent.tool_plain
+    def get_market_status() -> str:
+        return "open"
+
+    return agent
+
+
+def run_session(agent: Agent, manager: HistoryManager, prompts: list[str]) -> list[list]:
+    """Run a multi-turn session, compacting after every turn; returns the history after each"""
+    async def run():
+        snapshots, history_ = [], []
+        for prompt in prompts:
+            result = await agent.run(prompt, message_history=history_)
+            history_ = manager.compact(result.all_messages())
+            snapshots.append(history_)
+        return snapshots
+    return asyncio.run(run())
+
+
+PROMPTS = [
+    "How did AAPL and MSFT do?",
+    "Compare NVDA, TSLA and AMZN",
+    "What about META?",
+    "Show GOOGL and SPY",
+    "AAPL, NVDA, SPY again",
+    "And TSLA?",
+]
+
+
+@pytest.mark.parametrize("parallel", [False, True], ids=["sequential", "parallel"])
+@pytest.mark.parametrize("max_tokens", [300, 800, 1500, 3000, 100000])
+def test_compacted_agent_histories_keep_tool_pairs(parallel, max_tokens):
+    manager = HistoryManager(max_tokens=max_tokens, keep_recent_turns=1, digest_chars=80)
+    snapshots = run_session(build_agent(parallel), manager, PROMPTS)
+    for snapshot in snapshots:
+        assert validate_tool_pairs(snapshot)
+        # The system prompt survives and comes first
+        assert isinstance(snapshot[0].parts[0], SystemPromptPart)
+        # The most recent turn is kept intact, with its tool calls
+        _, turns = split_turns(snapshot)
+        assert any(isinstance(p, ToolCallPart) for m in turns[-1] for p in m.parts)
+        # Over the ceiling only when the recent turn alone does not fit
+        assert estimate_tokens(snapshot) <= max_tokens or len(turns) == 1
+
+
+def test_compacted_history_is_accepted_by_the_agent():
+    agent = build_agent(parallel=True)
+    manager = HistoryManager(max_tokens=600, keep_recent_turns=1, digest_chars=50)
+    snapshots = run_session(agent, manager, PROMPTS)
+    result = asyncio.run(agent.run("One more: AAPL", message_history=snapshots[-1]))
+    assert validate_tool_pairs(result.all_messages())
+
+
+def test_validate_tool_pairs_detects_broken_histories():
+    call = ModelResponse(parts=[ToolCallPart("get_market_status", {}, tool_call_id="a")])
+    result = ModelRequest(parts=[ToolReturnPart("get_market_status", "open", tool_call_id="a")])
+    prompt = ModelRequest(parts=[UserPromptPart("status?")])
+    answer = ModelResponse(parts=[TextPart("open")])
+    assert validate_tool_pairs([prompt, call, result, answer])
+    assert not validate_tool_pairs([prompt, call, answer])          # call without result
+    assert not validate_tool_pairs([prompt, result, answer])        # result without call
+    assert not validate_tool_pairs([prompt, call])                  # dangling call at the end
+
+
+def test_compact_falls_back_when_a_stage_breaks_pairs(monkeypatch, capsys):
+    # Room for the recent turn plus collapsed old ones, so the broken stage's output would be used
+    manager = HistoryManager(max_tokens=1500, keep_recent_turns=1, digest_chars=80)
+    messages = run_session(build_agent(parallel=True), HistoryManager(max_tokens=10**6), PROMPTS[:3])[-1]
+    # A faulty stage that drops tool results but keeps the calls
+    monkeypatch.setattr(history, "collapse_turn", lambda turn: [m for m in turn if isinstance(m, ModelResponse)])
+    compacted = manager.compact(messages)
+    assert "broke tool call pairs" in capsys.readouterr().out
+    assert validate_tool_pairs(compacted)
+    _, turns = split_turns(compacted)
+    assert len(turns) == 1
@@ -0,0 +1,191 @@
+"""Local indicator kernels against published reference values, loop implementations and recorded Polygon output"""
+
+import asyncio
+import glob
+import json
+import os
+
+import numpy as np
+import pytest
+
+import custom_mcp_server as server
+
+FIXTURES_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "fixtures")
+
+with open(os.path.join(FIXTURES_DIR, "indicator_reference.json")) as f:
+    REFERENCE = json.load(f)
+
+
+# ------------- Reference implementations (plain loops) -------------
+def loop_sma(closes, window):
+    return [sum(closes[i - window + 1:i + 1]) / window if i >= window - 1 else None for i in range(len(closes))]
+
+
+def loop_ema(closes, window, seed=None):
+    alpha = 2.0 / (window + 1)
+    out, prev = [], closes[0] if seed is None else seed
+    for close in closes:
+        prev = alpha * close + (1 - alpha) * prev
+        out.append(prev)
+    return out
+
+
+def loop_rsi(closes, window):
+    out = [None] * len(closes)
+    if len(closes) <= window:
+        return out
+    changes = [b - a for a, b in zip(closes, closes[1:])]
+    avg_gain = sum(max(c, 0) for c in changes[:window]) / window
+    avg_loss = sum(max(-c, 0) for c in changes[:window]) / window
+    for i in range(window, len(closes)):
+        if i > window:
+            change = changes[i - 1]
+            avg_gain = (avg_gain * (window - 1) + max(change, 0)) / window
+            avg_loss = (avg_loss * (window - 1) + max(-change, 0)) / window
+        out[i] = 100.0 if avg_loss == 0 else 100.0 - 100.0 / (1 + avg_gain / avg_loss)
+    return out
+
+
+def random_walk(n, seed=7, start=100.0):
+    rng = np.random.default_rng(seed)
+    return start * np.exp(np.cumsum(rng.normal(0, 0.015, n)))
+
+
+def assert_matches(actual, expected, tol):
+    for i, (a, e) in enumerate(zip(actual, expected)):
+        if e is None:
+            assert np.isnan(a), f"index {i}: expected NaN during warm-up, got {a}"
+        else:
+            assert a == pytest.approx(e, abs=tol), f"index {i}"
+
+
+# ------------- Published worked examples -------------
+def test_rsi_matches_published_wilder_example():
+    ref = REFERENCE["rsi"]
+    rsi = server.rsi_kernel(np.array(ref["closes"]), ref["window"])
+    assert np.isnan(rsi[:ref["first_index"]]).all()
+    np.testing.assert_allclose(rsi[ref["first_index"]:], ref["expected"], atol=0.006)
+
+
+def test_sma_matches_published_example():
+    ref = REFERENCE["moving_averages"]
+    sma = server.sma_kernel(np.array(ref["closes"]), ref["window"])
+    assert np.isnan(sma[:ref["first_index"]]).all()
+    # The published closes are rounded to cents, the averages were computed from unrounded ones
+    np.testing.assert_allclose(sma[ref["first_index"]:], ref["sma"], atol=0.015)
+
+
+def test_ema_recursion_matches_published_example():
+    ref = REFERENCE["moving_averages"]
+    closes, window, first = np.array(ref["closes"]), ref["window"], ref["first_index"]
+    seed = closes[:window].mean()
+    ema = server.ewm_kernel(closes[first + 1:], 2.0 / (window + 1), seed)
+    np.testing.assert_allclose(np.insert(ema, 0, seed), ref["ema_seeded_with_sma"], atol=0.015)
+
+
+# ------------- Against loop implementations, including window edges -------------
+@pytest.mark.parametrize("window", [1, 2, 14, 50, 199, 200, 201])
+def test_sma_matches_loop(window):
+    closes = random_walk(200)
+    assert_matches(server.sma_kernel(closes, window), loop_sma(list(closes), window), 1e-9)
+
+
+@pytest.mark.parametrize("window", [1, 12, 26, 200])
+def test_ema_matches_loop(window):
+    closes = random_walk(3000)  # long enough to cross several vectorized blocks
+    np.testing.assert_allclose(server.ema_kernel(closes, window), loop_ema(list(closes), window), rtol=1e-9)
+
+
+@pytest.mark.parametrize("window", [2, 14, 30, 99, 100])
+def test_rsi_matches_loop(window):
+    closes = random_walk(100)
+    assert_matches(server.rsi_kernel(closes, window), loop_rsi(list(closes), window), 1e-9)
+
+
+def test_rsi_one_sided_series():
+    rising = np.arange(1.0, 40.0)
+    assert (server.rsi_kernel(rising, 14)[14:] == 100.0).all()
+    assert (server.rsi_kernel(rising[::-1], 14)[14:] == 0.0).all()
+    assert (server.rsi_kernel(np.full(40, 5.0), 14)[14:] == 100.0).all()
+
+
+def test_macd_matches_loop():
+    closes = random_walk(500)
+    line, signal, histogram = server.macd_kernel(closes)
+    expected_line = np.array(loop_ema(list(closes), 12)) - np.array(loop_ema(list(closes), 26))
+    np.testing.assert_allclose(line, expected_line, rtol=1e-9, atol=1e-12)
+    np.testing.assert_allclose(signal, loop_ema(list(expected_line), 9), rtol=1e-9, atol=1e-12)
+    np.testing.assert_allclose(histogram, line - signal)
+
+
+def test_empty_and_short_inputs():
+    assert len(server.ema_kernel(np.array([]), 12)) == 0
+    assert np.isnan(server.sma_kernel(np.array([1.0, 2.0]), 3)).all()
+    assert np.isnan(server.rsi_kernel(np.array([1.0, 2.0, 3.0]), 3)).all()
+
+
+@pytest.mark.parametrize("kind,window", [("ema", 12), ("ema", 50), ("rsi", 14), ("macd", 0)])
+def test_warmup_makes_seed_irrelevant(kind, window):
+    # Polygon's seeding is not documented; after warmup_bars the seed must no longer matter
+    closes = random_walk(warmup_bars := server.warmup_bars(kind, window))
+    shifted = closes.copy()
+    shifted[0] *= 1.5
+    if kind == "ema":
+        a, b = server.ema_kernel(closes, window), server.ema_kernel(shifted, window)
+    elif kind == "rsi":
+        a, b = server.rsi_kernel(closes, window), server.rsi_kernel(shifted, window)
+    else:
+        a, b = server.macd_kernel(closes)[1], server.macd_kernel(shifted)[1]
+    assert a[warmup_bars - 1] == pytest.approx(b[warmup_bars - 1], rel=1e-4, abs=1e-4)
+
+
+def test_local_indicator_response_shape(monkeypatch):
+    closes = random_walk(400)
+    timestamps = np.arange(len(closes), dtype=np.int64) * 86_400_000
+
+    async def fake_load_closes(ticker, timespan, end, bars_needed):
+        return timestamps[-bars_needed:], closes[-bars_needed:]
+
+    monkeypatch.setattr(server, "load_closes", fake_load_closes)
+    result = asyncio.run(server.local_indicator("sma", "AAPL", "day", 20))
+    values = result["results"]["values"]
+    assert len(values) == 10
+    assert [v["timestamp"] for v in values] == sorted((v["timestamp"] for v in values), reverse=True)
+    assert values[0]["value"] == pytest.approx(closes[-20:].mean())
+
+    macd = asyncio.run(server.local_indicator("macd", "AAPL", "day", None, timestamp="2025-01-01"))
+    assert len(macd["results"]["values"]) == 1
+    assert set(macd["results"]["values"][0]) == {"timestamp", "value", "signal", "histogram"}
+
+
+# ------------- Recorded Polygon /v1/indicators output -------------
+RECORDINGS = sorted(glob.glob(os.path.join(FIXTURES_DIR, "polygon_indicators_*.json")))
+
+
+@pytest.mark.skipif(not RECORDINGS, reason="no recordings; see tests/record_polygon_indicators.py")
+@pytest.mark.parametrize("path", RECORDINGS, ids=os.path.basename)
+def test_matches_recorded_polygon_indicators(path):
+    with open(path) as f:
+        recording = json.load(f)
+    timestamps = np.array([bar["t"] for bar in recording["bars"]], dtype=np.int64)
+    closes = np.array([bar["c"] for bar in recording["bars"]], dtype=np.float64)
+    index = {int(t): i for i, t in enumerate(timestamps)}
+    for name, values in recording["indicators"].items():
+        kind, _, window = name.partition("_")
+        window = int(window) if window else 0
+        if kind == "macd":
+            line, signal, histogram = server.macd_kernel(closes)
+            columns = {"value": line, "signal": signal, "histogram": histogram}
+        else:
+            kernel = {"sma": server.sma_kernel, "ema": server.ema_kernel, "rsi": server.rsi_kernel}[kind]
+            columns = {"value": kernel(closes, window)}
+        checked = 0
+        for value in values:
+            i = index.get(int(value["timestamp"]))
+            # Only compare where the local series has had its full warm-up
+            if i is None or i + 1 < server.warmup_bars(kind, window):
+                continue
+            for column, series in columns.items():
+                assert series[i] == pytest.approx(value[column], rel=1e-3, abs=1e-3), f"{name} {column} at {i}"
+            checked += 1
+        assert checked, f"{name}: no recorded values overlap the bars after warm-up"
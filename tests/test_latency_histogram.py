@@ -0,0 +1,35 @@
+"""Latency histograms stay JSON-serializable however slow the observations"""
+
+import json
+
+from tracing import LATENCY_BUCKETS_MS, LATENCY_OVERFLOW_KEY, LatencyHistogram
+
+
+def test_quantiles_are_bucket_bounds():
+    histogram = LatencyHistogram()
+    for ms in [10] * 50 + [80] * 45 + [4000] * 5:
+        histogram.observe(ms)
+    assert histogram.quantile(0.50) == 25
+    assert histogram.quantile(0.95) == 100
+    assert histogram.quantile(0.99) == 5000
+
+
+def test_slow_observations_stay_finite():
+    histogram = LatencyHistogram()
+    for ms in [15_000, 45_000, 90_000]:
+        histogram.observe(ms)
+    assert histogram.quantile(0.99) == 120_000
+    histogram.observe(500_000)
+    stats = histogram.stats()
+    # allow_nan=False is what JSONResponse uses
+    json.dumps(stats, allow_nan=False)
+    assert stats["p99_ms"] is None
+    assert stats["max_ms"] == 500_000
+    assert stats["buckets"] == {"30000": 1, "60000": 1, "120000": 1, LATENCY_OVERFLOW_KEY: 1}
+    assert LATENCY_BUCKETS_MS[-1] == 120_000
+
+
+def test_empty_histogram():
+    stats = LatencyHistogram().stats()
+    json.dumps(stats, allow_nan=False)
+    assert stats["count"] == 0 and stats["p50_ms"] == 0.0
@@ -0,0 +1,33 @@
+"""PolygonClient retries"""
+
+import asyncio
+import time
+
+import httpx
+import pytest
+
+import custom_mcp_server as server
+
+
+def test_transport_retry_backoff_does_not_hold_a_concurrency_slot():
+    client = server.PolygonClient(max_retries=2, max_concurrency=1)
+    client.backoff = lambda attempt: 0.3
+
+    async def get(url, params=None):
+        if url.endswith("/down"):
+            raise httpx.ConnectError("down")
+        return httpx.Response(200, json={}, request=httpx.Request("GET", url))
+
+    client.http.get = get
+
+    async def run():
+        down = asyncio.create_task(client.get("https://polygon.test/down"))
+        await asyncio.sleep(0.05)  # the first attempt failed and is backing off
+        started = time.monotonic()
+        await client.get("https://polygon.test/ok")
+        assert time.monotonic() - started < 0.2
+        with pytest.raises(httpx.ConnectError):
+            await down
+        assert client.counters["retries"] == 2 and client.counters["failures"] == 1
+
+    asyncio.run(run())
@@ -0,0 +1,39 @@
+"""Response cache keys"""
+
+import asyncio
+
+import httpx
+
+import custom_mcp_server as server
+
+
+def test_default_adjusted_shares_a_key():
+    key = server.ResponseCache.make_key
+    prev = "/v2/aggs/ticker/AAPL/prev"
+    assert key(prev, {}) == key(prev, {"adjusted": "true"}) == key(prev, {"adjusted": True})
+    assert key(prev, {"adjusted": "false"}) != key(prev, {})
+    assert key(prev, {"apiKey": "secret"}) == key(prev, {})
+
+
+def test_prefetched_prev_close_serves_the_tools(monkeypatch):
+    requests = []
+
+    async def get(url, params=None):
+        requests.append(url)
+        return httpx.Response(200, json={"results": [{"o": 1, "h": 2, "l": 0.5, "c": 1.5, "v": 10, "t": 0}]},
+                              request=httpx.Request("GET", url))
+
+    monkeypatch.setattr(server.polygon_client, "get", get)
+    server.response_cache.clear()
+
+    async def run():
+        # What Prefetcher._warm_direct and the fast path fetch
+        await server.call_polygon_api("/v2/aggs/ticker/AAPL/prev")
+        await server.call_tool("get_previous_close", {"ticker": "AAPL"})
+        await server.call_tool("get_previous_close_batch", {"tickers": ["AAPL"]})
+
+    try:
+        asyncio.run(run())
+    finally:
+        server.response_cache.clear()
+    assert len(requests) == 1
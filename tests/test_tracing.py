@@ -0,0 +1,49 @@
+"""Tracer metrics stay serializable and the span sink writes off the caller's thread"""
+
+import json
+import os
+
+from tracing import Tracer
+
+
+def read_spans(path):
+    with open(path) as f:
+        return [json.loads(line) for line in f]
+
+
+def test_metrics_are_json_compliant_for_slow_spans():
+    tracer = Tracer()
+    tracer.observe("query", 200.0)
+    tracer.observe("query", 10 * 60 * 1000.0)  # a ten-minute outlier
+    tracer.record("polygon_http", 0, 15_000 * 10**6)
+    metrics = json.loads(json.dumps(tracer.metrics(), allow_nan=False))
+    assert metrics["query"]["count"] == 2
+    assert metrics["query"]["p99_ms"] is None
+    assert metrics["polygon_http"]["p50_ms"] == 30000
+
+
+def test_sink_is_opt_in():
+    tracer = Tracer()
+    with tracer.span("query"):
+        pass
+    assert tracer.writer is None and tracer.buffer == []
+
+
+def test_sink_writes_traces_and_rotates(tmp_path):
+    path = str(tmp_path / "traces.jsonl")
+    # 40 spans are about 11 kB: one rotation
+    tracer = Tracer(sink_path=path, max_bytes=6000)
+    for i in range(20):
+        with tracer.span("query", n=i):
+            with tracer.span("tool_call", tool="get_snapshot"):
+                pass
+    tracer.close()
+    spans = read_spans(path + ".1") + (read_spans(path) if os.path.exists(path) else [])
+    assert len(spans) == 40
+    assert os.path.getsize(path + ".1") >= 6000
+    roots = [s for s in spans if s["name"] == "query"]
+    assert [s["attributes"]["n"] for s in roots] == list(range(20))
+    # Spans finished after close are only counted in the metrics
+    with tracer.span("query"):
+        pass
+    assert tracer.metrics()["query"]["count"] == 21
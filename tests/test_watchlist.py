@@ -0,0 +1,89 @@
+"""Watchlist subscriptions and pushes"""
+
+import asyncio
+import time
+
+import pytest
+
+import custom_mcp_server
+import watchlist
+from watchlist import WatchlistPoller
+
+
+def test_rejected_subscribe_leaves_no_subscriber():
+    async def run():
+        poller = WatchlistPoller(max_tickers=2)
+
+        async def send(message):
+            pass
+
+        with pytest.raises(ValueError):
+            poller.subscribe("a", ["AAPL", "MSFT", "NVDA"], send)
+        assert poller.subscribers == {} and poller.task is None
+        poller.subscribe("a", ["AAPL"], send)
+        with pytest.raises(ValueError):
+            poller.subscribe("a", ["MSFT", "NVDA"], send)
+        assert poller.watched() == ["AAPL"]
+        await poller.stop()
+    asyncio.run(run())
+
+
+def test_stalled_subscriber_is_dropped_without_holding_up_the_poll(monkeypatch):
+    monkeypatch.setattr(watchlist, "SEND_TIMEOUT", 0.1)
+
+    async def batch_stock_prices(tickers):
+        return {"results": {t: {"price": 100.0} for t in tickers}}
+
+    monkeypatch.setattr(custom_mcp_server, "batch_stock_prices", batch_stock_prices)
+
+    async def run():
+        poller = WatchlistPoller(interval=3600)
+        received = []
+
+        async def stalled(message):
+            await asyncio.sleep(3600)
+
+        async def healthy(message):
+            received.append(message)
+
+        poller.subscribers["stalled"] = watchlist._Subscriber(stalled)
+        poller.subscribers["stalled"].tickers.add("AAPL")
+        poller.subscribers["healthy"] = watchlist._Subscriber(healthy)
+        poller.subscribers["healthy"].tickers.add("AAPL")
+        started = time.monotonic()
+        await poller.poll()
+        assert time.monotonic() - started < 1.0
+        assert received == [{"type": "quotes", "quotes": {"AAPL": {"price": 100.0}}}]
+        assert list(poller.subscribers) == ["healthy"]
+    asyncio.run(run())
+
+
+def test_prev_close_fallback_is_pushed_as_quotes_and_counted(monkeypatch):
+    import httpx
+
+    async def call_polygon_api(endpoint, params=None):
+        if "/snapshot/" in endpoint:
+            request = httpx.Request("GET", "https://polygon.test" + endpoint)
+            raise httpx.HTTPStatusError("403", request=request, response=httpx.Response(403, request=request))
+        return {"results": [{"o": 1.0, "h": 2.0, "l": 0.5, "c": 1.5, "v": 1000, "t": 1_700_000_000_000}]}
+
+    monkeypatch.setattr(custom_mcp_server, "call_polygon_api", call_polygon_api)
+    spent = []
+
+    async def run():
+        poller = WatchlistPoller(interval=3600, on_calls=spent.append)
+        received = []
+
+        async def send(message):
+            received.append(message)
+
+        poller.subscribers["a"] = watchlist._Subscriber(send)
+        poller.subscribers["a"].tickers.update(["AAPL", "MSFT"])
+        await poller.poll()
+        return poller, received
+
+    poller, received = asyncio.run(run())
+    assert received[0]["quotes"]["AAPL"]["price"] == 1.5
+    assert received[0]["quotes"]["MSFT"]["volume"] == 1000
+    # The failed snapshot call plus one /prev call per ticker
+    assert spent == [3] and poller.upstream_calls == 3
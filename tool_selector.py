@@ -0,0 +1,133 @@
+"""
+Per-query tool subsetting to shrink the tool-schema part of the prompt.
+
+A keyword pre-classifier maps the query to tool categories, and only tools
+whose names match those categories are exposed to the model for that run.
+Matching is on tool-name fragments, so it works for both the custom server
+and the full mcp_polygon toolset. When nothing matches, or when the model
+asks for a tool it was not shown, the run falls back to the full tool set
+(or, for a strict selection, stops so the query can be escalated).
+"""
+
+import re
+from dataclasses import dataclass, field
+
+from pydantic_ai import RunContext
+from pydantic_ai.messages import ModelRequest, RetryPromptPart, UserPromptPart
+from pydantic_ai.tools import ToolDefinition
+
+# category -> (query keywords, tool-name fragments)
+TOOL_CATEGORIES = {
+    "price": (
+        {"price", "prices", "quote", "trading", "worth", "cost", "bid", "ask", "now", "current", "today"},
+        ("price", "snapshot", "last_trade", "last_quote", "prev", "previous_close", "open_close"),
+    ),
+    "history": (
+        {"history", "historical", "chart", "trend", "performance", "return", "returns", "week", "month",
+         "year", "ytd", "since", "between", "high", "low", "volume", "range", "daily", "weekly", "monthly",
+         "change", "gain", "loss", "compare", "comparison", "volatility"},
+        ("aggs", "aggregates", "open_close", "prev", "previous_close"),
+    ),
+    "news": (
+        {"news", "headline", "headlines", "sentiment", "article", "articles", "announcement", "announced"},
+        ("news",),
+    ),
+    "fundamentals": (
+        {"earnings", "revenue", "financial", "financials", "income", "balance", "cash", "eps", "margin",
+         "margins", "valuation", "profit", "debt", "fundamentals", "pe", "ratio", "ratios"},
+        ("financial", "details"),
+    ),
+    "dividends": (
+        {"dividend", "dividends", "payout", "yield", "distribution"},
+        ("dividend",),
+    ),
+    "splits": (
+        {"split", "splits"},
+        ("split",),
+    ),
+    "indicators": (
+        {"rsi", "sma", "ema", "macd", "moving", "average", "indicator", "indicators", "technical",
+         "overbought", "oversold", "momentum"},
+        ("sma", "ema", "rsi", "macd", "indicator"),
+    ),
+    "market": (
+        {"market", "open", "closed", "holiday", "holidays", "hours", "session"},
+        ("market_status", "market_holiday"),
+    ),
+    "reference": (
+        {"company", "about", "sector", "industry", "description", "employees", "ticker", "symbol",
+         "search", "find", "ceo", "headquarters", "exchange", "cap", "capitalization"},
+        ("details", "search", "tickers", "ticker_type", "related"),
+    ),
+    "movers": (
+        {"movers", "gainers", "losers", "top", "biggest", "best", "worst", "all"},
+        ("snapshot", "gainers", "losers"),
+    ),
+}
+
+# Useful for almost any query and cheap to describe
+ALWAYS_INCLUDED = ("market_status",)
+
+
+class HiddenToolRequested(Exception):
+    """A strict run's model asked for a tool outside its selection"""
+
+
+@dataclass
+class ToolSelection:
+    """Tool categories exposed for one agent run (passed to the run as deps)"""
+
+    categories: frozenset = frozenset()
+    full: bool = False
+    strict: bool = False
+    fragments: tuple = field(init=False)
+
+    def __post_init__(self):
+        fragments = [f for c in self.categories for f in TOOL_CATEGORIES[c][1]]
+        self.fragments = tuple(fragments) + ALWAYS_INCLUDED
+
+    def allows(self, tool_name: str) -> bool:
+        if self.full:
+            return True
+        return any(fragment in tool_name for fragment in self.fragments)
+
+    def describe(self) -> str:
+        return "all tools" if self.full else ", ".join(sorted(self.categories))
+
+
+def select_tools(query: str) -> ToolSelection:
+    """Pick tool categories for a query; the full set when no category clearly applies"""
+    words = set(re.findall(r"[a-z]+", query.lower()))
+    categories = {name for name, (keywords, _) in TOOL_CATEGORIES.items() if words & keywords}
+    if not categories:
+        return ToolSelection(full=True)
+    # Prices are the most common follow-up need of every other category
+    categories.add("price")
+    return ToolSelection(categories=frozenset(categories))
+
+
+def asked_for_hidden_tool(messages) -> bool:
+    """True if the model tried to call a tool it was not shown during the current turn"""
+    for message in reversed(messages):
+        if not isinstance(message, ModelRequest):
+            continue
+        for part in message.parts:
+            if isinstance(part, RetryPromptPart) and "Unknown tool name" in part.model_response():
+                return True
+        if any(isinstance(part, UserPromptPart) for part in message.parts):
+            return False
+    return False
+
+
+def tool_filter(ctx: RunContext, tool_def: ToolDefinition) -> bool:
+    """FilteredToolset filter: apply the run's ToolSelection, widening it on a retry"""
+    selection = ctx.deps
+    if not isinstance(selection, ToolSelection) or selection.full:
+        return True
+    if asked_for_hidden_tool(ctx.messages):
+        if selection.strict:
+            raise HiddenToolRequested(tool_def.name)
+        print("[Tools] Model asked for a hidden tool; exposing all tools")
+        selection.full = True
+        return True
+    return selection.allows(tool_def.name)
@@ -0,0 +1,37 @@
+"""
+Model wrapper that traces every model request.
+
+Lives apart from tracing.py because it subclasses a pydantic_ai class, and
+the tracer itself must be importable before pydantic_ai is loaded.
+"""
+
+from contextlib import asynccontextmanager
+from typing import Any
+
+from pydantic_ai.models.wrapper import WrapperModel
+
+from tracing import Tracer
+
+
+class TracedModel(WrapperModel):
+    """Wraps a model so each request is a span carrying its token usage"""
+
+    def __init__(self, wrapped, tracer: Tracer):
+        super().__init__(wrapped)
+        self.tracer = tracer
+
+    async def request(self, *args: Any, **kwargs: Any):
+        with self.tracer.span("model_request", model=self.model_name) as span:
+            response = await self.wrapped.request(*args, **kwargs)
+            span.set(input_tokens=response.usage.input_tokens, output_tokens=response.usage.output_tokens)
+            return response
+
+    @asynccontextmanager
+    async def request_stream(self, messages, model_settings, model_request_parameters, run_context=None):
+        with self.tracer.span("model_request", model=self.model_name, streamed=True) as span:
+            async with self.wrapped.request_stream(
+                messages, model_settings, model_request_parameters, run_context
+            ) as response_stream:
+                yield response_stream
+            usage = response_stream.usage()
+            span.set(input_tokens=usage.input_tokens, output_tokens=usage.output_tokens)
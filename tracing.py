@@ -0,0 +1,207 @@
+"""
+Per-query tracing and latency metrics.
+
+Spans nest through a context variable, so work done in tasks spawned by the
+agent (model requests, tool calls) is attributed to the query that started
+it. Every span's duration feeds a per-name latency histogram served by
+/metrics. Optionally, finished spans are also appended to a JSONL file using
+OpenTelemetry's span field names (trace_id, span_id, parent_span_id,
+start/end time in unix nanoseconds, attributes); the file is written by a
+background thread and rotated once it reaches max_bytes. Model requests are traced by
+traced_model.TracedModel, kept separate so this module stays cheap to import.
+"""
+
+import json
+import os
+import queue
+import secrets
+import threading
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Any
+
+current_span: ContextVar["Span | None"] = ContextVar("current_span", default=None)
+
+# Latency histogram bucket upper bounds in milliseconds; slower observations are counted
+# in an overflow bucket (stats must stay finite to be served as JSON)
+LATENCY_BUCKETS_MS = (25, 50, 100, 250, 500, 1000, 2500, 5000, 10000, 30000, 60000, 120000)
+LATENCY_OVERFLOW_KEY = f">{LATENCY_BUCKETS_MS[-1]}"
+
+
+class LatencyHistogram:
+    """Fixed-bucket latency histogram with approximate quantiles"""
+
+    def __init__(self):
+        self.counts = [0] * len(LATENCY_BUCKETS_MS)
+        self.overflow = 0
+        self.total = 0
+        self.sum_ms = 0.0
+        self.max_ms = 0.0
+
+    def observe(self, ms: float):
+        for i, bound in enumerate(LATENCY_BUCKETS_MS):
+            if ms <= bound:
+                self.counts[i] += 1
+                break
+        else:
+            self.overflow += 1
+        self.total += 1
+        self.sum_ms += ms
+        self.max_ms = max(self.max_ms, ms)
+
+    def quantile(self, q: float) -> float | None:
+        """Upper bound of the bucket holding the q-th observation; None if it is above the last bucket"""
+        rank, seen = q * self.total, 0
+        for bound, count in zip(LATENCY_BUCKETS_MS, self.counts):
+            seen += count
+            if seen >= rank and count:
+                return bound
+        return None if self.overflow else 0.0
+
+    def stats(self) -> dict:
+        buckets = {str(b): c for b, c in zip(LATENCY_BUCKETS_MS, self.counts) if c}
+        if self.overflow:
+            buckets[LATENCY_OVERFLOW_KEY] = self.overflow
+        return {
+            "count": self.total,
+            "mean_ms": round(self.sum_ms / self.total, 1) if self.total else 0.0,
+            "max_ms": round(self.max_ms, 1),
+            "p50_ms": self.quantile(0.50),
+            "p95_ms": self.quantile(0.95),
+            "p99_ms": self.quantile(0.99),
+            "buckets": buckets,
+        }
+
+
+class Span:
+    """One timed operation within a trace"""
+
+    def __init__(self, name: str, trace_id: str, parent_id: str | None, attributes: dict):
+        self.name = name
+        self.trace_id = trace_id
+        self.span_id = secrets.token_hex(8)
+        self.parent_id = parent_id
+        self.attributes = attributes
+        self.start_ns = time.time_ns()
+        self.end_ns = None
+
+    def set(self, **attributes: Any):
+        self.attributes.update(attributes)
+
+    def add(self, **amounts: float):
+        """Accumulate numeric attributes (e.g. bytes sent over many messages)"""
+        for key, amount in amounts.items():
+            self.attributes[key] = self.attributes.get(key, 0) + amount
+
+    @property
+    def duration_ms(self) -> float:
+        return ((self.end_ns or time.time_ns()) - self.start_ns) / 1e6
+
+    def to_record(self) -> dict:
+        return {
+            "name": self.name,
+            "trace_id": self.trace_id,
+            "span_id": self.span_id,
+            "parent_span_id": self.parent_id,
+            "start_time_unix_nano": self.start_ns,
+            "end_time_unix_nano": self.end_ns,
+            "duration_ms": round(self.duration_ms, 3),
+            "attributes": {k: round(v, 3) if isinstance(v, float) else v for k, v in self.attributes.items()},
+        }
+
+
+class Tracer:
+    """Creates spans, writes them to a JSONL sink and keeps latency histograms"""
+
+    def __init__(self, sink_path: str = None, flush_every: int = 50, max_bytes: int = 50_000_000):
+        self.sink_path = sink_path
+        self.flush_every = flush_every
+        self.max_bytes = max_bytes  # rotate the sink to <sink_path>.1 at this size (0: never)
+        self.histograms = {}
+        self.buffer = []
+        self.lock = threading.Lock()
+        self.writes = queue.SimpleQueue()
+        self.writer = None
+        if sink_path:
+            os.makedirs(os.path.dirname(sink_path) or ".", exist_ok=True)
+            # File I/O happens on this thread, never on the event loop
+            self.writer = threading.Thread(target=self._write_loop, name="trace-writer", daemon=True)
+            self.writer.start()
+
+    @contextmanager
+    def span(self, name: str, **attributes: Any):
+        parent = current_span.get()
+        span = Span(name, parent.trace_id if parent else secrets.token_hex(16),
+                    parent.span_id if parent else None, attributes)
+        token = current_span.set(span)
+        try:
+            yield span
+        except BaseException as e:
+            span.set(error=type(e).__name__)
+            raise
+        finally:
+            current_span.reset(token)
+            span.end_ns = time.time_ns()
+            self._finish(span)
+
+    def record(self, name: str, start_ns: int, end_ns: int, **attributes: Any):
+        """Add an already-finished span under the current span (for callbacks timed elsewhere)"""
+        parent = current_span.get()
+        span = Span(name, parent.trace_id if parent else secrets.token_hex(16),
+                    parent.span_id if parent else None, attributes)
+        span.start_ns, span.end_ns = start_ns, end_ns
+        self._finish(span)
+
+    def observe(self, name: str, ms: float):
+        """Record a latency without creating a span (for very frequent operations)"""
+        with self.lock:
+            histogram = self.histograms.get(name)
+            if histogram is None:
+                histogram = self.histograms[name] = LatencyHistogram()
+            histogram.observe(ms)
+
+    def _finish(self, span: Span):
+        self.observe(span.name, span.duration_ms)
+        if self.writer is None:
+            return
+        with self.lock:
+            self.buffer.append(span.to_record())
+            # Flush whole traces when their root ends, or when the buffer grows
+            if span.parent_id is None or len(self.buffer) >= self.flush_every:
+                self._flush()
+
+    def _flush(self):
+        lines = "".join(json.dumps(record, default=str) + "\n" for record in self.buffer)
+        self.buffer.clear()
+        self.writes.put(lines)
+
+    def _write_loop(self):
+        while True:
+            lines = self.writes.get()
+            if lines is None:
+                return
+            try:
+                with open(self.sink_path, "a") as f:
+                    f.write(lines)
+                    size = f.tell()
+                if self.max_bytes and size >= self.max_bytes:
+                    # Keep a single rotated file, so the sink never uses much more than 2 * max_bytes
+                    os.replace(self.sink_path, self.sink_path + ".1")
+            except OSError as e:
+                print(f"[Tracing] Failed to write spans: {e}")
+
+    def close(self):
+        """Write out buffered spans and stop the writer thread"""
+        with self.lock:
+            writer, self.writer = self.writer, None
+            if writer is None:
+                return
+            if self.buffer:
+                self._flush()
+            self.writes.put(None)
+        writer.join(timeout=5.0)
+
+    def metrics(self) -> dict:
+        with self.lock:
+            return {name: h.stats() for name, h in sorted(self.histograms.items())}
@@ -0,0 +1,248 @@
+"""
+Shared watchlist polling with pushed quote deltas.
+
+Sessions subscribe to tickers over the WebSocket. One WatchlistPoller per
+worker takes the union of every session's tickers and fetches them with a
+single batched snapshot call per interval (one per 50 tickers), however many
+sessions are watching, and sends each session only the quotes that changed
+since the previous poll. No model is involved. The poll loop runs only while
+someone is subscribed, and slows down while the market is closed.
+"""
+
+import asyncio
+import re
+import time
+
+# Fields of a compact snapshot quote whose change is worth pushing
+QUOTE_FIELDS = ("price", "change", "change_pct", "volume")
+# Subscribing to tickers that have no quote yet polls early, but never more often than this
+MIN_POLL_GAP = 2.0
+# A subscriber whose socket takes longer than this to accept a push is dropped
+SEND_TIMEOUT = 5.0
+TICKER_PATTERN = re.compile(r"^[A-Z][A-Z0-9.\-]{0,9}$")
+
+
+def normalize_tickers(value) -> list[str]:
+    """Uppercased, deduplicated tickers from a list or comma-separated string; raises ValueError on junk"""
+    if isinstance(value, str):
+        value = value.split(",")
+    if not isinstance(value, list):
+        raise ValueError("tickers must be a list or a comma-separated string")
+    tickers = []
+    for ticker in value:
+        ticker = str(ticker).strip().lstrip("$").upper()
+        if not TICKER_PATTERN.match(ticker):
+            raise ValueError(f"Invalid ticker: {ticker[:12]!r}")
+        if ticker not in tickers:
+            tickers.append(ticker)
+    return tickers
+
+
+def watch_quote(quote: dict) -> dict:
+    """A batch_stock_prices result as a compact snapshot quote.
+
+    Without snapshot access the batch falls back to previous-close bars (o/h/l/c/v/t);
+    their close is the latest known price and there is no intraday change.
+    """
+    if "price" in quote:
+        return quote
+    return {
+        "price": quote.get("c"),
+        "change": None,
+        "change_pct": None,
+        "prev_close": quote.get("c"),
+        "volume": quote.get("v"),
+        "updated": quote.get("t"),
+    }
+
+
+class _Subscriber:
+    __slots__ = ("tickers", "send")
+
+    def __init__(self, send):
+        self.tickers = set()
+        self.send = send  # async send(message dict)
+
+
+class WatchlistPoller:
+    """One batched snapshot poll per interval for every subscribed ticker, pushing changed quotes"""
+
+    def __init__(self, interval: float = 15.0, closed_interval: float = 300.0, max_tickers: int = 20,
+                 market_state=None, on_calls=None, tracer=None):
+        self.interval = interval                # seconds between polls while the market is open
+        self.closed_interval = closed_interval  # ... and while it is closed
+        self.max_tickers = max_tickers          # per subscriber
+        self.market_state = market_state        # () -> "open" / "extended-hours" / "closed" / None
+        self.on_calls = on_calls                # Reports Polygon calls spent (e.g. to the rate limiter)
+        self.tracer = tracer
+        self.subscribers = {}  # key -> _Subscriber
+        self.quotes = {}       # ticker -> last compact quote
+        self.errors = {}       # ticker -> last error
+        self.wake = asyncio.Event()
+        self.task = None
+        self.polls = 0
+        self.upstream_calls = 0
+        self.pushes = 0
+        self.quotes_pushed = 0
+        self.last_poll = None
+        self.last_poll_ms = None
+
+    # ------------- Subscriptions -------------
+    def watched(self) -> list[str]:
+        """Union of every subscriber's tickers"""
+        return sorted(set().union(*(s.tickers for s in self.subscribers.values())))
+
+    def subscribe(self, key, tickers, send) -> dict:
+        """Add tickers to a subscriber's watchlist; returns the watchlist message to send it"""
+        tickers = normalize_tickers(tickers)
+        subscriber = self.subscribers.get(key)
+        current = subscriber.tickers if subscriber is not None else set()
+        if len(current | set(tickers)) > self.max_tickers:
+            raise ValueError(f"At most {self.max_tickers} tickers per watchlist")
+        if subscriber is None:
+            subscriber = self.subscribers[key] = _Subscriber(send)
+        subscriber.tickers.update(tickers)
+        if any(t not in self.quotes and t not in self.errors for t in tickers):
+            self.wake.set()
+        if self.task is None or self.task.done():
+            self.task = asyncio.create_task(self._loop())
+        return self.snapshot(subscriber)
+
+    def unsubscribe(self, key, tickers=None) -> dict | None:
+        """Remove some tickers, or the whole subscriber when tickers is None"""
+        subscriber = self.subscribers.get(key)
+        if subscriber is None:
+            return None
+        if tickers is None:
+            del self.subscribers[key]
+            return None
+        subscriber.tickers.difference_update(normalize_tickers(tickers))
+        message = self.snapshot(subscriber)
+        if not subscriber.tickers:
+            del self.subscribers[key]
+        self._forget_unwatched()
+        return message
+
+    def snapshot(self, subscriber: _Subscriber) -> dict:
+        """The subscriber's tickers with every quote known so far"""
+        tickers = sorted(subscriber.tickers)
+        message = {
+            "type": "watchlist",
+            "tickers": tickers,
+            "quotes": {t: self.quotes[t] for t in tickers if t in self.quotes},
+        }
+        errors = {t: self.errors[t] for t in tickers if t in self.errors}
+        if errors:
+            message["errors"] = errors
+        return message
+
+    def _forget_unwatched(self):
+        watched = set(self.watched())
+        for table in (self.quotes, self.errors):
+            for ticker in [t for t in table if t not in watched]:
+                del table[ticker]
+
+    # ------------- Polling -------------
+    def current_interval(self) -> float:
+        market = self.market_state() if self.market_state else None
+        return self.closed_interval if market == "closed" else self.interval
+
+    async def poll(self):
+        """Fetch every watched ticker in batches and push what changed"""
+        # Imported where used so importing this module (and the app) stays cheap
+        import custom_mcp_server
+        tickers = self.watched()
+        if not tickers:
+            return
+        started = time.perf_counter()
+        changed, new_errors = {}, {}
+        batches = [tickers[i:i + custom_mcp_server.BATCH_MAX_TICKERS]
+                   for i in range(0, len(tickers), custom_mcp_server.BATCH_MAX_TICKERS)]
+        results = await asyncio.gather(*(custom_mcp_server.batch_stock_prices(b) for b in batches),
+                                       return_exceptions=True)
+        # One snapshot call per batch, plus one /prev call per ticker when a batch fell back
+        calls = sum(1 + len(batch) if isinstance(result, dict) and result.get("source") == "prev_close" else 1
+                    for batch, result in zip(batches, results))
+        self.upstream_calls += calls
+        if self.on_calls:
+            self.on_calls(calls)
+        for result in results:
+            if isinstance(result, Exception):
+                print(f"[Watchlist] Poll failed: {custom_mcp_server.describe_error(result)}")
+                continue
+            for ticker, quote in result.get("results", {}).items():
+                quote = watch_quote(quote)
+                self.errors.pop(ticker, None)
+                previous = self.quotes.get(ticker)
+                if previous is None or any(previous.get(f) != quote.get(f) for f in QUOTE_FIELDS):
+                    self.quotes[ticker] = quote
+                    changed[ticker] = quote
+            for ticker, error in result.get("errors", {}).items():
+                if self.errors.get(ticker) != error:
+                    self.errors[ticker] = new_errors[ticker] = error
+        self.polls += 1
+        self.last_poll = time.time()
+        self.last_poll_ms = round((time.perf_counter() - started) * 1000, 1)
+        if changed or new_errors:
+            await self._push(changed, new_errors)
+
+    async def _push(self, changed: dict, errors: dict):
+        async def push(key, subscriber):
+            message = {"type": "quotes", "quotes": {t: changed[t] for t in subscriber.tickers if t in changed}}
+            ticker_errors = {t: errors[t] for t in subscriber.tickers if t in errors}
+            if ticker_errors:
+                message["errors"] = ticker_errors
+            if not message["quotes"] and not ticker_errors:
+                return
+            try:
+                # One stalled socket must not hold up the next poll for everyone
+                await asyncio.wait_for(subscriber.send(message), timeout=SEND_TIMEOUT)
+            except Exception as e:
+                # The connection is gone or stuck; its session cleanup may not have run yet
+                print(f"[Watchlist] Dropping subscriber {key}: {type(e).__name__}")
+                self.subscribers.pop(key, None)
+                return
+            self.pushes += 1
+            self.quotes_pushed += len(message["quotes"])
+
+        await asyncio.gather(*(push(key, s) for key, s in list(self.subscribers.items())))
+
+    async def _loop(self):
+        import custom_mcp_server
+        while self.subscribers:
+            self.wake.clear()
+            try:
+                if self.tracer is not None:
+                    with self.tracer.span("watchlist_poll", tickers=len(self.watched()),
+                                          subscribers=len(self.subscribers)):
+                        await self.poll()
+                else:
+                    await self.poll()
+            except Exception as e:
+                print(f"[Watchlist] Poll failed: {custom_mcp_server.describe_error(e)}")
+            try:
+                await asyncio.wait_for(self.wake.wait(), timeout=self.current_interval())
+                # New tickers to quote: poll early, but not in a tight loop
+                await asyncio.sleep(max(0.0, MIN_POLL_GAP - (time.time() - (self.last_poll or 0))))
+            except asyncio.TimeoutError:
+                pass
+        self._forget_unwatched()
+
+    async def stop(self):
+        if self.task is not None:
+            self.task.cancel()
+            self.task = None
+
+    def stats(self) -> dict:
+        return {
+            "interval": self.current_interval(),
+            "subscribers": len(self.subscribers),
+            "tickers": self.watched(),
+            "polls": self.polls,
+            "upstream_calls": self.upstream_calls,
+            "pushes": self.pushes,
+            "quotes_pushed": self.quotes_pushed,
+            "last_poll": self.last_poll,
+            "last_poll_ms": self.last_poll_ms,
+            "running": self.task is not None and not self.task.done(),
+        }